@@ -1,5 +1,33 @@
-from db import get_connection
-from datetime import datetime
+import sqlite3
+from db import get_connection, transaction
+from contextlib import contextmanager
+from datetime import date, datetime
+
+# Take a new balance snapshot once this many movements have been appended
+# since the last one (see StockDB.snapshot_if_due).
+SNAPSHOT_EVERY_MOVEMENTS = 5000
+
+# Local-time ISO timestamp to the millisecond, as written by the ledger triggers
+_LEDGER_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+
+
+def _normalized_expiry_sql(column):
+    """
+    SQL for a free-form expiry date as YYYY-MM-DD, or NULL.
+    Accepts YYYY-MM-DD and YYYY/MM/DD (optionally followed by a time) and
+    day-first DD/MM/YYYY, DD-MM-YYYY or DD.MM.YYYY. Deterministic, so it can
+    back a generated column and an index.
+    """
+    value = f"trim({column})"
+    day_first = f"replace(replace({value}, '.', '/'), '-', '/')"
+    return f"""CASE
+        WHEN {value} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+            THEN date(substr({value}, 1, 10))
+        WHEN {value} GLOB '[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]*'
+            THEN date(replace(substr({value}, 1, 10), '/', '-'))
+        WHEN {day_first} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*'
+            THEN date(substr({day_first}, 7, 4) || '-' || substr({day_first}, 4, 2) || '-' || substr({day_first}, 1, 2))
+    END"""
 
 class StockDB:
     @staticmethod
@@ -47,21 +75,170 @@ class StockDB:
         conn.commit()
         conn.close()
 
+    @staticmethod
+    def init_stock_totals(conn):
+        """
+        Create the materialized availability totals and the triggers that keep them current.
+        stock_totals holds SUM(stock.quantity) per ingredient_id, and
+        stock_metadata_totals the same per ingredients.metadata_id, so availability
+        is a primary-key lookup instead of a scan over every batch.
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_totals (
+                ingredient_id INTEGER PRIMARY KEY,
+                quantity REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_metadata_totals (
+                metadata_id INTEGER PRIMARY KEY,
+                quantity REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        # Add/subtract one stock row's quantity to both totals
+        add = '''
+            INSERT INTO stock_totals (ingredient_id, quantity) VALUES ({row}.ingredient_id, {sign}{row}.quantity)
+            ON CONFLICT(ingredient_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+            INSERT INTO stock_metadata_totals (metadata_id, quantity)
+            SELECT metadata_id, {sign}{row}.quantity FROM ingredients WHERE id = {row}.ingredient_id
+            ON CONFLICT(metadata_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+        '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_stock_totals_insert AFTER INSERT ON stock
+            BEGIN {add.format(row="NEW", sign="")} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_stock_totals_delete AFTER DELETE ON stock
+            BEGIN {add.format(row="OLD", sign="-")} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_stock_totals_update
+            AFTER UPDATE OF quantity, ingredient_id ON stock
+            BEGIN {add.format(row="OLD", sign="-")} {add.format(row="NEW", sign="")} END
+        ''')
+        # An ingredient moving to another tag takes its stock with it
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stock_totals_retag
+            AFTER UPDATE OF metadata_id ON ingredients
+            WHEN OLD.metadata_id IS NOT NEW.metadata_id
+            BEGIN
+                UPDATE stock_metadata_totals
+                SET quantity = quantity - COALESCE((SELECT quantity FROM stock_totals WHERE ingredient_id = NEW.id), 0)
+                WHERE metadata_id = OLD.metadata_id;
+                INSERT INTO stock_metadata_totals (metadata_id, quantity)
+                VALUES (NEW.metadata_id, COALESCE((SELECT quantity FROM stock_totals WHERE ingredient_id = NEW.id), 0))
+                ON CONFLICT(metadata_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+            END
+        ''')
+        # Stock of a deleted ingredient no longer counts towards its tag
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stock_totals_ingredient_delete
+            AFTER DELETE ON ingredients
+            BEGIN
+                UPDATE stock_metadata_totals
+                SET quantity = quantity - COALESCE((SELECT quantity FROM stock_totals WHERE ingredient_id = OLD.id), 0)
+                WHERE metadata_id = OLD.metadata_id;
+            END
+        ''')
+        StockDB.rebuild_totals()
+        conn.commit()
+
+    @staticmethod
+    def rebuild_totals():
+        """Recompute both totals tables from the stock table (recovery; also run by the migration)."""
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM stock_totals")
+            cur.execute("DELETE FROM stock_metadata_totals")
+            cur.execute('''
+                INSERT INTO stock_totals (ingredient_id, quantity)
+                SELECT ingredient_id, SUM(quantity) FROM stock GROUP BY ingredient_id
+            ''')
+            cur.execute('''
+                INSERT INTO stock_metadata_totals (metadata_id, quantity)
+                SELECT i.metadata_id, SUM(s.quantity)
+                FROM stock s
+                JOIN ingredients i ON i.id = s.ingredient_id
+                GROUP BY i.metadata_id
+            ''')
+
+    @staticmethod
+    def verify_totals(tolerance=1e-6):
+        """
+        Compare the materialized totals with a fresh aggregate over stock.
+        Returns a list of (kind, key, stored, actual) for every mismatch; empty means consistent.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT 'ingredient', a.ingredient_id, COALESCE(t.quantity, 0), a.qty
+            FROM (SELECT ingredient_id, SUM(quantity) AS qty FROM stock GROUP BY ingredient_id) a
+            LEFT JOIN stock_totals t ON t.ingredient_id = a.ingredient_id
+            UNION ALL
+            SELECT 'ingredient', t.ingredient_id, t.quantity, 0
+            FROM stock_totals t
+            WHERE NOT EXISTS (SELECT 1 FROM stock s WHERE s.ingredient_id = t.ingredient_id)
+            UNION ALL
+            SELECT 'metadata', a.metadata_id, COALESCE(t.quantity, 0), a.qty
+            FROM (
+                SELECT i.metadata_id, SUM(s.quantity) AS qty
+                FROM stock s JOIN ingredients i ON i.id = s.ingredient_id
+                GROUP BY i.metadata_id
+            ) a
+            LEFT JOIN stock_metadata_totals t ON t.metadata_id = a.metadata_id
+            UNION ALL
+            SELECT 'metadata', t.metadata_id, t.quantity, 0
+            FROM stock_metadata_totals t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM stock s JOIN ingredients i ON i.id = s.ingredient_id
+                WHERE i.metadata_id = t.metadata_id
+            )
+        ''')
+        rows = cur.fetchall()
+        conn.close()
+        return [row for row in rows if abs(row[2] - row[3]) > tolerance]
+
     @staticmethod
     def get_available_stock(ingredient_id):
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT SUM(quantity) FROM stock WHERE ingredient_id=?", (ingredient_id,))
+        cur.execute("SELECT quantity FROM stock_totals WHERE ingredient_id=?", (ingredient_id,))
         row = cur.fetchone()
         conn.close()
         return row[0] if row and row[0] is not None else 0
 
+    @staticmethod
+    def get_available_stock_for_metadata(metadata_id):
+        """Available quantity of every ingredient carrying this metadata tag."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT quantity FROM stock_metadata_totals WHERE metadata_id=?", (metadata_id,))
+        row = cur.fetchone()
+        conn.close()
+        return row[0] if row and row[0] is not None else 0
+
+    @staticmethod
+    def get_available_by_metadata():
+        """Available quantity per metadata tag: {metadata_id: qty}."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT metadata_id, quantity FROM stock_metadata_totals")
+        rows = cur.fetchall()
+        conn.close()
+        return dict(rows)
+
     @staticmethod
     def update_stock(stock_id, quantity, batch_number=None, expiry_date=None):
+        """Set a batch's quantity; batch_number and expiry_date are only changed when given."""
         conn = get_connection()
         cur = conn.cursor()
         cur.execute(
-            "UPDATE stock SET quantity=?, last_updated=?, batch_number=?, expiry_date=? WHERE id=?",
+            """
+            UPDATE stock SET quantity=?, last_updated=?,
+                batch_number=COALESCE(?, batch_number), expiry_date=COALESCE(?, expiry_date)
+            WHERE id=?
+            """,
             (quantity, datetime.now().isoformat(), batch_number, expiry_date, stock_id)
         )
         conn.commit()
@@ -72,4 +249,322 @@ class StockDB:
         conn = get_connection()
         cur = conn.cursor()
         cur.execute("DELETE FROM stock WHERE id=?", (stock_id,))
-        conn.commit()
\ No newline at end of file
+        conn.commit()
+
+    # ------------------ Expiry ------------------
+    @staticmethod
+    def init_expiry_column(conn):
+        """
+        Add stock.expiry_on, expiry_date normalised to an ISO date (NULL when absent or
+        unparseable), and a partial index over the batches that still hold stock.
+        On SQLite 3.31+ it is a virtual generated column; older builds get a plain
+        column kept in step by triggers.
+        """
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(stock)")
+        if "expiry_on" not in [row[1] for row in cursor.fetchall()]:
+            if sqlite3.sqlite_version_info >= (3, 31, 0):
+                cursor.execute(
+                    f"ALTER TABLE stock ADD COLUMN expiry_on TEXT "
+                    f"GENERATED ALWAYS AS ({_normalized_expiry_sql('expiry_date')}) VIRTUAL"
+                )
+            else:
+                cursor.execute("ALTER TABLE stock ADD COLUMN expiry_on TEXT")
+                cursor.execute(f"UPDATE stock SET expiry_on = {_normalized_expiry_sql('expiry_date')}")
+                for name, event in (("insert", "AFTER INSERT ON stock"),
+                                    ("update", "AFTER UPDATE OF expiry_date ON stock")):
+                    cursor.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS trg_stock_expiry_{name} {event}
+                        BEGIN
+                            UPDATE stock SET expiry_on = {_normalized_expiry_sql('NEW.expiry_date')}
+                            WHERE id = NEW.id;
+                        END
+                    ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_expiry ON stock(expiry_on, ingredient_id) WHERE quantity > 0")
+        # The allocator's FEFO index now orders on the normalised date
+        cursor.execute("DROP INDEX IF EXISTS idx_stock_in_stock")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_in_stock
+            ON stock(ingredient_id, expiry_on, id)
+            WHERE quantity > 0
+        """)
+        conn.commit()
+
+    # ------------------ Movement ledger ------------------
+    @staticmethod
+    def init_stock_movements(conn):
+        """
+        Create the append-only stock_movements ledger, its balance snapshots, and the
+        triggers that append a movement for every change to stock.quantity.
+
+        Each movement records the quantity delta for one batch, with a movement_type
+        ('opening', 'purchase', 'reservation', 'release', 'adjustment') and an optional
+        reference ('purchase', 'order' or 'reservation' plus its id); the expiry sweep
+        books its write-offs as 'write_off', the reservation TTL sweep its releases
+        as 'lapsed', and the unit normalisation its rescaling as 'unit_conversion'.
+        The triggers take type and reference from stock_movement_context, which
+        StockDB.movement() sets for the duration of a write; writes outside it are
+        logged as 'adjustment'.
+        Existing stock is booked as 'opening' movements and a first snapshot is taken.
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_movements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stock_id INTEGER NOT NULL,
+                ingredient_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                movement_type TEXT NOT NULL,
+                reference_type TEXT,
+                reference_id INTEGER,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_stock ON stock_movements(stock_id)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_stock_movements_ingredient ON stock_movements(ingredient_id, id)"
+        )
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_movement_context (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                movement_type TEXT,
+                reference_type TEXT,
+                reference_id INTEGER
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO stock_movement_context (id) VALUES (1)")
+        # A snapshot is the ledger balance per ingredient up to and including movement_id
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                movement_id INTEGER NOT NULL,
+                taken_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_snapshot_balances (
+                snapshot_id INTEGER NOT NULL,
+                ingredient_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                PRIMARY KEY (snapshot_id, ingredient_id)
+            )
+        ''')
+
+        append = f'''
+            INSERT INTO stock_movements
+                (stock_id, ingredient_id, quantity, movement_type, reference_type, reference_id, created_at)
+            SELECT {{row}}.id, {{row}}.ingredient_id, {{delta}},
+                   COALESCE(c.movement_type, 'adjustment'), c.reference_type, c.reference_id, {_LEDGER_NOW}
+            FROM stock_movement_context c WHERE c.id = 1;
+        '''
+        triggers = {
+            "trg_stock_movements_insert": (
+                "AFTER INSERT ON stock",
+                append.format(row="NEW", delta="NEW.quantity"),
+            ),
+            "trg_stock_movements_delete": (
+                "AFTER DELETE ON stock",
+                append.format(row="OLD", delta="-OLD.quantity"),
+            ),
+            "trg_stock_movements_update": (
+                "AFTER UPDATE OF quantity ON stock "
+                "WHEN NEW.quantity IS NOT OLD.quantity AND NEW.ingredient_id IS OLD.ingredient_id",
+                append.format(row="NEW", delta="NEW.quantity - OLD.quantity"),
+            ),
+            # A batch booked against another ingredient leaves one and arrives at the other
+            "trg_stock_movements_move": (
+                "AFTER UPDATE OF ingredient_id ON stock WHEN NEW.ingredient_id IS NOT OLD.ingredient_id",
+                append.format(row="OLD", delta="-OLD.quantity") + append.format(row="NEW", delta="NEW.quantity"),
+            ),
+            "trg_stock_movements_no_update": (
+                "BEFORE UPDATE ON stock_movements",
+                "SELECT RAISE(ABORT, 'stock_movements is append-only');",
+            ),
+            "trg_stock_movements_no_delete": (
+                "BEFORE DELETE ON stock_movements",
+                "SELECT RAISE(ABORT, 'stock_movements is append-only');",
+            ),
+        }
+        for name, (event, body) in triggers.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+        cursor.execute("SELECT COUNT(*) FROM stock_movements")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f'''
+                INSERT INTO stock_movements (stock_id, ingredient_id, quantity, movement_type, created_at)
+                SELECT id, ingredient_id, quantity, 'opening', {_LEDGER_NOW}
+                FROM stock WHERE quantity <> 0 ORDER BY id
+            ''')
+            StockDB.take_snapshot()
+        conn.commit()
+
+    @staticmethod
+    @contextmanager
+    def movement(movement_type, reference_type=None, reference_id=None):
+        """
+        Label every stock change made inside the block, e.g.
+            with StockDB.movement("purchase", "purchase", purchase_id):
+                StockDB.add_stock(...)
+        Runs as one unit of work; the previous label is restored on exit, so blocks nest.
+        """
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT movement_type, reference_type, reference_id FROM stock_movement_context WHERE id = 1")
+            previous = cur.fetchone() or (None, None, None)
+            cur.execute(
+                "UPDATE stock_movement_context SET movement_type=?, reference_type=?, reference_id=? WHERE id = 1",
+                (movement_type, reference_type, reference_id)
+            )
+            try:
+                yield conn
+            finally:
+                cur.execute(
+                    "UPDATE stock_movement_context SET movement_type=?, reference_type=?, reference_id=? WHERE id = 1",
+                    previous
+                )
+
+    @staticmethod
+    def get_movements(stock_id=None, ingredient_id=None, since=None, until=None):
+        """Ledger rows, oldest first, optionally for one batch or ingredient and a time range."""
+        where, params = [], []
+        if stock_id is not None:
+            where.append("stock_id = ?")
+            params.append(stock_id)
+        if ingredient_id is not None:
+            where.append("ingredient_id = ?")
+            params.append(ingredient_id)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(StockDB._ledger_time(since, end_of_day=False))
+        if until is not None:
+            where.append("created_at <= ?")
+            params.append(StockDB._ledger_time(until))
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT id, stock_id, ingredient_id, quantity, movement_type, reference_type, reference_id, created_at
+            FROM stock_movements
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY id
+        ''', params)
+        rows = cur.fetchall()
+        conn.close()
+        return [
+            {
+                "ID": r[0],
+                "StockID": r[1],
+                "IngredientID": r[2],
+                "Quantity": r[3],
+                "Type": r[4],
+                "ReferenceType": r[5],
+                "ReferenceID": r[6],
+                "CreatedAt": r[7],
+            }
+            for r in rows
+        ]
+
+    @staticmethod
+    def _ledger_time(value, end_of_day=True):
+        """
+        A date, datetime or ISO string as a bound comparable with stock_movements.created_at.
+        A date, or a date-only string such as '2026-09-30', covers that whole day: the end
+        of it by default, its start with end_of_day=False.
+        """
+        if isinstance(value, str):
+            text = value.strip()
+            try:
+                value = date.fromisoformat(text) if len(text) == 10 else datetime.fromisoformat(text)
+            except ValueError:
+                raise ValueError(f"'{value}' is not an ISO date or date and time")
+        if isinstance(value, datetime):
+            return value.isoformat(timespec="milliseconds")
+        if isinstance(value, date):
+            return value.isoformat() + ("T23:59:59.999" if end_of_day else "T00:00:00.000")
+        return value
+
+    @staticmethod
+    def take_snapshot():
+        """
+        Record the ledger balance of every ingredient as of the newest movement.
+        Built from the previous snapshot plus the movements since, never a full replay.
+        Returns the new snapshot id.
+        """
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, movement_id FROM stock_snapshots ORDER BY id DESC LIMIT 1")
+            base_id, base_movement = cur.fetchone() or (None, 0)
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements")
+            movement_id = cur.fetchone()[0]
+            cur.execute(
+                f"INSERT INTO stock_snapshots (movement_id, taken_at) VALUES (?, {_LEDGER_NOW})", (movement_id,)
+            )
+            snapshot_id = cur.lastrowid
+            cur.execute('''
+                INSERT INTO stock_snapshot_balances (snapshot_id, ingredient_id, quantity)
+                SELECT ?, ingredient_id, SUM(quantity)
+                FROM (
+                    SELECT ingredient_id, quantity FROM stock_snapshot_balances WHERE snapshot_id = ?
+                    UNION ALL
+                    SELECT ingredient_id, quantity FROM stock_movements WHERE id > ? AND id <= ?
+                )
+                GROUP BY ingredient_id
+            ''', (snapshot_id, base_id, base_movement, movement_id))
+        return snapshot_id
+
+    @staticmethod
+    def snapshot_if_due(min_movements=None):
+        """Take a snapshot once min_movements have been appended since the last one; cheap to call on a timer."""
+        min_movements = SNAPSHOT_EVERY_MOVEMENTS if min_movements is None else min_movements
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT COALESCE(MAX(m.id), 0) - COALESCE((SELECT MAX(movement_id) FROM stock_snapshots), 0)
+            FROM stock_movements m
+        ''')
+        pending = cur.fetchone()[0]
+        conn.close()
+        if pending < min_movements:
+            return None
+        return StockDB.take_snapshot()
+
+    @staticmethod
+    def get_balances_as_of(as_of=None, by_metadata=False):
+        """
+        Stock per ingredient as of a moment: {ingredient_id: qty}, or {metadata_id: qty}
+        with by_metadata (grouped by each ingredient's current tag).
+        as_of is a datetime or ISO date-time, or a date (or date-only string) meaning
+        the end of that day;
+        None means now. Reads the latest snapshot at or before as_of and applies only
+        the movements after it.
+        """
+        bound = StockDB._ledger_time(as_of) if as_of is not None else None
+        conn = get_connection()
+        cur = conn.cursor()
+        if bound is None:
+            cur.execute("SELECT id, movement_id FROM stock_snapshots ORDER BY id DESC LIMIT 1")
+        else:
+            cur.execute(
+                "SELECT id, movement_id FROM stock_snapshots WHERE taken_at <= ? ORDER BY id DESC LIMIT 1", (bound,)
+            )
+        snapshot_id, movement_id = cur.fetchone() or (None, 0)
+        cur.execute('''
+            SELECT ingredient_id, SUM(quantity)
+            FROM (
+                SELECT ingredient_id, quantity FROM stock_snapshot_balances WHERE snapshot_id = ?
+                UNION ALL
+                SELECT ingredient_id, quantity FROM stock_movements
+                WHERE id > ? AND (? IS NULL OR created_at <= ?)
+            )
+            GROUP BY ingredient_id
+        ''', (snapshot_id, movement_id, bound, bound))
+        balances = dict(cur.fetchall())
+        if by_metadata and balances:
+            cur.execute("SELECT id, metadata_id FROM ingredients")
+            tags = dict(cur.fetchall())
+            by_tag = {}
+            for ingredient_id, qty in balances.items():
+                if ingredient_id in tags:
+                    by_tag[tags[ingredient_id]] = by_tag.get(tags[ingredient_id], 0) + qty
+            balances = by_tag
+        conn.close()
+        return balances
@@ -3,6 +3,7 @@ from PyQt5.QtWidgets import QInputDialog, QMessageBox
 from ingredient_db import IngredientDB
 from stock_logic import StockLogic
 from metadata_db import MetadataDB
+import units
 
 class IngredientStockPopup(QtWidgets.QWidget):
     def __init__(self):
@@ -28,7 +29,7 @@ class IngredientStockPopup(QtWidgets.QWidget):
         form_layout = QtWidgets.QHBoxLayout()
         self.ingredient_input = QtWidgets.QComboBox()
         self.quantity_input = QtWidgets.QLineEdit()
-        self.quantity_input.setPlaceholderText("Quantity")
+        self.quantity_input.setPlaceholderText("Quantity (e.g. 500 g)")
         form_layout.addWidget(self.ingredient_input)
         form_layout.addWidget(self.quantity_input)
 
@@ -129,8 +130,8 @@ class IngredientStockPopup(QtWidgets.QWidget):
             QMessageBox.warning(self, "Error", "Select existing ingredient first")
             return
         try:
-            quantity = float(self.quantity_input.text().strip())
-            StockLogic.add_stock(ingredient_id, quantity)
+            quantity, unit = units.parse_quantity(self.quantity_input.text())
+            StockLogic.add_stock(ingredient_id, quantity, unit)
             self.refresh_table(ingredient_id)
             self.clear_form()
         except Exception as e:
@@ -142,8 +143,8 @@ class IngredientStockPopup(QtWidgets.QWidget):
             return
         stock_id = self.data[selected][0]
         try:
-            quantity = float(self.quantity_input.text().strip())
-            StockLogic.update_stock(stock_id, quantity)
+            quantity, unit = units.parse_quantity(self.quantity_input.text())
+            StockLogic.update_stock(stock_id, quantity, unit)
             self.refresh_table(self.ingredient_input.currentData())
             self.clear_form()
         except Exception as e:
@@ -0,0 +1,404 @@
+import bisect
+import heapq
+import re
+from datetime import date, datetime
+
+from db import transaction, chunked
+from Stock_db import StockDB
+from recipe_db import RecipeDB, LINE_ITEM_BATCHES_SQL
+from reservation_db import FULFILLED_STATUSES_SQL
+
+
+_YEAR_FIRST = re.compile(r"^(\d{4})([-/])(\d{2})\2(\d{2})")
+_DAY_FIRST = re.compile(r"^(\d{2})[./-](\d{2})[./-](\d{4})")
+
+
+def _plain_date(value):
+    """
+    A date, datetime or free-form date string as YYYY-MM-DD, comparable with
+    stock.expiry_on; the same formats as Stock_db._normalized_expiry_sql, so a
+    time part ('2026-05-01T09:00') is dropped. None if it is not a date.
+    """
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    match = _YEAR_FIRST.match(text)
+    if match:
+        year, month, day = match.group(1), match.group(3), match.group(4)
+    else:
+        match = _DAY_FIRST.match(text)
+        if not match:
+            return None
+        day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+class BatchHeap:
+    """
+    The eligible stock batches of one ingredient tag (metadata_id), ordered
+    first-expired-first-out on (expiry_on, id). Batches without an expiry
+    date sort last. Quantities are consumed in memory; nothing is written.
+    """
+
+    def __init__(self, batches=()):
+        # entries are mutable [expiry_key, stock_id, remaining] lists so the
+        # head can be drawn down in place without re-heapifying
+        self._heap = [[(expiry is None, expiry or ""), stock_id, qty] for stock_id, expiry, qty in batches if qty > 0]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def available(self):
+        return sum(entry[2] for entry in self._heap)
+
+    def take(self, qty):
+        """Draw up to qty from the heap. Returns [(stock_id, taken_qty), ...] in FEFO order."""
+        taken = []
+        while qty > 0 and self._heap:
+            head = self._heap[0]
+            amount = min(head[2], qty)
+            taken.append((head[1], amount))
+            head[2] -= amount
+            qty -= amount
+            if head[2] <= 0:
+                heapq.heappop(self._heap)
+        return taken
+
+
+class AllocationLogic:
+    """
+    In-memory FEFO allocation of stock batches to line items.
+    The eligible batches for each ingredient are read once into a BatchHeap,
+    every line item is allocated in memory, and all reservations and stock
+    decrements are then written in a single transaction.
+    """
+
+    @staticmethod
+    def load_batch_rows(conn, metadata_ids):
+        """
+        Snapshot of the usable batches: {metadata_id: [(stock_id, expiry_on, quantity)]}.
+        Only batches with stock left that have not expired yet are read.
+        """
+        batches = {metadata_id: [] for metadata_id in metadata_ids}
+        today = date.today().isoformat()
+        cur = conn.cursor()
+        for chunk in chunked(metadata_ids):
+            cur.execute(f"""
+                SELECT i.metadata_id, s.id, s.expiry_on, s.quantity
+                FROM stock s
+                JOIN ingredients i ON i.id = s.ingredient_id
+                WHERE s.quantity > 0
+                  AND (s.expiry_on IS NULL OR s.expiry_on >= ?)
+                  AND i.metadata_id IN ({','.join(['?'] * len(chunk))})
+            """, (today, *chunk))
+            for metadata_id, stock_id, expiry, qty in cur.fetchall():
+                batches[metadata_id].append((stock_id, expiry, qty))
+        return batches
+
+    @staticmethod
+    def load_batches(conn, metadata_ids):
+        """The eligible batches as FEFO heaps: {metadata_id: BatchHeap}."""
+        rows = AllocationLogic.load_batch_rows(conn, metadata_ids)
+        return {metadata_id: BatchHeap(batches) for metadata_id, batches in rows.items()}
+
+    @staticmethod
+    def allocate(needs, heaps, remaining):
+        """
+        Pure in-memory allocation.
+        needs: [(lineitem_id, metadata_id, qty)] in the order line items should be served
+        heaps: {metadata_id: BatchHeap}
+        remaining: {metadata_id: qty still to reserve} (updated in place)
+        Returns [(lineitem_id, stock_id, qty, status)] where status is "ready" for the
+        reservation that completes a line item and "partial" otherwise.
+        """
+        allocations = []
+        for lineitem_id, metadata_id, needed in needs:
+            to_reserve = min(needed, remaining.get(metadata_id, 0))
+            heap = heaps.get(metadata_id)
+            if to_reserve <= 0 or not heap:
+                continue
+            for stock_id, qty in heap.take(to_reserve):
+                status = "ready" if qty == to_reserve else "partial"
+                allocations.append((lineitem_id, stock_id, qty, status))
+                to_reserve -= qty
+                remaining[metadata_id] -= qty
+        return allocations
+
+    @staticmethod
+    def write_allocations(conn, allocations, reserved_until=None):
+        """
+        Insert the reservations and decrement their batches; the caller owns the transaction.
+        Without an explicit reserved_until each reservation gets its order's TTL.
+        """
+        if not allocations:
+            return
+        from reservation_db import ReservationDB
+        now = datetime.now().isoformat()
+        cur = conn.cursor()
+        lineitem_ids = sorted({a[0] for a in allocations})
+        order_of = {}
+        for chunk in chunked(lineitem_ids):
+            cur.execute(f"SELECT id, order_id FROM line_items WHERE id IN ({','.join(['?'] * len(chunk))})", chunk)
+            order_of.update(cur.fetchall())
+        until = {} if reserved_until else ReservationDB.reserved_until_for_orders(conn, set(order_of.values()))
+        cur.executemany(
+            "INSERT INTO reservations (lineitem_id, ingredient_stock_id, qty, status, reserved_until) VALUES (?, ?, ?, ?, ?)",
+            [
+                (lineitem_id, stock_id, qty, status, reserved_until or until.get(order_of.get(lineitem_id)))
+                for lineitem_id, stock_id, qty, status in allocations
+            ]
+        )
+        # Decrement the batches order by order so each ledger movement points at its order
+        by_order = {}
+        for lineitem_id, stock_id, qty, _ in allocations:
+            by_order.setdefault(order_of.get(lineitem_id), []).append((qty, now, stock_id))
+        for order_id, rows in by_order.items():
+            with StockDB.movement("reservation", "order", order_id):
+                cur.executemany("UPDATE stock SET quantity = quantity - ?, last_updated=? WHERE id=?", rows)
+
+    @staticmethod
+    def reserve_order(order_id, limits=None):
+        """
+        Reserve stock for every ingredient of an order (or only those in limits).
+        limits: optional {metadata_id: max total reserved for the order}; by default
+        each ingredient is reserved up to the order's full requirement.
+        Returns the allocations written: [(lineitem_id, stock_id, qty, status)].
+        """
+        with transaction() as conn:
+            RecipeDB.refresh_bom()
+            cur = conn.cursor()
+            # Per line item requirement, in line item order
+            cur.execute(f"""
+                SELECT li.id, b.metadata_id, SUM(b.quantity * {LINE_ITEM_BATCHES_SQL})
+                FROM line_items li
+                JOIN recipes r ON r.id = li.recipe_id
+                JOIN recipe_bom b ON b.recipe_id = li.recipe_id
+                WHERE li.order_id = ?
+                GROUP BY li.id, b.metadata_id
+                ORDER BY li.id
+            """, (order_id,))
+            needs = [row for row in cur.fetchall() if limits is None or row[1] in limits]
+            if not needs:
+                return []
+            required = {}
+            for _, metadata_id, qty in needs:
+                required[metadata_id] = required.get(metadata_id, 0) + qty
+            # What the order already holds
+            cur.execute("SELECT metadata_id, quantity FROM reservation_totals WHERE order_id = ?", (order_id,))
+            reserved = dict(cur.fetchall())
+            remaining = {}
+            for metadata_id, qty in required.items():
+                target = qty if limits is None else limits[metadata_id]
+                remaining[metadata_id] = target - reserved.get(metadata_id, 0)
+
+            heaps = AllocationLogic.load_batches(conn, list(required))
+            allocations = AllocationLogic.allocate(needs, heaps, remaining)
+            AllocationLogic.write_allocations(conn, allocations)
+        return allocations
+
+    # ------------------ Multi-order allocation ------------------
+    @staticmethod
+    def load_open_order_needs(conn, bom=None):
+        """
+        Open orders in priority order, with what each line item still needs.
+        Read-only, so it can run inside a snapshot(): sub-recipes come pre-expanded from
+        recipe_bom, and the caller runs RecipeDB.refresh_bom() before opening conn's
+        transaction or snapshot. Pass bom (RecipeDB.read_bom(conn)) to expand the line
+        items with it instead, without needing the refresh.
+        Returns (orders, needs) where orders is [(order_id, delivery_date, status)] sorted by
+        priority and needs is {order_id: [(lineitem_id, metadata_id, qty)]}.
+        """
+        cur = conn.cursor()
+        cur.execute(f"SELECT id, delivery_date, status FROM orders WHERE status NOT IN ({FULFILLED_STATUSES_SQL})")
+        orders = sorted(cur.fetchall(), key=AllocationLogic.order_priority)
+        if bom is None:
+            cur.execute(f"""
+                SELECT li.order_id, li.id, b.metadata_id, SUM(b.quantity * {LINE_ITEM_BATCHES_SQL})
+                FROM orders o
+                JOIN line_items li ON li.order_id = o.id
+                JOIN recipes r ON r.id = li.recipe_id
+                JOIN recipe_bom b ON b.recipe_id = li.recipe_id
+                WHERE o.status NOT IN ({FULFILLED_STATUSES_SQL})
+                GROUP BY li.id, b.metadata_id
+                ORDER BY li.id
+            """)
+            rows = cur.fetchall()
+        else:
+            cur.execute(f"""
+                SELECT li.order_id, li.id, li.recipe_id, {LINE_ITEM_BATCHES_SQL}
+                FROM orders o
+                JOIN line_items li ON li.order_id = o.id
+                JOIN recipes r ON r.id = li.recipe_id
+                WHERE o.status NOT IN ({FULFILLED_STATUSES_SQL})
+                ORDER BY li.id
+            """)
+            rows = [
+                (order_id, lineitem_id, metadata_id, qty * batches)
+                for order_id, lineitem_id, recipe_id, batches in cur.fetchall()
+                for metadata_id, qty in bom.get(recipe_id, [])
+            ]
+        needs = {}
+        for order_id, lineitem_id, metadata_id, qty in rows:
+            needs.setdefault(order_id, []).append((lineitem_id, metadata_id, qty))
+        return orders, needs
+
+    @staticmethod
+    def order_priority(order):
+        """Sort key for (order_id, delivery_date, status): earliest delivery first, then furthest along."""
+        order_id, delivery_date, status = order
+        rank = ORDER_STATUS_PRIORITY.index(status) if status in ORDER_STATUS_PRIORITY else len(ORDER_STATUS_PRIORITY)
+        return (delivery_date is None, delivery_date or "", rank, order_id)
+
+    @staticmethod
+    def allocate_orders(orders, needs, reserved, pools, mode="greedy"):
+        """
+        Pure in-memory allocation of many orders, in the order given.
+        orders: [(order_id, delivery_date, status)] already sorted by priority
+        needs: {order_id: [(lineitem_id, metadata_id, qty)]}
+        reserved: {order_id: {metadata_id: qty already held}}
+        pools: {metadata_id: BatchHeap} for "greedy" or {metadata_id: ExpiryLadder} for "optimal"
+            (drawn down in place)
+        Returns (allocations, shortages) as described in allocate_open_orders.
+        """
+        allocations = []
+        shortages = {}
+        for order_id, delivery_date, _status in orders:
+            order_needs = needs.get(order_id, [])
+            if not order_needs:
+                continue
+            remaining = {}
+            for _, metadata_id, qty in order_needs:
+                remaining[metadata_id] = remaining.get(metadata_id, 0) + qty
+            for metadata_id, qty in reserved.get(order_id, {}).items():
+                if metadata_id in remaining:
+                    remaining[metadata_id] -= qty
+            if mode == "greedy":
+                allocations.extend(AllocationLogic.allocate(order_needs, pools, remaining))
+            else:
+                allocations.extend(ExpiryLadder.allocate(order_needs, pools, remaining, delivery_date))
+            short = {m: q for m, q in remaining.items() if q > 1e-9}
+            if short:
+                shortages[order_id] = short
+        return allocations, shortages
+
+    @staticmethod
+    def allocate_open_orders(mode="greedy", dry_run=False):
+        """
+        Allocate stock to every open order, most urgent first (orders.delivery_date, then status).
+
+        mode="greedy": each order in turn takes from the first-expiring batches, exactly like
+            the Reserve Ingredients button, regardless of whether a batch outlives the delivery.
+        mode="optimal": a batch may only serve orders delivered on or before its expiry date,
+            and each order draws from the earliest-expiring batch it is allowed to use.
+            This minimises priority-weighted shortage and then expiry waste; see ExpiryLadder.
+
+        All reservations and stock decrements are written in one transaction
+        (nothing is written with dry_run=True).
+        Returns {"allocations": [(lineitem_id, stock_id, qty, status)],
+                 "shortages": {order_id: {metadata_id: qty}}}.
+        """
+        if mode not in ("greedy", "optimal"):
+            raise ValueError("mode must be 'greedy' or 'optimal'")
+        from reservation_db import ReservationDB
+        RecipeDB.refresh_bom()
+        with transaction() as conn:
+            orders, needs = AllocationLogic.load_open_order_needs(conn)
+            reserved = ReservationDB.get_reserved_qty_for_orders([o[0] for o in orders])
+            metadata_ids = sorted({n[1] for items in needs.values() for n in items})
+            if mode == "greedy":
+                pools = AllocationLogic.load_batches(conn, metadata_ids)
+            else:
+                pools = ExpiryLadder.load(conn, metadata_ids)
+            allocations, shortages = AllocationLogic.allocate_orders(orders, needs, reserved, pools, mode)
+            if not dry_run:
+                AllocationLogic.write_allocations(conn, allocations)
+        return {"allocations": allocations, "shortages": shortages}
+
+
+# Order statuses from most to least urgent when delivery dates tie
+ORDER_STATUS_PRIORITY = [
+    "Order in Progress",
+    "BOM Completed",
+    "Invoice Received",
+    "Invoice Sent",
+    "New Order",
+]
+
+
+class ExpiryLadder:
+    """
+    The batches of one ingredient tag sorted by expiry date, for expiry-aware allocation.
+
+    An order delivered on day d may use any batch expiring on or after d, so the
+    batches an order may use are always a suffix of this ladder, and a later
+    delivery's suffix is contained in an earlier one's. On such nested sets the
+    min-cost flow that minimises priority-weighted shortage reduces to: serve
+    orders in priority order, each from the earliest-expiring batch it may use.
+    Taking the earliest eligible batch never removes stock a later order could
+    use instead, and it consumes the batches most at risk of expiring unused,
+    so the same pass also minimises expiry waste. Each draw is a bisect plus an
+    amortised O(1) skip over emptied batches.
+    """
+
+    def __init__(self, batches=()):
+        # batches without an expiry date never go off: they sit at the top of the ladder
+        rows = sorted(
+            ((expiry is None, expiry or "", stock_id, qty) for stock_id, expiry, qty in batches if qty > 0)
+        )
+        self._keys = [(no_expiry, expiry) for no_expiry, expiry, _, _ in rows]
+        self._ids = [stock_id for _, _, stock_id, _ in rows]
+        self._qty = [qty for _, _, _, qty in rows]
+        # _next[i] points at the first batch >= i that may still have stock
+        self._next = list(range(len(rows) + 1))
+
+    def _find(self, i):
+        root = i
+        while self._next[root] != root:
+            root = self._next[root]
+        while self._next[i] != root:
+            self._next[i], i = root, self._next[i]
+        return root
+
+    def take(self, qty, delivery_date=None):
+        """Draw up to qty from batches that are still good on delivery_date, earliest expiry first."""
+        delivery_date = _plain_date(delivery_date) if delivery_date else None
+        start = bisect.bisect_left(self._keys, (False, delivery_date)) if delivery_date else 0
+        taken = []
+        i = self._find(start)
+        while qty > 0 and i < len(self._ids):
+            amount = min(self._qty[i], qty)
+            taken.append((self._ids[i], amount))
+            self._qty[i] -= amount
+            qty -= amount
+            if self._qty[i] <= 0:
+                self._next[i] = i + 1
+                i = self._find(i + 1)
+        return taken
+
+    @staticmethod
+    def load(conn, metadata_ids):
+        """{metadata_id: ExpiryLadder} built from the same snapshot as the FEFO heaps."""
+        rows = AllocationLogic.load_batch_rows(conn, metadata_ids)
+        return {metadata_id: ExpiryLadder(batches) for metadata_id, batches in rows.items()}
+
+    @staticmethod
+    def allocate(needs, ladders, remaining, delivery_date=None):
+        """Like AllocationLogic.allocate, but only from batches still good on delivery_date."""
+        allocations = []
+        for lineitem_id, metadata_id, needed in needs:
+            to_reserve = min(needed, remaining.get(metadata_id, 0))
+            ladder = ladders.get(metadata_id)
+            if to_reserve <= 0 or ladder is None:
+                continue
+            for stock_id, qty in ladder.take(to_reserve, delivery_date):
+                status = "ready" if qty == to_reserve else "partial"
+                allocations.append((lineitem_id, stock_id, qty, status))
+                to_reserve -= qty
+                remaining[metadata_id] -= qty
+        return allocations
@@ -1,7 +1,13 @@
 import sys
-from PyQt5 import QtWidgets
+from datetime import date
+from PyQt5 import QtWidgets, QtCore
 
 from init_all import init_db
+from db import close_connections, checkpoint, checkpoint_if_idle
+from Stock_db import StockDB
+from expiry_logic import ExpiryLogic
+from reservation_db import ReservationDB
+from valuation_logic import InventoryValuation
 from ingredient_ui import IngredientsPopup
 from purchases_ui import PurchasePopup
 from Stock_ui import IngredientStockPopup
@@ -11,6 +17,20 @@ from customer_ui import CustomerOrdersPopup
 from order_ui import OrdersPopup
 from production_ui import ProductionUI
 
+
+def background_task(task):
+    """
+    Wrap a QTimer slot so an error (e.g. a transient "database is locked") is logged
+    and the next tick tries again; an exception escaping a slot aborts a PyQt5 app.
+    """
+    def run():
+        try:
+            task()
+        except Exception as e:
+            print(f"[ERROR] Background task {task.__qualname__} failed: {e}")
+    return run
+
+
 class MainApp(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
@@ -34,6 +54,8 @@ class MainApp(QtWidgets.QMainWindow):
         ingredients_menu.addAction("Manage Ingredients", self.open_ingredients)
         ingredients_menu.addAction("Ingredient Purchase", self.open_history)
         ingredients_menu.addAction("Manage Stock", self.open_stock)
+        ingredients_menu.addAction("Write Off Expired Stock", self.sweep_expired_stock)
+        ingredients_menu.addAction("Inventory Valuation", self.show_inventory_valuation)
 
         # Recipes menu
         recipes_menu = menubar.addMenu("Recipes")
@@ -45,6 +67,57 @@ class MainApp(QtWidgets.QMainWindow):
         customers_menu.addAction("Manage Customers", self.open_customers)
         customers_menu.addAction("Production Dashboard", self.open_dashboard)
 
+        # Fold the WAL back into the database whenever the app has been idle a while
+        self.checkpoint_timer = QtCore.QTimer(self)
+        self.checkpoint_timer.timeout.connect(background_task(checkpoint_if_idle))
+        self.checkpoint_timer.start(10 * 1000)
+
+        # Snapshot stock balances now and then so as-of queries never replay the whole ledger
+        self.snapshot_timer = QtCore.QTimer(self)
+        self.snapshot_timer.timeout.connect(background_task(StockDB.snapshot_if_due))
+        self.snapshot_timer.start(5 * 60 * 1000)
+
+        # Hand stock held by lapsed reservations (past reserved_until) back to inventory
+        self.reservation_timer = QtCore.QTimer(self)
+        self.reservation_timer.timeout.connect(background_task(ReservationDB.release_lapsed))
+        self.reservation_timer.start(15 * 60 * 1000)
+
+    def sweep_expired_stock(self):
+        """Write off expired stock after confirmation and report what was done."""
+        answer = QtWidgets.QMessageBox.question(
+            self, "Write Off Expired Stock",
+            "Set every expired, unreserved batch to zero and flag reservations on expired stock?"
+        )
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+        result = ExpiryLogic.sweep_expired()
+        QtWidgets.QMessageBox.information(
+            self, "Write Off Expired Stock",
+            f"Wrote off {result['quantity']:.2f} from {result['batches']} batches.\n"
+            f"Flagged {result['reservations']} reservations on expired stock."
+        )
+
+    def show_inventory_valuation(self):
+        """FIFO value of stock on hand at the end of a chosen day (blank for now)."""
+        as_of, ok = QtWidgets.QInputDialog.getText(
+            self, "Inventory Valuation", "Value stock at the end of (YYYY-MM-DD, blank for now):"
+        )
+        if not ok:
+            return
+        as_of = as_of.strip() or None
+        if as_of is not None:
+            try:
+                as_of = date.fromisoformat(as_of)
+            except ValueError:
+                QtWidgets.QMessageBox.warning(self, "Inventory Valuation", "Enter the date as YYYY-MM-DD.")
+                return
+        report = InventoryValuation.value(as_of)
+        lines = [f"{row['Name']}: {row['Value']:.2f} ({row['Quantity']:.0f} {row['Unit']})" for row in report["ByMetadata"]]
+        lines.append(f"\nTotal: {report['Total']:.2f}")
+        if report["Unvalued"]:
+            lines.append(f"Not valued (no purchase price): {report['Unvalued']:.0f} units")
+        QtWidgets.QMessageBox.information(self, "Inventory Valuation", "\n".join(lines))
+
     # --- Open windows ---
     def open_ingredients(self):
         self.ingredients_window = IngredientsPopup()
@@ -77,7 +150,11 @@ class MainApp(QtWidgets.QMainWindow):
 
 if __name__ == "__main__":
     init_db()
+    background_task(ReservationDB.release_lapsed)()
     app = QtWidgets.QApplication(sys.argv)
     window = MainApp()
     window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    checkpoint("TRUNCATE")
+    close_connections()
+    sys.exit(exit_code)
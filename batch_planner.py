@@ -0,0 +1,109 @@
+import math
+from datetime import date, datetime, timedelta
+
+from db import get_connection, chunked
+from recipe_db import RecipeDB
+from reservation_db import FULFILLED_STATUSES_SQL
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+class BatchPlanner:
+    """
+    Production batches for the open orders delivered in a date window.
+
+    Line items for the same recipe are merged across orders and rounded up to
+    whole batches of recipes.output_quantity. A batch is one run of the recipe:
+    its flattened BOM (sub-recipes expanded) is what one batch pulls from stock, and it
+    yields output_quantity units of line_items.quantity.
+    """
+
+    @staticmethod
+    def plan(start_date=None, end_date=None, include_closed=False):
+        """
+        Batch plan for orders delivered between start_date and end_date (dates or
+        ISO strings, both inclusive, either may be None for an open end).
+        Returns a list of dicts, one per recipe, sorted by recipe name:
+        {"RecipeID", "Name", "OutputQuantity", "Ordered", "Batches", "Surplus",
+         "Orders": [order_id], "LineItems": [lineitem_id],
+         "PerBatch": [{"MetadataID", "Name", "Unit", "Quantity"}],  # pull list of one batch
+         "Total": [{"MetadataID", "Name", "Unit", "Quantity"}]}      # pull list of all batches
+        """
+        where, params = [], []
+        if not include_closed:
+            # Shipped and completed orders have used their stock; the <> 'Closed' term
+            # lets idx_orders_open (a partial index on it) serve the date range
+            where.append(f"o.status <> 'Closed' AND o.status NOT IN ({FULFILLED_STATUSES_SQL})")
+        # Plain range comparisons on the ISO dates, so idx_orders_open is used
+        if start_date is not None:
+            where.append("o.delivery_date >= ?")
+            params.append(_as_date(start_date).isoformat())
+        if end_date is not None:
+            where.append("o.delivery_date < ?")
+            params.append((_as_date(end_date) + timedelta(days=1)).isoformat())
+
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT li.recipe_id, r.name, r.output_quantity, li.order_id, li.id, li.quantity
+            FROM line_items li
+            JOIN orders o ON o.id = li.order_id
+            JOIN recipes r ON r.id = li.recipe_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY li.recipe_id, li.id
+        """, params)
+        groups = {}
+        for recipe_id, name, output_quantity, order_id, lineitem_id, quantity in cur.fetchall():
+            group = groups.get(recipe_id)
+            if group is None:
+                group = groups[recipe_id] = {
+                    "RecipeID": recipe_id,
+                    "Name": name,
+                    "OutputQuantity": output_quantity if output_quantity and output_quantity > 0 else 1,
+                    "Ordered": 0,
+                    "Orders": [],
+                    "LineItems": [],
+                }
+            group["Ordered"] += quantity or 0
+            group["Orders"].append(order_id)
+            group["LineItems"].append(lineitem_id)
+
+        # One batch's pull list per recipe, for just the recipes in the plan
+        per_batch = {recipe_id: [] for recipe_id in groups}
+        for chunk in chunked(list(groups)):
+            cur.execute(f"""
+                SELECT b.recipe_id, b.metadata_id, m.name, m.unit, b.quantity
+                FROM recipe_bom b
+                JOIN metadata m ON m.id = b.metadata_id
+                WHERE b.recipe_id IN ({','.join(['?'] * len(chunk))})
+                ORDER BY b.recipe_id, b.position
+            """, chunk)
+            for recipe_id, metadata_id, name, unit, quantity in cur.fetchall():
+                per_batch[recipe_id].append({"MetadataID": metadata_id, "Name": name, "Unit": unit, "Quantity": quantity})
+        conn.close()
+
+        plan = []
+        for recipe_id, group in groups.items():
+            batches = math.ceil(group["Ordered"] / group["OutputQuantity"])
+            group["Orders"] = sorted(set(group["Orders"]))
+            group["Batches"] = batches
+            group["Surplus"] = batches * group["OutputQuantity"] - group["Ordered"]
+            group["PerBatch"] = per_batch[recipe_id]
+            group["Total"] = [dict(item, Quantity=item["Quantity"] * batches) for item in per_batch[recipe_id]]
+            plan.append(group)
+        plan.sort(key=lambda g: (g["Name"] or "", g["RecipeID"]))
+        return plan
+
+    @staticmethod
+    def pull_list(plan):
+        """Everything a plan pulls from stock, merged across recipes: {metadata_id: quantity}."""
+        totals = {}
+        for group in plan:
+            for item in group["Total"]:
+                totals[item["MetadataID"]] = totals.get(item["MetadataID"], 0) + item["Quantity"]
+        return totals
@@ -0,0 +1,240 @@
+# Benchmarks for the database layer.
+# Every run seeds a throw-away SQLite file in a temp directory, so the real
+# ingredients.db is never touched.
+#
+#   python benchmark.py connections [--orders 200]
+#   python benchmark.py storage [--writes 200]
+#   python benchmark.py planner [--orders 2000]
+#   python benchmark.py allocation [--orders 3000]
+#   python benchmark.py batches [--orders 3000]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import db
+
+
+def seed_database(path, n_orders=200, n_tags=40, n_recipes=30, seed=42):
+    """Create all tables in a fresh database file and fill them with demo data."""
+    from init_all import init_db
+
+    rnd = random.Random(seed)
+    db.DB_NAME = path
+    init_db()
+    conn = db.get_connection()
+    cur = conn.cursor()
+
+    tag_units = [rnd.choice(["g", "ml"]) for _ in range(n_tags)]
+    cur.executemany(
+        "INSERT INTO metadata (name, description, unit) VALUES (?, ?, ?)",
+        [(f"Tag {i}", "", unit) for i, unit in enumerate(tag_units)]
+    )
+    ingredients = []
+    for meta_id in range(1, n_tags + 1):
+        for brand in range(3):
+            ingredients.append((f"Ingredient {meta_id}-{brand}", rnd.choice([500, 1000, 5000]), meta_id))
+    cur.executemany("INSERT INTO ingredients (name, size, metadata_id) VALUES (?, ?, ?)", ingredients)
+
+    today = date.today()
+    stock = []
+    for ingredient_id in range(1, len(ingredients) + 1):
+        for batch in range(5):
+            expiry = (today + timedelta(days=rnd.randint(-10, 180))).isoformat()
+            stock.append((ingredient_id, rnd.uniform(0, 5000), f"B{ingredient_id}-{batch}", expiry))
+    cur.executemany(
+        "INSERT INTO stock (ingredient_id, quantity, batch_number, expiry_date) VALUES (?, ?, ?, ?)", stock
+    )
+
+    cur.executemany(
+        "INSERT INTO recipes (name, output_quantity) VALUES (?, ?)",
+        [(f"Recipe {i}", rnd.choice([12, 24, 48])) for i in range(n_recipes)]
+    )
+    recipe_rows = []
+    for recipe_id in range(1, n_recipes + 1):
+        for meta_id in rnd.sample(range(1, n_tags + 1), 6):
+            recipe_rows.append((recipe_id, meta_id, rnd.uniform(5, 250), tag_units[meta_id - 1]))
+    cur.executemany(
+        "INSERT INTO recipe_ingredients (recipe_id, metadata_id, quantity, unit) VALUES (?, ?, ?, ?)", recipe_rows
+    )
+
+    cur.executemany("INSERT INTO customers (name) VALUES (?)", [(f"Customer {i}",) for i in range(20)])
+    statuses = ["New Order", "Invoice Sent", "Order in Progress", "Closed"]
+    orders = []
+    for _ in range(n_orders):
+        order_day = today - timedelta(days=rnd.randint(0, 30))
+        delivery = order_day + timedelta(days=rnd.randint(1, 45))
+        orders.append((rnd.randint(1, 20), order_day.isoformat(), delivery.isoformat(), rnd.choice(statuses)))
+    cur.executemany(
+        "INSERT INTO orders (customer_id, order_date, delivery_date, status) VALUES (?, ?, ?, ?)", orders
+    )
+    line_items = []
+    for order_id in range(1, n_orders + 1):
+        for recipe_id in rnd.sample(range(1, n_recipes + 1), rnd.randint(1, 5)):
+            line_items.append((order_id, recipe_id, rnd.randint(1, 10)))
+    cur.executemany("INSERT INTO line_items (order_id, recipe_id, quantity) VALUES (?, ?, ?)", line_items)
+    conn.commit()
+    conn.close()
+
+
+def timed(label, fn, repeat=3):
+    """Run fn `repeat` times and print the best wall-clock time."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<52} {best * 1000:10.1f} ms")
+    return best
+
+
+def _controller():
+    """A ProductionController wired to bare tables, without the full window."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from types import SimpleNamespace
+    from PyQt5 import QtWidgets
+    from production_logic import ProductionController
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    ui = SimpleNamespace(
+        ingredients_for_lineitem_table=QtWidgets.QTableWidget(0, 4),
+        shopping_table=QtWidgets.QTableWidget(0, 4),
+    )
+    controller = ProductionController.__new__(ProductionController)
+    controller.ui = ui
+    controller._app = app
+    return controller
+
+
+def bench_connections(args):
+    """Per-call sqlite3.connect versus the persistent per-thread connection."""
+    controller = _controller()
+    order_id = args.orders // 2
+    for persistent in (False, True):
+        db.PERSISTENT = persistent
+        print("persistent connections" if persistent else "connection per call")
+        timed(f"load_ingredients_for_order({order_id})", lambda: controller.load_ingredients_for_order(order_id))
+        timed("load_shopping_list()", controller.load_shopping_list)
+        db.close_connections()
+    db.PERSISTENT = True
+
+
+def bench_storage(args):
+    """Per-commit latency of reservation and purchase writes under each storage profile."""
+    from purchases_logic import PurchasesLogic
+    from reservation_db import ReservationDB
+
+    conn = db.get_connection()
+    lineitem_id = conn.execute("SELECT MIN(id) FROM line_items").fetchone()[0]
+    stock_ids = [r[0] for r in conn.execute("SELECT id FROM stock ORDER BY id LIMIT ?", (args.writes,))]
+    ingredient_ids = [r[0] for r in conn.execute("SELECT id FROM ingredients")]
+
+    def reserve():
+        for stock_id in stock_ids:
+            with db.transaction() as c:
+                ReservationDB.add_reservation(lineitem_id, stock_id, 1)
+                c.execute("UPDATE stock SET quantity = quantity - 1 WHERE id=?", (stock_id,))
+
+    def purchase():
+        for i in range(args.writes):
+            PurchasesLogic.add_purchase(ingredient_ids[i % len(ingredient_ids)], 1, 10.0, 0)
+
+    for name in ["legacy", "desktop-safe", "fast-local", "benchmark"]:
+        db.close_connections()
+        db.set_storage_profile(name)
+        print(f"profile {name} ({args.writes} commits each)")
+        r = timed("reservation + stock decrement", reserve, repeat=1)
+        p = timed("purchase intake", purchase, repeat=1)
+        print(f"  {'per commit':<52} {r / args.writes * 1e6:8.0f} us / {p / args.writes * 1e6:8.0f} us")
+
+
+def _per_row_requirements(order_ids):
+    """The original per-line-item loop: three point queries per line item, summed in Python."""
+    from line_item_db import LineItemDB
+    from recipe_db import RecipeDB
+
+    result = {}
+    for order_id in order_ids:
+        required = {}
+        for item in LineItemDB.get_order_items(order_id):
+            recipe_id = LineItemDB.get_recipe_id(item[0])
+            for ing in RecipeDB.get_recipe_ingredients(recipe_id):
+                required[ing[2]] = required.get(ing[2], 0) + ing[3] * item[3]
+        result[order_id] = required
+    return result
+
+
+def bench_planner(args):
+    """Per-row Python loops versus one grouped SQL join versus the NumPy matrix multiply."""
+    from demand_planner import DemandPlanner
+    from line_item_db import LineItemDB
+
+    order_ids = [r[0] for r in db.get_connection().execute("SELECT id FROM orders ORDER BY id")]
+    n_items = db.get_connection().execute("SELECT COUNT(*) FROM line_items").fetchone()[0]
+    print(f"{len(order_ids)} orders, {n_items} line items")
+    timed("per-row loops (original LineItemDB path)", lambda: _per_row_requirements(order_ids), repeat=1)
+    timed("grouped SQL (get_required_ingredients_for_orders)",
+          lambda: LineItemDB.get_required_ingredients_for_orders(order_ids))
+    timed("DemandPlanner load + multiply", lambda: DemandPlanner(order_ids).per_order())
+    planner = DemandPlanner(order_ids)
+    timed("DemandPlanner what-if (matrix already loaded)",
+          lambda: planner.shortage_vector(planner.recipe_vector({int(planner.recipe_ids[0]): 500})))
+
+
+def bench_allocation(args):
+    """Whole-book allocation over every open order, in both modes (dry runs, nothing written)."""
+    from allocation_logic import AllocationLogic
+
+    for mode in ("greedy", "optimal"):
+        result = {}
+        timed(f"allocate_open_orders({mode!r})",
+              lambda: result.update(AllocationLogic.allocate_open_orders(mode, dry_run=True)), repeat=1)
+        print(f"  {len(result['allocations'])} reservations, {len(result['shortages'])} orders short")
+
+
+def bench_batches(args):
+    """Batch plan for one delivery day and for the whole book of open orders."""
+    from batch_planner import BatchPlanner
+    from reservation_db import FULFILLED_STATUSES_SQL
+
+    busiest, n_orders = db.get_connection().execute(f"""
+        SELECT date(delivery_date), COUNT(*) FROM orders WHERE status NOT IN ({FULFILLED_STATUSES_SQL})
+        GROUP BY 1 ORDER BY 2 DESC LIMIT 1
+    """).fetchone()
+    plan = BatchPlanner.plan(busiest, busiest)
+    print(f"{busiest}: {n_orders} open orders, {sum(g['Batches'] for g in plan)} batches of {len(plan)} recipes")
+    timed(f"BatchPlanner.plan({busiest!r}, {busiest!r})", lambda: BatchPlanner.plan(busiest, busiest))
+    timed("BatchPlanner.plan() over every open order", lambda: BatchPlanner.pull_list(BatchPlanner.plan()))
+
+
+BENCHMARKS = {
+    "connections": bench_connections,
+    "storage": bench_storage,
+    "planner": bench_planner,
+    "allocation": bench_allocation,
+    "batches": bench_batches,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Royal Cookie database benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--orders", type=int, default=200, help="number of seeded orders")
+    parser.add_argument("--writes", type=int, default=200, help="commits per write benchmark")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "benchmark.db")
+        print(f"Seeding {args.orders} orders into {path}")
+        seed_database(path, n_orders=args.orders)
+        BENCHMARKS[args.benchmark](args)
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+# Script to check the trigger-maintained totals against the rows they summarise:
+# stock availability per ingredient / metadata tag, reserved quantity per order,
+# and purchase cost totals per ingredient.
+# Usage: python check_stock_totals.py [--rebuild]
+# Without arguments it only reports mismatches; --rebuild recomputes the
+# totals tables from the underlying rows (e.g. after editing the database by hand).
+
+import sys
+
+from Stock_db import StockDB
+from reservation_db import ReservationDB
+from costing_db import CostingDB
+from db import close_connections
+from init_all import init_db
+
+init_db()
+checks = [("Stock totals", StockDB), ("Reservation totals", ReservationDB), ("Purchase cost totals", CostingDB)]
+for label, dao in checks:
+    mismatches = dao.verify_totals()
+    for kind, key, stored, actual in mismatches:
+        print(f"{kind} {key}: stored {stored}, actual {actual}")
+
+    if not mismatches:
+        print(f"{label} are consistent.")
+    elif "--rebuild" in sys.argv:
+        dao.rebuild_totals()
+        print(f"Rebuilt {label.lower()} ({len(mismatches)} mismatches fixed).")
+    else:
+        print(f"{label}: {len(mismatches)} mismatches found; run with --rebuild to recompute them.")
+
+close_connections()
@@ -0,0 +1,258 @@
+from db import get_connection, transaction, chunked
+from recipe_db import RecipeDB
+
+COST_METHODS = ("average", "latest")
+
+# What a purchase cost after its discount; purchases without a price are not costed.
+_NET = "(COALESCE({row}.price, 0) - COALESCE({row}.discount, 0))"
+
+
+class CostingDB:
+    """
+    Unit costs from purchase history, and recipe costs rolled up from them.
+
+    ingredient_costs keeps a running total of net cost and packs bought per ingredient,
+    plus the most recent purchase, maintained by triggers on ingredient_purchases. Unit
+    costs are per base unit (g, ml, pcs): packs are multiplied by the ingredient's current
+    size when read, so changing a pack size needs no bookkeeping. Tag and recipe costs are
+    computed from ingredient_costs and recipe_bom and never read the purchase history.
+    """
+
+    @staticmethod
+    def init_costs(conn):
+        """Create ingredient_costs, its triggers, and fill it from existing purchases."""
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingredient_costs (
+                ingredient_id INTEGER PRIMARY KEY,
+                total_cost REAL NOT NULL DEFAULT 0,
+                total_packs REAL NOT NULL DEFAULT 0,
+                last_date TEXT,
+                last_cost REAL,
+                last_packs REAL
+            )
+        """)
+        # Newest purchase per ingredient is a top-1 probe on this index
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_purchases_ingredient_date ON ingredient_purchases(ingredient_id, date, id)"
+        )
+
+        delta = """
+            INSERT INTO ingredient_costs (ingredient_id, total_cost, total_packs)
+            SELECT {row}.ingredient_id, {sign}{net}, {sign}{row}.quantity
+            WHERE {row}.price IS NOT NULL
+            ON CONFLICT(ingredient_id) DO UPDATE SET
+                total_cost = total_cost + excluded.total_cost,
+                total_packs = total_packs + excluded.total_packs;
+        """
+        latest = f"""
+            UPDATE ingredient_costs SET (last_date, last_cost, last_packs) = (
+                SELECT p.date, {_NET.format(row="p")}, p.quantity
+                FROM ingredient_purchases p
+                WHERE p.ingredient_id = {{row}}.ingredient_id AND p.price IS NOT NULL
+                ORDER BY p.date DESC, p.id DESC
+                LIMIT 1
+            )
+            WHERE ingredient_id = {{row}}.ingredient_id;
+        """
+
+        def add(row, sign=""):
+            return delta.format(row=row, sign=sign, net=_NET.format(row=row))
+
+        triggers = {
+            "trg_ingredient_costs_insert": (
+                "AFTER INSERT ON ingredient_purchases",
+                add("NEW") + latest.format(row="NEW"),
+            ),
+            "trg_ingredient_costs_delete": (
+                "AFTER DELETE ON ingredient_purchases",
+                add("OLD", "-") + latest.format(row="OLD"),
+            ),
+            "trg_ingredient_costs_update": (
+                "AFTER UPDATE OF ingredient_id, date, quantity, price, discount ON ingredient_purchases",
+                add("OLD", "-") + add("NEW") + latest.format(row="OLD") + latest.format(row="NEW"),
+            ),
+        }
+        for name, (event, body) in triggers.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+        CostingDB.rebuild_totals()
+        conn.commit()
+
+    @staticmethod
+    def rebuild_totals():
+        """Recompute ingredient_costs from ingredient_purchases (recovery; also run by the migration)."""
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM ingredient_costs")
+            cur.execute(f"""
+                INSERT INTO ingredient_costs (ingredient_id, total_cost, total_packs)
+                SELECT ingredient_id, SUM({_NET.format(row="p")}), SUM(quantity)
+                FROM ingredient_purchases p
+                WHERE price IS NOT NULL
+                GROUP BY ingredient_id
+            """)
+            cur.execute(f"""
+                UPDATE ingredient_costs SET (last_date, last_cost, last_packs) = (
+                    SELECT p.date, {_NET.format(row="p")}, p.quantity
+                    FROM ingredient_purchases p
+                    WHERE p.ingredient_id = ingredient_costs.ingredient_id AND p.price IS NOT NULL
+                    ORDER BY p.date DESC, p.id DESC
+                    LIMIT 1
+                )
+            """)
+
+    @staticmethod
+    def verify_totals(tolerance=1e-6):
+        """
+        Compare ingredient_costs with a fresh aggregate over ingredient_purchases.
+        Returns a list of (kind, key, stored, actual) for every mismatch; empty means consistent.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            WITH actual AS (
+                SELECT ingredient_id, SUM({_NET.format(row="p")}) AS cost, SUM(quantity) AS packs
+                FROM ingredient_purchases p
+                WHERE price IS NOT NULL
+                GROUP BY ingredient_id
+            )
+            SELECT a.ingredient_id, COALESCE(c.total_cost, 0), a.cost, COALESCE(c.total_packs, 0), a.packs
+            FROM actual a
+            LEFT JOIN ingredient_costs c ON c.ingredient_id = a.ingredient_id
+            UNION ALL
+            SELECT c.ingredient_id, c.total_cost, 0, c.total_packs, 0
+            FROM ingredient_costs c
+            WHERE NOT EXISTS (SELECT 1 FROM actual a WHERE a.ingredient_id = c.ingredient_id)
+        """)
+        rows = cur.fetchall()
+        conn.close()
+        mismatches = []
+        for ingredient_id, stored_cost, cost, stored_packs, packs in rows:
+            if abs(stored_cost - cost) > tolerance:
+                mismatches.append(("cost", ingredient_id, stored_cost, cost))
+            if abs(stored_packs - packs) > tolerance:
+                mismatches.append(("packs", ingredient_id, stored_packs, packs))
+        return mismatches
+
+    # ------------------ Unit costs ------------------
+    @staticmethod
+    def _check_method(method):
+        if method not in COST_METHODS:
+            raise ValueError(f"Unknown cost method '{method}'. Choose from: {', '.join(COST_METHODS)}")
+
+    @staticmethod
+    def _tag_cost_sql(method):
+        """SELECT metadata_id, unit_cost per tag, for use as a CTE."""
+        CostingDB._check_method(method)
+        if method == "average":
+            return """
+                SELECT i.metadata_id, SUM(c.total_cost) / SUM(c.total_packs * i.size) AS unit_cost
+                FROM ingredient_costs c
+                JOIN ingredients i ON i.id = c.ingredient_id
+                WHERE c.total_packs > 0 AND i.size > 0
+                GROUP BY i.metadata_id
+            """
+        # Latest: the tag's most recently bought ingredient; the bare unit_cost
+        # column is taken from the row holding MAX(last_date)
+        return """
+            SELECT i.metadata_id, c.last_cost / (c.last_packs * i.size) AS unit_cost, MAX(c.last_date)
+            FROM ingredient_costs c
+            JOIN ingredients i ON i.id = c.ingredient_id
+            WHERE c.last_packs > 0 AND i.size > 0
+            GROUP BY i.metadata_id
+        """
+
+    @staticmethod
+    def get_ingredient_costs(method="average"):
+        """{ingredient_id: cost per base unit} for every ingredient with a priced purchase."""
+        CostingDB._check_method(method)
+        column = "c.total_cost / (c.total_packs * i.size)" if method == "average" else "c.last_cost / (c.last_packs * i.size)"
+        packs = "c.total_packs" if method == "average" else "c.last_packs"
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT c.ingredient_id, {column}
+            FROM ingredient_costs c
+            JOIN ingredients i ON i.id = c.ingredient_id
+            WHERE {packs} > 0 AND i.size > 0
+        """)
+        costs = dict(cur.fetchall())
+        conn.close()
+        return costs
+
+    @staticmethod
+    def get_metadata_costs(method="average"):
+        """{metadata_id: cost per base unit}; 'average' pools every ingredient of the tag."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(CostingDB._tag_cost_sql(method))
+        costs = {row[0]: row[1] for row in cur.fetchall()}
+        conn.close()
+        return costs
+
+    # ------------------ Recipe roll-up ------------------
+    @staticmethod
+    def get_recipe_costs(method="average", recipe_ids=None):
+        """
+        Cost of one batch of each recipe (output_quantity units), from the flattened
+        BOM, so sub-recipes are included. One grouped query for the catalog.
+        Returns a list of dicts sorted by name:
+        {"RecipeID", "Name", "Cost", "Uncosted"} where Uncosted lists the tags with no priced purchase.
+        """
+        RecipeDB.refresh_bom()
+        query = f"""
+            WITH tag_cost AS ({CostingDB._tag_cost_sql(method)})
+            SELECT r.id, r.name, COALESCE(SUM(b.quantity * t.unit_cost), 0),
+                   GROUP_CONCAT(CASE WHEN t.unit_cost IS NULL THEN m.name END, '|')
+            FROM recipes r
+            LEFT JOIN recipe_bom b ON b.recipe_id = r.id
+            LEFT JOIN metadata m ON m.id = b.metadata_id
+            LEFT JOIN tag_cost t ON t.metadata_id = b.metadata_id
+            {{where}}
+            GROUP BY r.id
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        rows = []
+        if recipe_ids is None:
+            cur.execute(query.format(where=""))
+            rows = cur.fetchall()
+        else:
+            for chunk in chunked(recipe_ids):
+                cur.execute(query.format(where=f"WHERE r.id IN ({','.join(['?'] * len(chunk))})"), chunk)
+                rows.extend(cur.fetchall())
+        conn.close()
+        rows.sort(key=lambda row: (row[1] or "", row[0]))
+        return [
+            {"RecipeID": recipe_id, "Name": name, "Cost": cost, "Uncosted": uncosted.split("|") if uncosted else []}
+            for recipe_id, name, cost, uncosted in rows
+        ]
+
+    @staticmethod
+    def get_recipe_cost_breakdown(recipe_id, method="average"):
+        """Per-ingredient lines of a recipe's batch cost: [{"MetadataID", "Name", "Quantity", "Unit", "UnitCost", "Cost"}]."""
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            WITH tag_cost AS ({CostingDB._tag_cost_sql(method)})
+            SELECT b.metadata_id, m.name, b.quantity, m.unit, t.unit_cost
+            FROM recipe_bom b
+            JOIN metadata m ON m.id = b.metadata_id
+            LEFT JOIN tag_cost t ON t.metadata_id = b.metadata_id
+            WHERE b.recipe_id = ?
+            ORDER BY b.position
+        """, (recipe_id,))
+        rows = cur.fetchall()
+        conn.close()
+        return [
+            {
+                "MetadataID": metadata_id,
+                "Name": name,
+                "Quantity": quantity,
+                "Unit": unit,
+                "UnitCost": unit_cost,
+                "Cost": quantity * unit_cost if unit_cost is not None else None,
+            }
+            for metadata_id, name, quantity, unit, unit_cost in rows
+        ]
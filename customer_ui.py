@@ -6,6 +6,7 @@ from line_item_db import LineItemDB
 from metadata_db import MetadataDB
 from Stock_db import StockDB
 from recipe_db import RecipeDB
+from order_import import OrderImport
 
 
 class StockCheckPanel(QtWidgets.QWidget):
@@ -36,7 +37,7 @@ class StockCheckPanel(QtWidgets.QWidget):
             self.breakdown_tree.clear()
             return
 
-        stock_db = StockDB()
+        available_by_metadata = StockDB.get_available_by_metadata()
         ingredient_totals = {}
         self.breakdown_tree.clear()
 
@@ -48,16 +49,17 @@ class StockCheckPanel(QtWidgets.QWidget):
             recipe_node = QtWidgets.QTreeWidgetItem([recipe_name])
             self.breakdown_tree.addTopLevelItem(recipe_node)
 
-            recipe_id = LineItemDB.get_recipe_id(lineitem_id)
+            recipe_id, batches = LineItemDB.get_recipe_batches(lineitem_id)
             if not recipe_id:
                 continue
 
-            ingredients = RecipeDB.get_recipe_ingredients(recipe_id) or []
-            for ri_id, r_id, metadata_id, per_recipe_amt, unit, ing_name in ingredients:
+            # Sub-recipes expanded down to raw ingredients
+            ingredients = RecipeDB.get_flattened_ingredients(recipe_id) or []
+            for metadata_id, per_recipe_amt, unit, ing_name in ingredients:
                 ing_name = str(ing_name or "Unnamed Ingredient")
                 per_recipe_amt = per_recipe_amt or 0
-                required = per_recipe_amt * qty
-                available = stock_db.get_available_stock(metadata_id) or 0
+                required = per_recipe_amt * batches
+                available = available_by_metadata.get(metadata_id, 0) or 0
 
                 # For summary table
                 if metadata_id not in ingredient_totals:
@@ -183,10 +185,13 @@ class CustomerOrdersPopup(QtWidgets.QWidget):
         left_layout.addWidget(self.customer_list)
         self.delete_btn = QtWidgets.QPushButton("Delete Customer")
         self.add_customer_btn = QtWidgets.QPushButton("Add Customer")
+        self.import_orders_btn = QtWidgets.QPushButton("Import Orders...")
         left_layout.addWidget(self.delete_btn)
         left_layout.addWidget(self.add_customer_btn)
+        left_layout.addWidget(self.import_orders_btn)
         self.delete_btn.clicked.connect(self.delete_selected_customer)
         self.add_customer_btn.clicked.connect(self.show_add_customer_dialog)
+        self.import_orders_btn.clicked.connect(self.import_orders)
 
              # MIDDLE PANEL
         middle_layout = QtWidgets.QVBoxLayout()
@@ -272,6 +277,30 @@ class CustomerOrdersPopup(QtWidgets.QWidget):
             item = QtWidgets.QListWidgetItem(f"{c[1]} ({c[2]})")
             item.setData(QtCore.Qt.UserRole, c[0])
             self.customer_list.addItem(item)
+
+    def import_orders(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Import Orders", "", "Order files (*.csv *.json *.jsonl *.ndjson)"
+        )
+        if not path:
+            return
+        try:
+            result = OrderImport.import_file(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        if result["Rejected"]:
+            shown = "\n".join(f"Row {number}: {reason}" for number, reason in result["Rejected"][:20])
+            more = len(result["Rejected"]) - 20
+            if more > 0:
+                shown += f"\n... and {more} more"
+            QMessageBox.warning(self, "Import Orders", f"Nothing was imported. Fix these rows and try again:\n{shown}")
+            return
+        QMessageBox.information(
+            self, "Import Orders", f"Imported {len(result['Orders'])} orders with {result['LineItems']} line items."
+        )
+        self.load_orders()
+
     def show_add_customer_dialog(self):
         dialog = AddCustomerDialog(self)
         if dialog.exec_() == QtWidgets.QDialog.Accepted:
@@ -1,7 +1,315 @@
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
 DB_NAME = "ingredients.db"
 
+# When False, get_connection() falls back to opening a fresh connection on
+# every call (the old behaviour). Only the benchmarks flip this.
+PERSISTENT = True
+
+# Storage tuning applied to every connection when it opens.
+#   desktop-safe  WAL, full fsync on commit: nothing committed is ever lost
+#   fast-local    WAL, fsync only at checkpoints: a power cut may lose the
+#                 last few commits but never corrupts the file
+#   benchmark     no fsync at all; for throw-away databases only
+#   legacy        SQLite's defaults (rollback journal), as before profiles
+# cache_size is negative to mean KiB rather than pages.
+STORAGE_PROFILES = {
+    "desktop-safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "DEFAULT",
+    },
+    "fast-local": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "benchmark": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+}
+
+STORAGE_PROFILE = os.environ.get("ROYAL_COOKIE_DB_PROFILE", "desktop-safe")
+
+# Keep dynamic IN (...) lists below SQLite's host-parameter limit (999 on
+# older builds).
+MAX_SQL_PARAMS = 900
+
+# Seconds without a commit before checkpoint_if_idle() folds the WAL back
+# into the main database file.
+CHECKPOINT_IDLE_SECONDS = 30
+
+_last_commit = None
+_dirty = False
+
+
+def chunked(values, size=MAX_SQL_PARAMS):
+    """Split a list of ids into slices small enough for one IN (...) list."""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def set_storage_profile(name):
+    """
+    Select the storage profile for connections opened from now on.
+    Already open connections keep their settings until close_connections().
+    """
+    global STORAGE_PROFILE
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}'. Choose from: {', '.join(STORAGE_PROFILES)}")
+    STORAGE_PROFILE = name
+
+
+def _apply_storage_profile(conn):
+    settings = STORAGE_PROFILES.get(STORAGE_PROFILE)
+    if settings is None:
+        print(f"[WARN] Unknown storage profile '{STORAGE_PROFILE}', using SQLite defaults")
+        return
+    # journal_mode first: it cannot change inside a transaction, and
+    # synchronous=NORMAL is only safe once WAL is on.
+    conn.execute(f"PRAGMA journal_mode={settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous={settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size={int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store={settings['temp_store']}")
+
+
+def _connect(db_name, **kwargs):
+    conn = sqlite3.connect(db_name, **kwargs)
+    _apply_storage_profile(conn)
+    return conn
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A long-lived connection owned by one thread.
+    The DAO classes still call conn.close() after every query; for a pooled
+    connection that only rolls back anything left uncommitted, exactly like
+    closing a fresh connection used to, and keeps the connection open.
+    Inside a transaction() block commit() and close() are deferred to the
+    end of the unit of work, so DAO methods join it without any changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tx_depth = 0
+
+    def commit(self):
+        global _last_commit, _dirty
+        if self.tx_depth == 0:
+            super().commit()
+            _last_commit = time.monotonic()
+            _dirty = True
+
+    def close(self):
+        if self.tx_depth == 0 and self.in_transaction:
+            self.rollback()
+
+    def shutdown(self):
+        """Really close the underlying SQLite connection."""
+        super().close()
+
+
+class ConnectionManager:
+    """
+    Hands out one persistent connection per thread (and per database file).
+    Connections are created lazily and stay open until close_all() is called,
+    normally when the application shuts down.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+
+    def get(self, db_name=None):
+        db_name = db_name or DB_NAME
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(db_name)
+        if conn is None:
+            # check_same_thread is off only so close_all() can close every
+            # thread's connection at shutdown; each connection is otherwise
+            # only ever used by the thread that created it.
+            conn = _connect(db_name, factory=PooledConnection, check_same_thread=False)
+            conns[db_name] = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close_thread(self):
+        """Close the calling thread's connections (e.g. when a worker thread exits)."""
+        conns = getattr(self._local, "conns", None) or {}
+        for conn in conns.values():
+            with self._lock:
+                if conn in self._all:
+                    self._all.remove(conn)
+            conn.shutdown()
+        conns.clear()
+
+    def close_all(self):
+        """Close every connection handed out by this manager, on all threads."""
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.shutdown()
+            except sqlite3.Error as e:
+                print(f"[ERROR] Failed to close connection: {e}")
+        # Forget the cached connections; threads reconnect lazily on next use.
+        self._local = threading.local()
+
+
+manager = ConnectionManager()
+
+
 def get_connection():
-    """Return a new connection to the main database."""
-    return sqlite3.connect(DB_NAME)
\ No newline at end of file
+    """Return the calling thread's connection to the main database."""
+    conn = manager.get()
+    if not PERSISTENT and not conn.tx_depth:
+        return _connect(DB_NAME)
+    return conn
+
+
+@contextmanager
+def connection():
+    """
+    Context-manager access to the thread's connection:
+
+        with connection() as conn:
+            conn.execute(...)
+
+    Commits on success and rolls back on error; the connection stays open.
+    """
+    conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not getattr(conn, "tx_depth", 0):
+            conn.rollback()
+        raise
+    finally:
+        if not PERSISTENT:
+            conn.close()
+
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: every DAO call made inside the block runs on the thread's
+    connection and is committed once, when the outermost block exits.
+    Any exception rolls the whole unit back.
+
+        with transaction():
+            ReservationDB.add_reservation(...)
+            StockDB.update_stock(...)
+
+    Nested blocks join the outer unit through a savepoint, so an error caught
+    inside an inner block only undoes that block's writes.
+    """
+    conn = manager.get()
+    depth = conn.tx_depth
+    if depth == 0:
+        if conn.in_transaction:
+            # A DAO call that raised before commit()/close() left its implicit
+            # transaction open (and the write lock held); don't adopt its writes.
+            print("[WARN] Rolling back an unfinished transaction left on the connection")
+            conn.rollback()
+        conn.execute("BEGIN IMMEDIATE")
+    else:
+        conn.execute(f"SAVEPOINT uow_{depth}")
+    conn.tx_depth += 1
+    try:
+        yield conn
+    except BaseException:
+        conn.tx_depth -= 1
+        if depth == 0:
+            conn.rollback()
+        else:
+            conn.execute(f"ROLLBACK TO uow_{depth}")
+            conn.execute(f"RELEASE uow_{depth}")
+        raise
+    conn.tx_depth -= 1
+    if depth == 0:
+        conn.commit()
+    else:
+        conn.execute(f"RELEASE uow_{depth}")
+
+
+@contextmanager
+def snapshot():
+    """
+    Read-only unit of work: every read inside the block sees the same committed
+    state of the database (one read transaction), and PRAGMA query_only makes
+    any attempted write fail instead of landing. Inside an open transaction()
+    it simply reuses that transaction's view.
+    """
+    conn = manager.get()
+    if conn.tx_depth:
+        yield conn
+        return
+    if conn.in_transaction:
+        print("[WARN] Rolling back an unfinished transaction left on the connection")
+        conn.rollback()
+    conn.execute("BEGIN")
+    conn.execute("PRAGMA query_only = ON")
+    conn.tx_depth += 1
+    try:
+        yield conn
+    finally:
+        conn.tx_depth -= 1
+        conn.rollback()
+        conn.execute("PRAGMA query_only = OFF")
+
+
+def close_connections():
+    """Close all persistent connections; call once on application shutdown."""
+    manager.close_all()
+
+
+def checkpoint(mode="PASSIVE"):
+    """
+    Copy committed WAL frames back into the database file.
+    PASSIVE never blocks readers or writers; TRUNCATE (used on shutdown) also
+    resets the -wal file to zero bytes. Returns (busy, wal_frames,
+    checkpointed_frames), or None when the database is not in WAL mode.
+    """
+    global _dirty
+    conn = manager.get()
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        return None
+    result = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    _dirty = False
+    return result
+
+
+def checkpoint_if_idle(idle_seconds=None):
+    """Checkpoint once nothing has been committed for idle_seconds; cheap to call on a timer."""
+    idle_seconds = CHECKPOINT_IDLE_SECONDS if idle_seconds is None else idle_seconds
+    if not _dirty or _last_commit is None:
+        return None
+    if time.monotonic() - _last_commit < idle_seconds:
+        return None
+    return checkpoint("PASSIVE")
@@ -0,0 +1,133 @@
+import numpy as np
+
+from db import get_connection
+from recipe_db import RecipeDB, LINE_ITEM_BATCHES_SQL
+from reservation_db import FULFILLED_STATUSES_SQL
+
+
+class DemandPlanner:
+    """
+    Vectorised ingredient demand for what-if planning across many orders.
+
+    The bill of materials (one batch of each recipe) is loaded once into a recipe x
+    metadata matrix and the line items into an order x recipe matrix of the whole
+    batches they need; every per-order and total requirement then falls out of a
+    single matrix multiply:
+
+        requirements (orders x metadata) = demand (orders x recipes) @ bom (recipes x metadata)
+
+    The catalogue is small (tens of recipes, tens of tags), so dense float64
+    arrays are both smaller and faster here than a sparse format would be.
+    """
+
+    def __init__(self, order_ids=None, include_closed=False):
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        if order_ids is None:
+            # Open orders only: shipped, completed and closed ones have used their stock
+            order_filter = "" if include_closed else f"WHERE status NOT IN ({FULFILLED_STATUSES_SQL})"
+            cur.execute(f"SELECT id FROM orders {order_filter} ORDER BY id")
+            order_ids = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT id, output_quantity FROM recipes ORDER BY id")
+        recipes = cur.fetchall()
+        recipe_ids = [r[0] for r in recipes]
+        cur.execute("SELECT id FROM metadata ORDER BY id")
+        metadata_ids = [r[0] for r in cur.fetchall()]
+
+        self.order_ids = np.array(order_ids, dtype=np.int64)
+        self.recipe_ids = np.array(recipe_ids, dtype=np.int64)
+        self.metadata_ids = np.array(metadata_ids, dtype=np.int64)
+        # units per batch, for turning unit quantities into whole batches
+        self.yields = np.array([max(r[1] or 1, 1) for r in recipes], dtype=float)
+        self._order_index = {oid: i for i, oid in enumerate(order_ids)}
+        self._recipe_index = {rid: i for i, rid in enumerate(recipe_ids)}
+        self._metadata_index = {mid: i for i, mid in enumerate(metadata_ids)}
+
+        # recipe x metadata bill of materials, sub-recipes expanded
+        cur.execute("SELECT recipe_id, metadata_id, quantity FROM recipe_bom")
+        self.bom = np.zeros((len(recipe_ids), len(metadata_ids)))
+        rows = [(self._recipe_index.get(r), self._metadata_index.get(m), q) for r, m, q in cur.fetchall()]
+        rows = [row for row in rows if row[0] is not None and row[1] is not None]
+        if rows:
+            r_idx, m_idx, qty = zip(*rows)
+            np.add.at(self.bom, (list(r_idx), list(m_idx)), qty)
+
+        # order x recipe batches (each line item rounded up on its own), read in one pass over line_items
+        cur.execute(f"""
+            SELECT li.order_id, li.recipe_id, {LINE_ITEM_BATCHES_SQL}
+            FROM line_items li
+            JOIN recipes r ON r.id = li.recipe_id
+        """)
+        self.demand = np.zeros((len(order_ids), len(recipe_ids)))
+        rows = [(self._order_index.get(o), self._recipe_index.get(r), q) for o, r, q in cur.fetchall()]
+        rows = [row for row in rows if row[0] is not None and row[1] is not None]
+        if rows:
+            o_idx, r_idx, qty = zip(*rows)
+            np.add.at(self.demand, (list(o_idx), list(r_idx)), qty)
+
+        # stock on hand and reserved quantities, both from the trigger-maintained totals
+        cur.execute("SELECT metadata_id, quantity FROM stock_metadata_totals")
+        self.available = self._metadata_vector(cur.fetchall())
+        cur.execute("SELECT order_id, metadata_id, quantity FROM reservation_totals")
+        self.reserved = np.zeros((len(order_ids), len(metadata_ids)))
+        for order_id, metadata_id, qty in cur.fetchall():
+            o, m = self._order_index.get(order_id), self._metadata_index.get(metadata_id)
+            if o is not None and m is not None:
+                self.reserved[o, m] += qty
+        conn.close()
+
+        self.requirements = self.demand @ self.bom
+
+    def _metadata_vector(self, pairs):
+        vec = np.zeros(len(self.metadata_ids))
+        for metadata_id, qty in pairs:
+            m = self._metadata_index.get(metadata_id)
+            if m is not None and qty is not None:
+                vec[m] += qty
+        return vec
+
+    def _as_dict(self, vec):
+        nz = np.nonzero(vec)[0]
+        return {int(self.metadata_ids[m]): float(vec[m]) for m in nz}
+
+    def batches_for(self, demand):
+        """Whole batches for a demand in units (recipe vector or order x recipe matrix)."""
+        return np.ceil(np.asarray(demand, dtype=float) / self.yields)
+
+    def requirements_for(self, demand):
+        """
+        Requirements (orders x metadata) for any order x recipe demand matrix in units,
+        e.g. a what-if scenario; each entry is made in whole batches.
+        """
+        return self.batches_for(demand) @ self.bom
+
+    def totals(self):
+        """Total required quantity per ingredient: {metadata_id: qty}."""
+        return self._as_dict(self.requirements.sum(axis=0))
+
+    def per_order(self):
+        """Required quantities per order: {order_id: {metadata_id: qty}}."""
+        return {int(oid): self._as_dict(self.requirements[i]) for i, oid in enumerate(self.order_ids)}
+
+    def shortage_vector(self, extra_demand=None):
+        """
+        Shortage per ingredient, aligned with self.metadata_ids:
+        max(required - reserved - available, 0). extra_demand is an optional
+        recipe-length vector of additional units to plan for, made in whole batches.
+        """
+        required = self.requirements.sum(axis=0)
+        if extra_demand is not None:
+            required = required + self.batches_for(extra_demand) @ self.bom
+        return np.maximum(required - self.reserved.sum(axis=0) - self.available, 0)
+
+    def shortages(self, extra_demand=None):
+        """Ingredients that have to be bought: {metadata_id: shortage}."""
+        return self._as_dict(self.shortage_vector(extra_demand))
+
+    def recipe_vector(self, quantities):
+        """Build a recipe-length demand vector in units from {recipe_id: quantity}."""
+        vec = np.zeros(len(self.recipe_ids))
+        for recipe_id, qty in quantities.items():
+            vec[self._recipe_index[recipe_id]] += qty
+        return vec
@@ -0,0 +1,104 @@
+from datetime import date, datetime, timedelta
+
+from db import get_connection
+from Stock_db import StockDB
+from reservation_db import FULFILLED_LINE_ITEMS_SQL
+
+
+class ExpiryLogic:
+    """
+    Expiring-soon lookups and the expired-stock sweep, all on the normalised,
+    indexed stock.expiry_on column (see StockDB.init_expiry_column).
+    """
+
+    @staticmethod
+    def get_expiring(days=7, metadata_id=None, include_expired=False, today=None):
+        """
+        Batches with stock left that expire within `days` days, soonest first.
+        Already expired batches are included only with include_expired.
+        Returns a list of dicts:
+        {"StockID", "IngredientID", "MetadataID", "Quantity", "ExpiryDate", "BatchNumber"}
+        """
+        today = today or date.today()
+        params = [(today + timedelta(days=days)).isoformat()]
+        where = ["s.quantity > 0", "s.expiry_on <= ?"]
+        if not include_expired:
+            where.append("s.expiry_on >= ?")
+            params.append(today.isoformat())
+        if metadata_id is not None:
+            where.append("i.metadata_id = ?")
+            params.append(metadata_id)
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT s.id, s.ingredient_id, i.metadata_id, s.quantity, s.expiry_on, s.batch_number
+            FROM stock s
+            JOIN ingredients i ON i.id = s.ingredient_id
+            WHERE {" AND ".join(where)}
+            ORDER BY s.expiry_on, s.id
+        """, params)
+        rows = cur.fetchall()
+        conn.close()
+        return [
+            {
+                "StockID": r[0],
+                "IngredientID": r[1],
+                "MetadataID": r[2],
+                "Quantity": r[3],
+                "ExpiryDate": r[4],
+                "BatchNumber": r[5],
+            }
+            for r in rows
+        ]
+
+    @staticmethod
+    def get_expiring_by_metadata(days=7, today=None):
+        """Quantity expiring within `days` days per metadata tag: {metadata_id: qty}."""
+        today = today or date.today()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT i.metadata_id, SUM(s.quantity)
+            FROM stock s
+            JOIN ingredients i ON i.id = s.ingredient_id
+            WHERE s.quantity > 0 AND s.expiry_on BETWEEN ? AND ?
+            GROUP BY i.metadata_id
+        """, (today.isoformat(), (today + timedelta(days=days)).isoformat()))
+        rows = cur.fetchall()
+        conn.close()
+        return dict(rows)
+
+    @staticmethod
+    def sweep_expired(today=None):
+        """
+        Write off the unreserved quantity of every batch that expired before today and
+        flag the open orders' reservations still pointing at expired batches as 'expired'
+        (fulfilled orders' reservations record stock already used), in one
+        transaction. Reserved quantities are left alone: releasing a flagged
+        reservation returns it to its batch and the next sweep writes it off.
+        The write-offs are booked in the stock ledger as 'write_off' movements.
+        Returns {"batches": n, "quantity": total written off, "reservations": n flagged}.
+        """
+        today = (today or date.today()).isoformat()
+        with StockDB.movement("write_off") as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM stock WHERE quantity > 0 AND expiry_on < ?",
+                (today,)
+            )
+            batches, quantity = cur.fetchone()
+            cur.execute(
+                "UPDATE stock SET quantity = 0, last_updated = ? WHERE quantity > 0 AND expiry_on < ?",
+                (datetime.now().isoformat(), today)
+            )
+            cur.execute(f"""
+                UPDATE reservations SET status = 'expired'
+                WHERE status IS NOT 'expired'
+                  AND lineitem_id NOT IN ({FULFILLED_LINE_ITEMS_SQL})
+                  AND EXISTS (
+                      SELECT 1 FROM stock s
+                      WHERE s.id = reservations.ingredient_stock_id AND s.expiry_on < ?
+                  )
+            """, (today,))
+            flagged = cur.rowcount
+        return {"batches": batches, "quantity": quantity, "reservations": flagged}
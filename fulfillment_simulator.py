@@ -0,0 +1,111 @@
+from datetime import date, datetime
+
+from db import snapshot
+from allocation_logic import AllocationLogic, BatchHeap, ExpiryLadder, _plain_date
+from reservation_db import ReservationDB
+from recipe_db import RecipeDB, batches_needed
+
+
+class FulfillmentSimulator:
+    """
+    Read-only "what-if" fulfilment checks.
+
+    The open orders, what they already hold, the usable stock batches and the
+    recipe ingredients are read once from one consistent snapshot; hypothetical
+    orders and purchases are then layered on in memory and every run() replays
+    the multi-order allocator against a fresh copy of the stock. Nothing is ever
+    written: the snapshot is read under PRAGMA query_only.
+
+        sim = FulfillmentSimulator(until=date.today() + timedelta(days=7))
+        new_order = sim.add_order({recipe_id: 500}, delivery_date="2025-06-13")
+        result = sim.run()
+        result["feasible"], result["shortfalls"].get(new_order)
+    """
+
+    def __init__(self, until=None):
+        """until: only orders due on or before this date (date or date string) are simulated."""
+        self.until = None if until is None else _plain_date(until)
+        if until is not None and self.until is None:
+            raise ValueError(f"until '{until}' is not a date")
+        with snapshot() as conn:
+            cur = conn.cursor()
+            # A stale BOM cache is expanded in memory rather than refreshed: nothing here writes
+            self._bom = RecipeDB.read_bom(conn)
+            orders, needs = AllocationLogic.load_open_order_needs(conn, self._bom)
+            if self.until is not None:
+                # Orders with no or an unparseable delivery date are not due by any date
+                due = [(order, _plain_date(order[1])) for order in orders]
+                orders = [order for order, day in due if day is not None and day <= self.until]
+            self._orders = orders
+            self._needs = {order[0]: needs.get(order[0], []) for order in orders}
+            self._reserved = ReservationDB.get_reserved_qty_for_orders([o[0] for o in orders])
+
+            cur.execute("SELECT id, output_quantity FROM recipes")
+            self._yields = dict(cur.fetchall())
+            cur.execute("SELECT id, metadata_id, size FROM ingredients")
+            self._ingredients = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+            cur.execute("SELECT id FROM metadata")
+            self._batches = AllocationLogic.load_batch_rows(conn, [row[0] for row in cur.fetchall()])
+        self.reset()
+
+    def reset(self):
+        """Drop every hypothetical order and purchase."""
+        self._extra_orders = []
+        self._extra_needs = {}
+        self._extra_batches = {}
+        self._next_id = -1
+
+    def _new_id(self):
+        new_id, self._next_id = self._next_id, self._next_id - 1
+        return new_id
+
+    def add_order(self, recipes, delivery_date=None, status="New Order"):
+        """
+        Add a hypothetical order: recipes is {recipe_id: quantity}, as on its line items,
+        each made in whole batches of the recipe's output_quantity.
+        Returns the (negative) order id its shortfalls are reported under.
+        """
+        order_id = self._new_id()
+        if isinstance(delivery_date, (date, datetime)):
+            delivery_date = delivery_date.isoformat()[:10]
+        needs = []
+        for recipe_id, quantity in recipes.items():
+            lineitem_id = self._new_id()
+            batches = batches_needed(quantity, self._yields.get(recipe_id))
+            for metadata_id, qty in self._bom.get(recipe_id, []):
+                needs.append((lineitem_id, metadata_id, qty * batches))
+        self._extra_orders.append((order_id, delivery_date, status))
+        self._extra_needs[order_id] = needs
+        return order_id
+
+    def add_purchase(self, ingredient_id, quantity, expiry_date=None):
+        """
+        Add a hypothetical delivery of `quantity` units of an ingredient (quantity x size
+        in stock, as PurchasesLogic.add_purchase books it). Returns its (negative) batch id.
+        """
+        metadata_id, size = self._ingredients[ingredient_id]
+        stock_id = self._new_id()
+        if isinstance(expiry_date, (date, datetime)):
+            expiry_date = expiry_date.isoformat()[:10]
+        self._extra_batches.setdefault(metadata_id, []).append((stock_id, expiry_date, quantity * (size or 1)))
+        return stock_id
+
+    def run(self, mode="optimal"):
+        """
+        Allocate the snapshot plus the hypotheticals, most urgent order first.
+        mode is "greedy" or "optimal" as in AllocationLogic.allocate_open_orders.
+        Returns {"feasible": bool, "shortfalls": {order_id: {metadata_id: qty}},
+                 "allocations": [(lineitem_id, stock_id, qty, status)]}.
+        """
+        if mode not in ("greedy", "optimal"):
+            raise ValueError("mode must be 'greedy' or 'optimal'")
+        orders = sorted(self._orders + self._extra_orders, key=AllocationLogic.order_priority)
+        needs = {**self._needs, **self._extra_needs}
+        pool_type = BatchHeap if mode == "greedy" else ExpiryLadder
+        metadata_ids = set(self._batches) | set(self._extra_batches)
+        pools = {
+            metadata_id: pool_type(self._batches.get(metadata_id, []) + self._extra_batches.get(metadata_id, []))
+            for metadata_id in metadata_ids
+        }
+        allocations, shortfalls = AllocationLogic.allocate_orders(orders, needs, self._reserved, pools, mode)
+        return {"feasible": not shortfalls, "shortfalls": shortfalls, "allocations": allocations}
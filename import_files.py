@@ -0,0 +1,143 @@
+import csv
+import functools
+import hashlib
+import json
+import os
+
+# Streaming readers for the CSV / JSON import pipelines. Rows come out one at a
+# time as dicts with lower-cased, underscore-separated keys, so a 50k-line file
+# never has to fit in memory.
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_hash(path):
+    """SHA-256 of the file's bytes, read in chunks; identifies a file that was already imported."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_key(key):
+    return "_".join(str(key or "").strip().lower().replace("-", " ").split())
+
+
+def _normalize(row):
+    return {_normalize_key(k): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k is not None}
+
+
+def _iter_json_array(f):
+    """
+    Yield the elements of a top-level JSON array, or of the array under the "lines" key
+    of a top-level object, without loading the file. Other keys of the object are
+    decoded and skipped; anything else is rejected with ValueError.
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(CHUNK_SIZE)
+    pos = 0
+    eof = not buf
+
+    def fill():
+        nonlocal buf, pos, eof
+        more = f.read(CHUNK_SIZE)
+        if not more:
+            eof = True
+        buf = buf[pos:] + more
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def expect(char, message):
+        nonlocal pos
+        skip(" \t\r\n")
+        if buf[pos:pos + 1] != char:
+            raise ValueError(message)
+        pos += 1
+
+    def decode():
+        # A value touching the end of the buffer may be cut short (e.g. a number), so read on
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    skip(" \t\r\n")
+    if buf[pos:pos + 1] == "{":
+        # {"lines": [...], ...} wrapper: skip the other keys until "lines"
+        pos += 1
+        while True:
+            skip(" \t\r\n,")
+            if buf[pos:pos + 1] != '"':
+                raise ValueError('JSON object has no "lines" array of rows')
+            key = decode()
+            expect(":", "invalid JSON object")
+            skip(" \t\r\n")
+            if key == "lines":
+                break
+            decode()
+    expect("[", 'JSON file must contain an array of rows, or an object with a "lines" array')
+    while True:
+        skip(" \t\r\n,")
+        if pos >= len(buf):
+            raise ValueError("JSON array is not closed")
+        if buf[pos] == "]":
+            return
+        yield decode()
+
+
+def read_rows(path):
+    """
+    Yield (line_number, row) for each record of a .csv, .json (array of objects) or
+    .jsonl / .ndjson (one object per line) file. line_number is the 1-based record
+    number (for CSV, the data row under the header) used in rejection reports.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for number, row in enumerate(csv.DictReader(f), start=1):
+                yield number, _normalize(row)
+    elif ext in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            number = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield number, {"_error": f"invalid JSON ({e.msg})"}
+                    continue
+                yield number, _normalize(row) if isinstance(row, dict) else {"_error": "not an object"}
+    elif ext == ".json":
+        with open(path, encoding="utf-8") as f:
+            for number, row in enumerate(_iter_json_array(f), start=1):
+                yield number, _normalize(row) if isinstance(row, dict) else {"_error": "not an object"}
+    else:
+        raise ValueError(f"Unsupported file type '{ext}'. Use .csv, .json or .jsonl")
+
+
+def parse_number(value):
+    """A float from a cell (None for blank); ValueError otherwise."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).replace(" ", ""))
@@ -1,4 +1,6 @@
 from ingredient_db import IngredientDB
+from metadata_db import MetadataDB
+import units
 
 class IngredientLogic:
     @staticmethod
@@ -6,13 +8,28 @@ class IngredientLogic:
         return IngredientDB.get_ingredients()
 
     @staticmethod
-    def add_ingredient(name, size, metadata_id):
+    def size_in_base_unit(size, metadata_id, unit=None):
+        """Pack size in the tag's base unit; unit defaults to that base unit."""
+        if not isinstance(size, (int, float)) or size <= 0:
+            raise ValueError("Size must be a positive number.")
+        if unit is None:
+            return size
+        info = MetadataDB.get_unit_info(metadata_id)
+        if not info:
+            raise ValueError("Invalid metadata ID.")
+        base, density = info
+        return units.convert(size, unit, base, density)
+
+    @staticmethod
+    def add_ingredient(name, size, metadata_id, unit=None):
+        size = IngredientLogic.size_in_base_unit(size, metadata_id, unit)
         IngredientDB.add_ingredient(name, size, metadata_id)
 
     @staticmethod
-    def update_ingredient(ingredient_id, name, size, metadata_id):
+    def update_ingredient(ingredient_id, name, size, metadata_id, unit=None):
+        size = IngredientLogic.size_in_base_unit(size, metadata_id, unit)
         IngredientDB.update_ingredient(ingredient_id, name, size, metadata_id)
 
     @staticmethod
     def delete_ingredient(ingredient_id):
-        IngredientDB.delete_ingredient(ingredient_id)
\ No newline at end of file
+        IngredientDB.delete_ingredient(ingredient_id)
@@ -1,6 +1,7 @@
 from PyQt5 import QtWidgets
 from ingredient_logic import IngredientLogic
 from metadata_logic import MetadataLogic
+import units
 
 class IngredientsPopup(QtWidgets.QWidget):
     def __init__(self):
@@ -24,7 +25,7 @@ class IngredientsPopup(QtWidgets.QWidget):
         # --- Inputs ---
         form_layout = QtWidgets.QHBoxLayout()
         self.name_input = QtWidgets.QLineEdit(); self.name_input.setPlaceholderText("Name")
-        self.size_input = QtWidgets.QLineEdit(); self.size_input.setPlaceholderText("Size")
+        self.size_input = QtWidgets.QLineEdit(); self.size_input.setPlaceholderText("Size (e.g. 2.5 kg)")
         self.meta_input = QtWidgets.QComboBox()
         form_layout.addWidget(self.name_input)
         form_layout.addWidget(self.size_input)
@@ -85,14 +86,18 @@ class IngredientsPopup(QtWidgets.QWidget):
             QtWidgets.QMessageBox.warning(self, "Error", "Name cannot be empty")
             return
         try:
-            size = float(size_text)
+            size, unit = units.parse_quantity(size_text)
         except ValueError:
-            QtWidgets.QMessageBox.warning(self, "Error", "Size must be a number")
+            QtWidgets.QMessageBox.warning(self, "Error", "Size must be a number, optionally with a unit (e.g. 2.5 kg)")
             return
         if meta_id == -1:
             QtWidgets.QMessageBox.warning(self, "Error", "Please select a metadata tag")
             return
-        IngredientLogic.add_ingredient(name, size, meta_id)
+        try:
+            IngredientLogic.add_ingredient(name, size, meta_id, unit)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Error", str(e))
+            return
         self.refresh_table()
         self.clear_form()
 
@@ -109,11 +114,15 @@ class IngredientsPopup(QtWidgets.QWidget):
             QtWidgets.QMessageBox.warning(self, "Error", "Name cannot be empty")
             return
         try:
-            size = float(size_text)
+            size, unit = units.parse_quantity(size_text)
         except ValueError:
-            QtWidgets.QMessageBox.warning(self, "Error", "Size must be a number")
+            QtWidgets.QMessageBox.warning(self, "Error", "Size must be a number, optionally with a unit (e.g. 2.5 kg)")
+            return
+        try:
+            IngredientLogic.update_ingredient(ing_id, name, size, meta_id, unit)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Error", str(e))
             return
-        IngredientLogic.update_ingredient(ing_id, name, size, meta_id)
         self.refresh_table()
         self.clear_form()
 
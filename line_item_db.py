@@ -1,4 +1,5 @@
-from db import get_connection
+from db import get_connection, chunked
+from recipe_db import RecipeDB, LINE_ITEM_BATCHES_SQL
 
 class LineItemDB:
 
@@ -8,23 +9,42 @@ class LineItemDB:
         Aggregate required quantity for each ingredient (metadata_id) for the given order.
         Returns a dict: {metadata_id: required_qty}
         """
-        from recipe_db import RecipeDB
+        return LineItemDB.get_required_ingredients_for_orders([order_id]).get(order_id, {})
+
+    @staticmethod
+    def get_required_ingredients_for_orders(order_ids=None):
+        """
+        Aggregate required quantities per ingredient (metadata_id) for many orders at once,
+        with one grouped join over line_items and the flattened recipe BOM (sub-recipes expanded).
+        Pass None for every order.
+        Returns a dict: {order_id: {metadata_id: required_qty}}
+        """
+        query = f"""
+            SELECT li.order_id, b.metadata_id, SUM(b.quantity * {LINE_ITEM_BATCHES_SQL})
+            FROM line_items li
+            JOIN recipes r ON r.id = li.recipe_id
+            JOIN recipe_bom b ON b.recipe_id = li.recipe_id
+            LEFT JOIN metadata m ON m.id = b.metadata_id
+            {{where}}
+            GROUP BY li.order_id, b.metadata_id
+            ORDER BY li.order_id, MIN(li.id), MIN(b.position)
+        """
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        rows = []
+        if order_ids is None:
+            cur.execute(query.format(where=""))
+            rows = cur.fetchall()
+        else:
+            for chunk in chunked(order_ids):
+                where = f"WHERE li.order_id IN ({','.join(['?'] * len(chunk))})"
+                cur.execute(query.format(where=where), chunk)
+                rows.extend(cur.fetchall())
+        conn.close()
         required = {}
-        items = LineItemDB.get_order_items(order_id)
-        for item in items:
-            lineitem_id = item[0]
-            quantity = item[3]
-            recipe_id = LineItemDB.get_recipe_id(lineitem_id)
-            if not recipe_id:
-                continue
-            ingredients = RecipeDB.get_recipe_ingredients(recipe_id)
-            for ing in ingredients:
-                metadata_id = ing[2]
-                per_recipe_amt = ing[3]
-                total_needed = per_recipe_amt * quantity
-                if metadata_id not in required:
-                    required[metadata_id] = 0
-                required[metadata_id] += total_needed
+        for order_id, metadata_id, qty in rows:
+            required.setdefault(order_id, {})[metadata_id] = qty
         return required
 
     @staticmethod
@@ -33,16 +53,29 @@ class LineItemDB:
         For each required ingredient in the order, return required, reserved, and ready status.
         Returns a dict: {metadata_id: {"required": x, "reserved": y, "ready": bool}}
         """
+        return LineItemDB.get_reservation_status_for_orders([order_id]).get(order_id, {})
+
+    @staticmethod
+    def get_reservation_status_for_orders(order_ids=None):
+        """
+        Required, reserved and ready per (order, ingredient) for a whole list of orders,
+        from one requirements query and one reservations query. Pass None for every order.
+        Returns a dict: {order_id: {metadata_id: {"required": x, "reserved": y, "ready": bool}}}
+        """
         from reservation_db import ReservationDB
-        required = LineItemDB.get_required_ingredients_for_order(order_id)
+        required = LineItemDB.get_required_ingredients_for_orders(order_ids)
+        reserved = ReservationDB.get_reserved_qty_for_orders(order_ids)
         status = {}
-        for metadata_id, req_qty in required.items():
-            reserved_qty = ReservationDB.get_reserved_qty_for_order(order_id, metadata_id)
-            status[metadata_id] = {
-                "required": req_qty,
-                "reserved": reserved_qty,
-                "ready": reserved_qty >= req_qty
-            }
+        for order_id, needs in required.items():
+            order_reserved = reserved.get(order_id, {})
+            status[order_id] = {}
+            for metadata_id, req_qty in needs.items():
+                reserved_qty = order_reserved.get(metadata_id, 0)
+                status[order_id][metadata_id] = {
+                    "required": req_qty,
+                    "reserved": reserved_qty,
+                    "ready": reserved_qty >= req_qty
+                }
         return status
 
     @staticmethod
@@ -98,6 +131,24 @@ class LineItemDB:
         conn.close()
         return row[0] if row else None
 
+    @staticmethod
+    def get_recipe_batches(lineitem_id):
+        """
+        (recipe_id, batches) for a line item: the whole batches of its recipe needed for
+        its quantity, which is what the flattened BOM is multiplied by. (None, 0) if missing.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT li.recipe_id, {LINE_ITEM_BATCHES_SQL}
+            FROM line_items li
+            JOIN recipes r ON r.id = li.recipe_id
+            WHERE li.id = ?
+        """, (lineitem_id,))
+        row = cur.fetchone()
+        conn.close()
+        return (row[0], row[1]) if row else (None, 0)
+
     @staticmethod
     def add_order_item(order_id, recipe_id, quantity):
         """Add a new line item to an order."""
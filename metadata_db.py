@@ -1,4 +1,5 @@
 from db import get_connection
+import units
 
 class MetadataDB:
     @staticmethod
@@ -33,7 +34,7 @@ class MetadataDB:
     def get_all_metadata():
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT id, name, description, unit FROM metadata")
+        cur.execute("SELECT id, name, description, unit, density FROM metadata")
         rows = cur.fetchall()
         conn.close()
         return rows
@@ -55,4 +56,92 @@ class MetadataDB:
         cur = conn.cursor()
         cur.execute("DELETE FROM metadata WHERE id=?", (metadata_id,))
         conn.commit()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    # ------------------ Units ------------------
+    @staticmethod
+    def get_unit_info(metadata_id):
+        """(unit, density) for a tag; unit is its base unit, density grams per ml or None."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT unit, density FROM metadata WHERE id=?", (metadata_id,))
+        row = cur.fetchone()
+        conn.close()
+        return row
+
+    @staticmethod
+    def set_density(metadata_id, density):
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("UPDATE metadata SET density=? WHERE id=?", (density, metadata_id))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def is_in_use(metadata_id):
+        """True if any ingredient or recipe quantity is stored in this tag's unit."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM ingredients WHERE metadata_id = ?)
+                OR EXISTS (SELECT 1 FROM recipe_ingredients WHERE metadata_id = ?)
+        """, (metadata_id, metadata_id))
+        in_use = bool(cur.fetchone()[0])
+        conn.close()
+        return in_use
+
+    @staticmethod
+    def normalize_units(conn):
+        """
+        Add metadata.density and rewrite every stored quantity into its tag's base unit
+        (g, ml or pcs): a 'kg' tag becomes 'g' with ingredient sizes, stock, reservations
+        and recipe quantities scaled by 1000, and recipe lines entered in another unit of
+        the same dimension are converted to the tag's unit. Tags with a unit the registry
+        does not know are left alone and reported.
+        """
+        from Stock_db import StockDB
+        cur = conn.cursor()
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(metadata)")]
+        if "density" not in columns:
+            cur.execute("ALTER TABLE metadata ADD COLUMN density REAL")
+
+        cur.execute("SELECT id, name, unit FROM metadata")
+        for metadata_id, name, unit in cur.fetchall():
+            try:
+                base = units.base_unit(unit)
+                factor = units.convert(1, unit, base)
+            except ValueError:
+                print(f"[WARN] Tag '{name}' has unknown unit '{unit}'; its quantities were not converted")
+                continue
+            if factor != 1:
+                cur.execute("UPDATE ingredients SET size = size * ? WHERE metadata_id = ?", (factor, metadata_id))
+                with StockDB.movement("unit_conversion", "metadata", metadata_id):
+                    cur.execute("""
+                        UPDATE stock SET quantity = quantity * ?
+                        WHERE ingredient_id IN (SELECT id FROM ingredients WHERE metadata_id = ?)
+                    """, (factor, metadata_id))
+                cur.execute("""
+                    UPDATE reservations SET qty = qty * ?
+                    WHERE ingredient_stock_id IN (
+                        SELECT s.id FROM stock s JOIN ingredients i ON i.id = s.ingredient_id
+                        WHERE i.metadata_id = ?
+                    )
+                """, (factor, metadata_id))
+            cur.execute("UPDATE metadata SET unit = ? WHERE id = ?", (base, metadata_id))
+
+            # Recipe lines: one UPDATE per distinct unit used for this tag
+            cur.execute(
+                "SELECT DISTINCT unit FROM recipe_ingredients WHERE metadata_id = ? AND unit IS NOT ?",
+                (metadata_id, base)
+            )
+            for (ri_unit,) in cur.fetchall():
+                try:
+                    ri_factor = units.convert(1, ri_unit or unit, base)
+                except ValueError:
+                    print(f"[WARN] Recipe lines for '{name}' in '{ri_unit}' could not be converted to {base}")
+                    continue
+                cur.execute(
+                    "UPDATE recipe_ingredients SET quantity = quantity * ?, unit = ? WHERE metadata_id = ? AND unit IS ?",
+                    (ri_factor, base, metadata_id, ri_unit)
+                )
+
@@ -1,4 +1,5 @@
 from metadata_db import MetadataDB
+import units
 
 class MetadataLogic:
     @staticmethod
@@ -11,18 +12,51 @@ class MetadataLogic:
                 "Name": r[1],
                 "Description": r[2],
                 "Unit": r[3],
+                "Density": r[4],
             }
             for r in rows
         ]
 
     @staticmethod
-    def add_metadata(name, description, unit):
-        MetadataDB.add_metadata(name, description, unit)
+    def _validate_density(density):
+        if density is not None and (not isinstance(density, (int, float)) or density <= 0):
+            raise ValueError("Density must be a positive number of grams per ml.")
 
     @staticmethod
-    def update_metadata(metadata_id, name, description, unit):
+    def add_metadata(name, description, unit, density=None):
+        # Tags always store their base unit: 'kg' is kept as 'g'
+        unit = units.base_unit(unit)
+        MetadataLogic._validate_density(density)
+        metadata_id = MetadataDB.add_metadata(name, description, unit)
+        if density is not None:
+            MetadataDB.set_density(metadata_id, density)
+        return metadata_id
+
+    @staticmethod
+    def update_metadata(metadata_id, name, description, unit, density=None):
+        """
+        Update a tag. density=None keeps the stored density and 0 clears it. A legacy
+        tag whose unit is not in the unit registry keeps that unit as long as it is
+        passed back unchanged.
+        """
+        current = MetadataDB.get_unit_info(metadata_id)
+        try:
+            unit = units.base_unit(unit)
+        except ValueError:
+            if not current or (unit or "").strip() != current[0]:
+                raise
+            unit = current[0]
+        if density != 0:
+            MetadataLogic._validate_density(density)
+        if current and current[0] != unit and MetadataDB.is_in_use(metadata_id):
+            raise ValueError(
+                f"Quantities for this tag are stored in {current[0]}; "
+                "it cannot switch units while ingredients or recipes use it."
+            )
         MetadataDB.update_metadata(metadata_id, name, description, unit)
+        if density is not None:
+            MetadataDB.set_density(metadata_id, density or None)
 
     @staticmethod
     def delete_metadata(metadata_id):
-        MetadataDB.delete_metadata(metadata_id)
\ No newline at end of file
+        MetadataDB.delete_metadata(metadata_id)
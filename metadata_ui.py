@@ -55,9 +55,16 @@ class MetadataPopup(QtWidgets.QWidget):
         if not ok2:
             return
         unit, ok3 = QInputDialog.getText(self, "Add Metadata", "Unit (e.g. g, ml, pcs):")
-        if ok3 and unit.strip():
-            MetadataLogic.add_metadata(name.strip(), desc.strip() if desc else "", unit.strip())
+        if not ok3 or not unit.strip():
+            return
+        density, ok4 = QInputDialog.getDouble(self, "Add Metadata", "Density in g per ml (0 if unknown):", 0, 0, 100, 3)
+        if not ok4:
+            return
+        try:
+            MetadataLogic.add_metadata(name.strip(), desc.strip() if desc else "", unit.strip(), density or None)
             self.refresh_table()
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
 
     def edit_metadata(self):
         selected = self.table.currentRow()
@@ -71,9 +78,18 @@ class MetadataPopup(QtWidgets.QWidget):
         if not ok2:
             return
         unit, ok3 = QInputDialog.getText(self, "Edit Metadata", "Unit (e.g. g, ml, pcs):", text=metadata["Unit"] or "")
-        if ok3 and unit.strip():
-            MetadataLogic.update_metadata(metadata["ID"], name.strip(), desc.strip() if desc else "", unit.strip())
+        if not ok3 or not unit.strip():
+            return
+        density, ok4 = QInputDialog.getDouble(
+            self, "Edit Metadata", "Density in g per ml (0 if unknown):", metadata["Density"] or 0, 0, 100, 3
+        )
+        if not ok4:
+            return
+        try:
+            MetadataLogic.update_metadata(metadata["ID"], name.strip(), desc.strip() if desc else "", unit.strip(), density)
             self.refresh_table()
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
 
     def delete_metadata(self):
         selected = self.table.currentRow()
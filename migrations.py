@@ -0,0 +1,172 @@
+from db import get_connection, transaction
+
+# Schema migrations, applied in order and exactly once per database.
+# The schema version lives in PRAGMA user_version; a database that is
+# already current costs a single PRAGMA read at start-up.
+#
+# To change the schema, append a new function to MIGRATIONS. Never edit or
+# reorder a migration that has already shipped.
+
+
+def _create_tables(conn):
+    """Version 1: the original tables (no-op on databases that already have them)."""
+    from ingredient_db import IngredientDB
+    from Stock_db import StockDB
+    from recipe_db import RecipeDB
+    from purchases_db import PurchaseDB
+    from metadata_db import MetadataDB
+    from customer_db import CustomerDB
+    from order_db import OrderDB
+    from line_item_db import LineItemDB
+    from reservation_db import ReservationDB
+    from recipe_ingredients import RecipeIngredientDB
+
+    IngredientDB.init_ingredient_db(conn)
+    StockDB.init_stock_db(conn)
+    RecipeDB.init_recipe_db(conn)
+    MetadataDB.init_metadata_db(conn)
+    PurchaseDB.init_ingredient_purchases_db(conn)
+    CustomerDB.init_customer_db(conn)
+    OrderDB.init_orders_table(conn)
+    ReservationDB.init_reservations_db(conn)
+    LineItemDB.init_line_items_table(conn)
+    RecipeIngredientDB.init_recipe_ingredients_db(conn)
+
+
+def _add_foreign_key_indexes(conn):
+    """Version 2: index the foreign-key columns every join and filter goes through."""
+    cur = conn.cursor()
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_ingredient ON stock(ingredient_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ingredients_metadata ON ingredients(metadata_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_line_items_order ON line_items(order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_lineitem ON reservations(lineitem_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_stock ON reservations(ingredient_stock_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_ingredient ON ingredient_purchases(ingredient_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe ON recipe_ingredients(recipe_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id)")
+
+
+def _add_partial_indexes(conn):
+    """Version 3: partial indexes over the rows the allocator and order lists actually read."""
+    cur = conn.cursor()
+    # Batches that still have something in them, in FEFO order
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_in_stock
+        ON stock(ingredient_id, expiry_date, id)
+        WHERE quantity > 0
+    """)
+    # Orders still being worked on, by delivery date
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_open
+        ON orders(delivery_date, id)
+        WHERE status <> 'Closed'
+    """)
+
+
+def _add_stock_totals(conn):
+    """Version 4: trigger-maintained availability totals per ingredient and per metadata tag."""
+    from Stock_db import StockDB
+    StockDB.init_stock_totals(conn)
+
+
+def _add_reservation_totals(conn):
+    """Version 5: trigger-maintained reserved quantity per order and metadata tag."""
+    from reservation_db import ReservationDB
+    ReservationDB.init_reservation_totals(conn)
+
+
+def _add_stock_movements(conn):
+    """Version 6: append-only stock movement ledger with balance snapshots."""
+    from Stock_db import StockDB
+    StockDB.init_stock_movements(conn)
+
+
+def _add_expiry_column(conn):
+    """Version 7: normalised, indexed expiry date on stock batches."""
+    from Stock_db import StockDB
+    StockDB.init_expiry_column(conn)
+
+
+def _add_reservation_ttl(conn):
+    """Version 8: reservation TTLs (reserved_until) and the index the lapse sweep uses."""
+    from reservation_db import ReservationDB
+    ReservationDB.init_reservation_ttl(conn)
+
+
+def _add_recipe_components(conn):
+    """Version 9: sub-recipes (recipe_components) and the cached flattened BOM."""
+    from recipe_db import RecipeDB
+    RecipeDB.init_recipe_components(conn)
+
+
+def _normalize_units(conn):
+    """Version 10: store every quantity in its metadata tag's base unit (g, ml, pcs)."""
+    from metadata_db import MetadataDB
+    MetadataDB.normalize_units(conn)
+
+
+def _add_ingredient_costs(conn):
+    """Version 11: running purchase costs per ingredient for recipe costing."""
+    from costing_db import CostingDB
+    CostingDB.init_costs(conn)
+
+
+def _add_stock_purchase_index(conn):
+    """Version 12: index stock.purchase_id, the batch-to-purchase link the valuation follows."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_purchase ON stock(purchase_id)")
+
+
+def _add_purchase_imports(conn):
+    """Version 13: content hashes of imported invoice files (idempotent imports)."""
+    from purchases_db import PurchaseDB
+    PurchaseDB.init_purchase_imports(conn)
+
+
+def _rebuild_recipe_bom(conn):
+    """Version 14: sub-recipes count as a share of their batch; rebuild recipe_bom and watch recipe yields."""
+    from recipe_db import RecipeDB
+    RecipeDB.init_recipe_components(conn)
+
+
+MIGRATIONS = [
+    _create_tables,
+    _add_foreign_key_indexes,
+    _add_partial_indexes,
+    _add_stock_totals,
+    _add_reservation_totals,
+    _add_stock_movements,
+    _add_expiry_column,
+    _add_reservation_ttl,
+    _add_recipe_components,
+    _normalize_units,
+    _add_ingredient_costs,
+    _add_stock_purchase_index,
+    _add_purchase_imports,
+    _rebuild_recipe_bom,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    """
+    Bring the database up to SCHEMA_VERSION.
+    Each pending migration runs in its own transaction together with the
+    user_version bump, so an interrupted upgrade resumes where it stopped.
+    Returns the number of migrations applied.
+    """
+    current = get_schema_version()
+    if current >= SCHEMA_VERSION:
+        return 0
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        step = MIGRATIONS[version - 1]
+        with transaction() as conn:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        print(f"[INFO] Applied schema migration {version} ({step.__name__})")
+    return SCHEMA_VERSION - current
@@ -1,4 +1,4 @@
-from db import get_connection
+from db import get_connection, transaction
 
 class OrderDB:
     @staticmethod
@@ -84,14 +84,22 @@ class OrderDB:
     @staticmethod
     def delete_order(order_id):
         """
-        Delete an order by ID.
+        Delete an order by ID, together with its line items.
+        Reserved ingredients are returned to stock first, unless the order was fulfilled
+        and has used them; everything commits at once.
         """
+        from reservation_db import ReservationDB
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM orders WHERE id=?", (order_id,))
-            conn.commit()
-            conn.close()
+            with transaction() as conn:
+                ReservationDB.release_order_reservations(order_id)
+                cur = conn.cursor()
+                # Whatever is still reserved belongs to a fulfilled order and was consumed
+                cur.execute(
+                    "DELETE FROM reservations WHERE lineitem_id IN (SELECT id FROM line_items WHERE order_id=?)",
+                    (order_id,)
+                )
+                cur.execute("DELETE FROM line_items WHERE order_id=?", (order_id,))
+                cur.execute("DELETE FROM orders WHERE id=?", (order_id,))
         except Exception as e:
             print(f"[ERROR] Failed to delete order: {e}")
 
@@ -0,0 +1,159 @@
+import os
+from datetime import date
+
+from db import get_connection, transaction
+from import_files import read_rows, parse_number
+
+# Accepted column names (after lower-casing, spaces -> underscores) per field
+COLUMNS = {
+    "customer": ("customer", "customer_name", "client"),
+    "customer_id": ("customer_id",),
+    "recipe": ("recipe", "recipe_name", "product", "item"),
+    "recipe_id": ("recipe_id",),
+    "quantity": ("quantity", "qty"),
+    "order": ("order", "order_ref", "order_reference", "po", "po_number"),
+    "delivery_date": ("delivery_date", "delivery", "deliver_on"),
+    "notes": ("notes", "order_notes"),
+}
+
+# Line items written per executemany round
+WRITE_BATCH_ROWS = 5000
+
+
+def _field(row, name):
+    for key in COLUMNS[name]:
+        value = row.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _name_key(name):
+    return " ".join(str(name).lower().split())
+
+
+class OrderImport:
+    """
+    Import orders from a spreadsheet export (CSV, JSON or JSON Lines), one line item per row.
+
+    Customers and recipes are resolved by name (or customer_id / recipe_id) through maps
+    built with one query each. Rows sharing a customer, delivery date and order reference
+    become one order; without an order column, one order per customer and delivery date.
+    Orders and line items are written with executemany in one transaction.
+    """
+
+    @staticmethod
+    def _lookup(cur, table):
+        """({normalised name: [ids]}, {ids}) for customers or recipes."""
+        cur.execute(f"SELECT id, name FROM {table}")
+        by_name = {}
+        ids = set()
+        for row_id, name in cur.fetchall():
+            by_name.setdefault(_name_key(name), []).append(row_id)
+            ids.add(row_id)
+        return by_name, ids
+
+    @staticmethod
+    def _resolve(row, field, by_name, ids, label):
+        row_id = _field(row, f"{field}_id")
+        if row_id is not None:
+            try:
+                row_id = int(parse_number(row_id))
+            except (TypeError, ValueError):
+                raise ValueError(f"bad {field}_id '{row_id}'")
+            if row_id not in ids:
+                raise ValueError(f"unknown {field}_id {row_id}")
+            return row_id
+        name = _field(row, field)
+        if name is None:
+            raise ValueError(f"no {label}")
+        matches = by_name.get(_name_key(name))
+        if not matches:
+            raise ValueError(f"unknown {label} '{name}'")
+        if len(matches) > 1:
+            raise ValueError(f"{label} name '{name}' is ambiguous; use {field}_id")
+        return matches[0]
+
+    @staticmethod
+    def _parse(row, customers, recipes):
+        """((customer_id, order ref, delivery date), notes, recipe_id, quantity), or raise ValueError."""
+        if "_error" in row:
+            raise ValueError(row["_error"])
+        customer_id = OrderImport._resolve(row, "customer", *customers, "customer")
+        recipe_id = OrderImport._resolve(row, "recipe", *recipes, "recipe")
+        try:
+            quantity = parse_number(_field(row, "quantity"))
+        except ValueError:
+            raise ValueError("quantity must be a number")
+        if quantity is None or quantity <= 0 or quantity != int(quantity):
+            raise ValueError("quantity must be a positive whole number")
+        delivery_date = _field(row, "delivery_date")
+        if delivery_date is not None:
+            delivery_date = str(delivery_date)[:10]
+            try:
+                date.fromisoformat(delivery_date)
+            except ValueError:
+                raise ValueError(f"delivery date '{delivery_date}' is not YYYY-MM-DD")
+        order_ref = _field(row, "order")
+        key = (customer_id, str(order_ref) if order_ref is not None else None, delivery_date)
+        return key, _field(row, "notes"), recipe_id, int(quantity)
+
+    @staticmethod
+    def _write_line_items(cur, lines):
+        if lines:
+            cur.executemany("INSERT INTO line_items (order_id, recipe_id, quantity) VALUES (?, ?, ?)", lines)
+        return len(lines)
+
+    @staticmethod
+    def import_file(path, allow_partial=False):
+        """
+        Import the orders in one file. With allow_partial=False (the default) a file with
+        any rejected row imports nothing; with True the valid rows go in.
+        Returns {"Orders": [new order ids], "LineItems": count, "Rejected": [(row number, reason)]}.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        customers = OrderImport._lookup(cur, "customers")
+        recipes = OrderImport._lookup(cur, "recipes")
+        conn.close()
+
+        # Rows are grouped per order before anything is written; {key: [notes, [(recipe_id, qty)]]}
+        orders = {}
+        rejected = []
+        for number, row in read_rows(path):
+            try:
+                key, notes, recipe_id, quantity = OrderImport._parse(row, customers, recipes)
+            except ValueError as e:
+                rejected.append((number, str(e)))
+                continue
+            entry = orders.setdefault(key, [notes, []])
+            if entry[0] is None:
+                entry[0] = notes
+            entry[1].append((recipe_id, quantity))
+        if (rejected and not allow_partial) or not orders:
+            return {"Orders": [], "LineItems": 0, "Rejected": rejected}
+
+        default_notes = f"Imported from {os.path.basename(path)}"
+        written = 0
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.executemany("""
+                INSERT INTO orders (customer_id, order_date, delivery_date, status, total_amount, notes)
+                VALUES (?, DATE('now'), ?, 'New Order', 0, ?)
+            """, [
+                (customer_id, delivery_date, notes or default_notes)
+                for (customer_id, _, delivery_date), (notes, _) in orders.items()
+            ])
+            # The write lock is held, so AUTOINCREMENT handed the orders consecutive ids ending at seq
+            cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'orders'")
+            first_id = cur.fetchone()[0] - len(orders) + 1
+            order_ids = list(range(first_id, first_id + len(orders)))
+
+            pending = []
+            for order_id, (_, lines) in zip(order_ids, orders.values()):
+                pending.extend((order_id, recipe_id, quantity) for recipe_id, quantity in lines)
+                if len(pending) >= WRITE_BATCH_ROWS:
+                    written += OrderImport._write_line_items(cur, pending)
+                    pending = []
+            written += OrderImport._write_line_items(cur, pending)
+        return {"Orders": order_ids, "LineItems": written, "Rejected": rejected}
@@ -7,63 +7,26 @@ from reservation_db import ReservationDB
 from metadata_db import MetadataDB
 from order_db import OrderDB
 from ingredient_db import IngredientDB
+from allocation_logic import AllocationLogic
 
 class ProductionController:
     def load_shopping_list(self):
         """
-        Populate the shopping list table with all orders and ingredients that have required > reserved + available (i.e., need to be purchased).
-        This version aggregates shortages per ingredient (metadata_id) across all orders, and lists which orders need them.
+        Populate the shopping list table with every ingredient whose required quantity across open orders
+        exceeds what is reserved plus available, and the orders that need it.
+        The shortages are computed by ShoppingListLogic; this only renders them.
         """
-        from order_db import OrderDB
-        from line_item_db import LineItemDB
-        from Stock_db import StockDB
-        from ingredient_db import IngredientDB
-        from metadata_db import MetadataDB
-        from reservation_db import ReservationDB
+        from shopping_list_logic import ShoppingListLogic
         table = self.ui.shopping_table
         table.setRowCount(0)
-        # metadata_id -> {name, unit, total_required, total_reserved, total_available, orders: set()}
-        ingredient_summary = {}
-        orders = OrderDB.get_all_orders()
-        for order in orders:
-            order_id = order[0]
-            required = LineItemDB.get_required_ingredients_for_order(order_id)
-            for metadata_id, req_qty in required.items():
-                meta = [m for m in MetadataDB.get_all_metadata() if m[0] == metadata_id]
-                name = meta[0][1] if meta else str(metadata_id)
-                unit = meta[0][3] if meta else ""
-                if metadata_id not in ingredient_summary:
-                    ingredient_summary[metadata_id] = {
-                        "name": name,
-                        "unit": unit,
-                        "total_required": 0,
-                        "total_reserved": 0,
-                        "orders": set()
-                    }
-                ingredient_summary[metadata_id]["total_required"] += req_qty
-                ingredient_summary[metadata_id]["orders"].add(order_id)
-                # Reserved for this order/ingredient
-                reserved = ReservationDB.get_reserved_qty_for_order(order_id, metadata_id)
-                ingredient_summary[metadata_id]["total_reserved"] += reserved
-        # Now, for each metadata_id, get available in stock (all stock, not just for this order)
-        for metadata_id in ingredient_summary:
-            ingredient_ids = [ing["ID"] for ing in IngredientDB.get_ingredients() if ing["MetadataID"] == metadata_id]
-            available = 0
-            for iid in ingredient_ids:
-                available += StockDB.get_available_stock(iid)
-            ingredient_summary[metadata_id]["total_available"] = available
-        # Now, build the shopping list: only those with shortage
         shopping_rows = []
-        for metadata_id, info in ingredient_summary.items():
-            shortage = info["total_required"] - info["total_reserved"] - info["total_available"]
-            if shortage > 0:
-                orders_str = ", ".join(str(oid) for oid in sorted(info["orders"]))
-                shopping_rows.append([
-                    info["name"],
-                    f"{shortage} {info['unit']}",
-                    orders_str,
-                    ""
-                ])
+        for entry in ShoppingListLogic.get_shopping_list():
+            shopping_rows.append([
+                entry["Name"],
+                f"{entry['Shortage']} {entry['Unit']}",
+                ", ".join(str(oid) for oid in entry["Orders"]),
+                ""
+            ])
         # Populate the table
         for row_idx, row_data in enumerate(shopping_rows):
             table.insertRow(row_idx)
@@ -132,6 +95,7 @@ class ProductionController:
         self.ui.show_closed_toggle.toggled.connect(self.populate_order_combo)
         self.ui.reserve_btn.clicked.connect(self.on_reserve_ingredients_clicked)
         self.ui.release_btn.clicked.connect(self.release_reservations)
+        self.ui.allocate_all_btn.clicked.connect(self.on_allocate_all_clicked)
         # self.ui.status_btn.clicked.connect(self.change_order_status)  # Disabled: method not implemented
         # self.ui.notes_text.focusOutEvent = self.save_production_note_on_focus_out  # Disabled: method not implemented
         self.ui.tabs.currentChanged.connect(self._on_tab_changed)
@@ -146,6 +110,8 @@ class ProductionController:
             print("[ERROR] No order selected.")
             return
         table = self.ui.ingredients_for_lineitem_table
+        metadata_by_name = {m[1]: m[0] for m in MetadataDB.get_all_metadata()}
+        limits = {}
         for row in range(table.rowCount()):
             # Get ingredient name from column 0, required from column 1, available from column 2
             name = table.item(row, 0).text()
@@ -157,17 +123,16 @@ class ProductionController:
             except Exception:
                 continue
             # Find metadata_id by name (could be optimized if table stores metadata_id as data)
-            meta_id = None
-            for m in MetadataDB.get_all_metadata():
-                if m[1] == name:
-                    meta_id = m[0]
-                    break
+            meta_id = metadata_by_name.get(name)
             if meta_id is None:
                 print(f"[WARN] Could not find metadata_id for ingredient '{name}'")
                 continue
             if available == 0:
                 continue
-            self.reserve_ingredient(order_id, meta_id, required)
+            limits[meta_id] = required
+        # One allocation pass and one commit for the whole click
+        if limits:
+            AllocationLogic.reserve_order(order_id, limits)
         # Refresh table after all reservations
         self.load_ingredients_for_order(order_id)
 
@@ -192,61 +157,38 @@ class ProductionController:
             msg.setText("The following ingredients have been reserved as much as possible:")
             msg.setInformativeText("\n".join(reserved_ingredients))
             msg.exec_()
+
+    def on_allocate_all_clicked(self):
+        """
+        Handler for the Allocate All Open Orders button. Reserves stock for every open order,
+        earliest delivery date first, in one transaction.
+        """
+        modes = ["Optimal (batches must last until delivery)", "Greedy (fast, first-expiring first)"]
+        choice, ok = QtWidgets.QInputDialog.getItem(self.ui, "Allocate All Open Orders", "Allocation mode:", modes, 0, False)
+        if not ok:
+            return
+        mode = "optimal" if choice == modes[0] else "greedy"
+        result = AllocationLogic.allocate_open_orders(mode)
+        short_orders = sorted(result["shortages"])
+        msg = QtWidgets.QMessageBox(self.ui)
+        msg.setIcon(QtWidgets.QMessageBox.Information)
+        msg.setWindowTitle("Allocation Complete")
+        msg.setText(f"Created {len(result['allocations'])} reservations.")
+        if short_orders:
+            msg.setInformativeText("Orders still short of stock: " + ", ".join(str(oid) for oid in short_orders))
+        msg.exec_()
+        order_id = int(self.ui.order_id_field.text()) if self.ui.order_id_field.text() else None
+        if order_id:
+            self.load_ingredients_for_order(order_id)
+        self.load_inventory()
+
     def reserve_ingredient(self, order_id, metadata_id, required_qty):
         """
-        Reserve the required quantity of an ingredient for an order, per line item (recipe).
-        After each reservation, recalculate reserved and available, and skip further reservations if enough is already reserved.
+        Reserve the required quantity of an ingredient for an order, per line item (recipe),
+        drawing from stock batches first-expired-first-out.
+        The batches are read once and every reservation and stock decrement is written in one transaction.
         """
-        import datetime
-        now = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
-        # Get all line items in the order that require this ingredient
-        items = LineItemDB.get_order_items(order_id)
-        for item in items:
-            lineitem_id = item[0]
-            quantity = item[3]
-            recipe_id = LineItemDB.get_recipe_id(lineitem_id)
-            if not recipe_id:
-                continue
-            # Find how much of this ingredient is needed for this line item
-            needed = 0
-            for ing in RecipeDB.get_recipe_ingredients(recipe_id):
-                if ing[2] == metadata_id:
-                    needed = ing[3] * quantity
-                    break
-            if needed == 0:
-                continue
-            # Check how much is already reserved for this ingredient in this order
-            total_reserved = ReservationDB.get_reserved_qty_for_order(order_id, metadata_id)
-            if total_reserved >= required_qty:
-                # Already reserved enough for the whole order, skip further reservations
-                break
-            # Reserve from stock batches (FIFO)
-            stock_batches = [s for s in StockDB.get_stock() if IngredientDB.get_ingredient_by_id(s[1]) and IngredientDB.get_ingredient_by_id(s[1])["MetadataID"] == metadata_id and s[3] > 0]
-            stock_batches.sort(key=lambda s: (s[6] if s[6] else '', s[0]))
-            to_reserve = min(needed, required_qty - total_reserved)
-            for batch in stock_batches:
-                stock_id = batch[0]
-                available = batch[3]
-                if available == 0:
-                    continue
-                reserve_qty = min(available, to_reserve)
-                status = "ready" if reserve_qty == to_reserve else "partial"
-                ReservationDB.add_reservation(
-                    lineitem_id=lineitem_id,
-                    ingredient_stock_id=stock_id,
-                    qty=reserve_qty,
-                    status=status,
-                    reserved_until=None
-                )
-                StockDB.update_stock(stock_id, available - reserve_qty)
-                to_reserve -= reserve_qty
-                # Recalculate total_reserved after each reservation
-                total_reserved = ReservationDB.get_reserved_qty_for_order(order_id, metadata_id)
-                if total_reserved >= required_qty or to_reserve <= 0:
-                    break
-            # If after this line item, enough is reserved, stop
-            if total_reserved >= required_qty:
-                break
+        AllocationLogic.reserve_order(order_id, {metadata_id: required_qty})
         # After all, update the table
         self.load_ingredients_for_order(order_id)
 
@@ -350,43 +292,28 @@ class ProductionController:
         ingredient_summary = {}  # metadata_id: {name, unit, required}
         for item in items:
             lineitem_id, order_id, recipe_name, quantity, *_ = item
-            recipe_id = LineItemDB.get_recipe_id(lineitem_id)
+            recipe_id, batches = LineItemDB.get_recipe_batches(lineitem_id)
             if not recipe_id:
                 continue
-            ingredients = RecipeDB.get_recipe_ingredients(recipe_id)
-            for ing in ingredients:
-                metadata_id = ing[2]
-                name = ing[5]
-                per_recipe_amt = ing[3]
-                # Get unit from metadata
-                unit = ""
-                meta = [m for m in MetadataDB.get_all_metadata() if m[0] == metadata_id]
-                if meta:
-                    unit = meta[0][3]
-                required = per_recipe_amt * quantity
+            # Sub-recipes expanded down to raw ingredients, with the metadata unit; the
+            # flattened BOM is one batch, so it scales by the batches the line item needs
+            for metadata_id, per_recipe_amt, unit, name in RecipeDB.get_flattened_ingredients(recipe_id):
+                required = per_recipe_amt * batches
                 if metadata_id not in ingredient_summary:
                     ingredient_summary[metadata_id] = {"name": name, "unit": unit, "required": 0}
                 ingredient_summary[metadata_id]["required"] += required
         
+        reserved_by_metadata = ReservationDB.get_reserved_qty_for_orders([order_id]).get(order_id, {})
+        available_by_metadata = StockDB.get_available_by_metadata()
         # Now, for each metadata_id, get available and reserved
         for idx, (metadata_id, info) in enumerate(ingredient_summary.items()):
             name = info["name"]
             unit = info["unit"]
             required = info["required"]
-            # Available: sum all stock for this metadata
-            available = 0
-            all_stock = StockDB.get_stock()
-            for stock in all_stock:
-                # stock: (id, ingredient_id, purchase_id, quantity, last_updated, batch_number, expiry_date)
-                ingredient_id = stock[1]
-                # Get ingredient's metadata_id
-
-                ing = IngredientDB.get_ingredient_by_id(ingredient_id)
-                if ing and ing["MetadataID"] == metadata_id:
-                    available += stock[3]
+            # Available: all stock for this metadata, from the trigger-maintained totals
+            available = available_by_metadata.get(metadata_id, 0)
             # Reserved: for this order and this metadata
-            reserved = 0
-            reserved = ReservationDB.get_reserved_qty_for_order(order_id, metadata_id)
+            reserved = reserved_by_metadata.get(metadata_id, 0)
             # Populate table
             table.insertRow(idx)
             table.setItem(idx, 0, QtWidgets.QTableWidgetItem(str(name)))
@@ -396,35 +323,29 @@ class ProductionController:
 
     def release_reservations(self):
         """
-        For the selected order, move all reservations back to stock and remove the reservations.
-        Update line item statuses to not ready.
+        Move reservations back to stock and remove them.
+        On the Reservations tab with rows selected, only those reservations are released;
+        otherwise every reservation of the selected order is. Either way it is one grouped update and one commit.
         """
-        print("releasing")
-
         order_id = int(self.ui.order_id_field.text()) if self.ui.order_id_field.text() else None
-        if not order_id:
-            return
-        # For each line item, restore stock and delete reservations
-        items = LineItemDB.get_order_items(order_id)
-        for item in items:
-            lineitem_id = item[0]
-            # Get all reservations for this lineitem
-            reservations = ReservationDB.get_reservations_for_lineitem(lineitem_id)
-            for res in reservations:
-                stock_id = res.get("IngredientStockID")
-                qty = res.get("Qty", 0)
-                if stock_id is not None:
-                    # Increase stock by released qty
-                    stock = StockDB.get_stock()
-                    for s in stock:
-                        if s[0] == stock_id:
-                            StockDB.update_stock(stock_id, s[3] + qty)
-                            break
-                # Delete reservation
-                ReservationDB.delete_reservation(res["ID"])
+        selected_ids = []
+        if self.ui.tabs.tabText(self.ui.tabs.currentIndex()) == "Reservations":
+            table = self.ui.reservations_table
+            for index in table.selectionModel().selectedRows():
+                item = table.item(index.row(), 0)
+                if item and item.text():
+                    selected_ids.append(int(item.text()))
+        if selected_ids:
+            ReservationDB.release_reservations(selected_ids)
+            self.load_reservations()
+        elif order_id:
+            ReservationDB.release_order_reservations(order_id)
             # No lineitem status update needed; status is tracked via reservations
+        else:
+            return
         # Refresh ingredient summary and inventory tables
-        self.load_ingredients_for_order(order_id)
+        if order_id:
+            self.load_ingredients_for_order(order_id)
         self.load_inventory()
 
     def _on_tab_changed(self, idx):
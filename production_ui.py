@@ -141,10 +141,12 @@ class ProductionUI(QtWidgets.QWidget):
         btn_layout = QtWidgets.QHBoxLayout()
         self.reserve_btn = QtWidgets.QPushButton("Reserve Ingredients")
         self.release_btn = QtWidgets.QPushButton("Release Reservation")
+        self.allocate_all_btn = QtWidgets.QPushButton("Allocate All Open Orders")
         self.status_btn = QtWidgets.QPushButton("Change Order Status")
         self.add_note_btn = QtWidgets.QPushButton("Add Production Note")
         btn_layout.addWidget(self.reserve_btn)
         btn_layout.addWidget(self.release_btn)
+        btn_layout.addWidget(self.allocate_all_btn)
         btn_layout.addWidget(self.status_btn)
         btn_layout.addWidget(self.add_note_btn)
         main_layout.addLayout(btn_layout)
@@ -157,4 +159,7 @@ if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     window = ProductionUI()
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    exit_code = app.exec_()
+    from db import close_connections
+    close_connections()
+    sys.exit(exit_code)
\ No newline at end of file
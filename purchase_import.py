@@ -0,0 +1,188 @@
+import os
+from datetime import date, datetime
+
+from db import get_connection, transaction
+from Stock_db import StockDB
+from purchases_db import PurchaseDB
+from import_files import file_hash, read_rows, parse_number
+
+# Accepted column names (after lower-casing, spaces -> underscores) per field
+COLUMNS = {
+    "ingredient": ("ingredient", "ingredient_name", "name", "item", "description"),
+    "ingredient_id": ("ingredient_id",),
+    "quantity": ("quantity", "qty", "packages", "number_of_packages"),
+    "price": ("price", "total_price", "amount", "line_total"),
+    "discount": ("discount", "total_discount"),
+    "batch_number": ("batch_number", "batch", "lot", "lot_number"),
+    "expiry_date": ("expiry_date", "expiry", "best_before", "use_by"),
+    "date": ("date", "purchase_date", "invoice_date"),
+}
+
+# Rows written per executemany round; keeps memory flat however long the file is
+WRITE_BATCH_ROWS = 2000
+
+
+def _field(row, name):
+    for key in COLUMNS[name]:
+        value = row.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+class _ImportRejected(Exception):
+    """Raised inside the import transaction to roll it back."""
+
+
+class PurchaseImport:
+    """
+    Import supplier invoices (CSV, JSON or JSON Lines) as purchases, each received as
+    its own stock batch exactly like PurchasesLogic.add_purchase, in one transaction.
+
+    The file is streamed: rows are validated, resolved by ingredient name through a
+    lookup map built with one query, and written with executemany in batches.
+    A file whose content hash was imported before is skipped.
+    """
+
+    @staticmethod
+    def _ingredient_lookup():
+        """({normalised name: [ingredient ids]}, {ingredient id: size}) from one query."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, size FROM ingredients")
+        by_name = {}
+        sizes = {}
+        for ingredient_id, name, size in cur.fetchall():
+            by_name.setdefault(" ".join(str(name).lower().split()), []).append(ingredient_id)
+            sizes[ingredient_id] = size
+        conn.close()
+        return by_name, sizes
+
+    @staticmethod
+    def _parse(row, by_name, sizes, default_date):
+        """(purchase tuple, stock fields) for a valid row, or raise ValueError with the reason."""
+        if "_error" in row:
+            raise ValueError(row["_error"])
+        ingredient_id = _field(row, "ingredient_id")
+        if ingredient_id is not None:
+            try:
+                ingredient_id = int(parse_number(ingredient_id))
+            except (TypeError, ValueError):
+                raise ValueError(f"bad ingredient_id '{ingredient_id}'")
+            if ingredient_id not in sizes:
+                raise ValueError(f"unknown ingredient_id {ingredient_id}")
+        else:
+            name = _field(row, "ingredient")
+            if name is None:
+                raise ValueError("no ingredient")
+            matches = by_name.get(" ".join(str(name).lower().split()))
+            if not matches:
+                raise ValueError(f"unknown ingredient '{name}'")
+            if len(matches) > 1:
+                raise ValueError(f"ingredient name '{name}' is ambiguous; use ingredient_id")
+            ingredient_id = matches[0]
+
+        try:
+            quantity = parse_number(_field(row, "quantity"))
+            price = parse_number(_field(row, "price"))
+            discount = parse_number(_field(row, "discount")) or 0
+        except ValueError:
+            raise ValueError("quantity, price and discount must be numbers")
+        if quantity is None or quantity <= 0:
+            raise ValueError("quantity must be a positive number of packages")
+        if price is not None and price < 0:
+            raise ValueError("price cannot be negative")
+
+        purchase_date = _field(row, "date")
+        if purchase_date is None:
+            purchase_date = default_date
+        else:
+            purchase_date = str(purchase_date)
+            try:
+                datetime.fromisoformat(purchase_date)
+            except ValueError:
+                raise ValueError(f"date '{purchase_date}' is not YYYY-MM-DD")
+
+        batch_number = _field(row, "batch_number")
+        expiry_date = _field(row, "expiry_date")
+        return (
+            (ingredient_id, purchase_date, quantity, price, discount),
+            (quantity * (sizes[ingredient_id] or 1),
+             str(batch_number) if batch_number is not None else None,
+             str(expiry_date) if expiry_date is not None else None),
+        )
+
+    @staticmethod
+    def _write(cur, lines):
+        """Insert a batch of purchases and their stock batches with two executemany calls."""
+        if not lines:
+            return 0
+        cur.executemany(
+            "INSERT INTO ingredient_purchases (ingredient_id, date, quantity, price, discount) VALUES (?, ?, ?, ?, ?)",
+            [purchase for purchase, _ in lines]
+        )
+        # The write lock is held, so AUTOINCREMENT handed this batch consecutive ids ending at seq
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ingredient_purchases'")
+        first_id = cur.fetchone()[0] - len(lines) + 1
+        now = datetime.now().isoformat()
+        cur.executemany(
+            "INSERT INTO stock (ingredient_id, quantity, purchase_id, batch_number, expiry_date, last_updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (purchase[0], quantity, first_id + offset, batch_number, expiry_date, now)
+                for offset, (purchase, (quantity, batch_number, expiry_date)) in enumerate(lines)
+            ]
+        )
+        return len(lines)
+
+    @staticmethod
+    def import_file(path, allow_partial=False, purchase_date=None):
+        """
+        Import one invoice file. Rows without a date get purchase_date (default: now).
+        With allow_partial=False (the default) a file with any rejected row imports
+        nothing, so it can be fixed and imported again; with True the valid rows go in.
+        Returns {"ImportID", "Skipped", "Imported", "Rejected"}; Rejected is a list of
+        (row number, reason), and Skipped is True when the file was already imported.
+        """
+        content_hash = file_hash(path)
+        existing = PurchaseDB.get_import_by_hash(content_hash)
+        if existing:
+            return {"ImportID": existing[0], "Skipped": True, "Imported": 0, "Rejected": []}
+
+        by_name, sizes = PurchaseImport._ingredient_lookup()
+        if isinstance(purchase_date, (date, datetime)):
+            purchase_date = purchase_date.isoformat()
+        default_date = purchase_date or datetime.now().isoformat()
+        rejected = []
+        imported = 0
+        import_id = None
+        try:
+            with transaction() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "INSERT INTO purchase_imports (content_hash, file_name) VALUES (?, ?)",
+                    (content_hash, os.path.basename(path))
+                )
+                import_id = cur.lastrowid
+                with StockDB.movement("purchase", "purchase_import", import_id):
+                    pending = []
+                    for number, row in read_rows(path):
+                        try:
+                            pending.append(PurchaseImport._parse(row, by_name, sizes, default_date))
+                        except ValueError as e:
+                            rejected.append((number, str(e)))
+                            continue
+                        # Once a strict import has failed, keep validating but stop writing
+                        if rejected and not allow_partial:
+                            pending.clear()
+                        elif len(pending) >= WRITE_BATCH_ROWS:
+                            imported += PurchaseImport._write(cur, pending)
+                            pending.clear()
+                    if not rejected or allow_partial:
+                        imported += PurchaseImport._write(cur, pending)
+                if (rejected and not allow_partial) or not imported:
+                    raise _ImportRejected()
+                cur.execute("UPDATE purchase_imports SET lines = ? WHERE id = ?", (imported, import_id))
+        except _ImportRejected:
+            return {"ImportID": None, "Skipped": False, "Imported": 0, "Rejected": rejected}
+        return {"ImportID": import_id, "Skipped": False, "Imported": imported, "Rejected": rejected}
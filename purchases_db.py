@@ -19,6 +19,33 @@ class PurchaseDB:
         ''')
         conn.commit()
 
+    @staticmethod
+    def init_purchase_imports(conn):
+        """Record of imported invoice files, keyed by content hash so a file is only imported once."""
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS purchase_imports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT NOT NULL UNIQUE,
+                file_name TEXT,
+                lines INTEGER NOT NULL DEFAULT 0,
+                imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+    @staticmethod
+    def get_import_by_hash(content_hash):
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, content_hash, file_name, lines, imported_at FROM purchase_imports WHERE content_hash = ?",
+            (content_hash,)
+        )
+        row = cur.fetchone()
+        conn.close()
+        return row
+
     @staticmethod
     def get_purchases(ingredient_id=None):
         conn = get_connection()
@@ -39,8 +66,10 @@ class PurchaseDB:
             "INSERT INTO ingredient_purchases (ingredient_id, date, quantity, price, discount) VALUES (?, ?, ?, ?, ?)",
             (ingredient_id, date, quantity, price, discount)
         )
+        purchase_id = cur.lastrowid
         conn.commit()
         conn.close()
+        return purchase_id
 
     @staticmethod
     def update_purchase(purchase_id, quantity, price, discount):
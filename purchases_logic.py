@@ -1,33 +1,63 @@
 from purchases_db import PurchaseDB
 from Stock_db import StockDB
 from datetime import datetime
+from db import transaction
 
 class PurchasesLogic:
     @staticmethod
-    def add_purchase(ingredient_id, quantity, price, discount):
+    def add_purchase(ingredient_id, quantity, price, discount, batch_number=None, expiry_date=None):
         """
         quantity: number of units purchased (e.g., 5 bags)
         ingredient size: grams per unit (e.g., 5000g per bag)
-        Stock should be updated by quantity * size
+        The delivery becomes its own stock batch of quantity * size, linked to the purchase.
+        Returns the purchase id.
         """
-        from ingredient_db import IngredientDB
-        purchase_date = datetime.now().isoformat()
-        PurchaseDB.add_purchase(ingredient_id, purchase_date, quantity, price, discount)
+        line = {
+            "IngredientID": ingredient_id,
+            "Quantity": quantity,
+            "Price": price,
+            "Discount": discount,
+            "BatchNumber": batch_number,
+            "ExpiryDate": expiry_date,
+        }
+        return PurchasesLogic.receive_delivery([line])[0]
 
-        # Get ingredient size in grams
-        ingredient = IngredientDB.get_ingredient_by_id(ingredient_id)
-        size = ingredient["Size"] if ingredient and "Size" in ingredient else 1
-        total_grams = quantity * size
+    @staticmethod
+    def receive_delivery(lines, purchase_date=None):
+        """
+        Receive a whole delivery note in one transaction: each line becomes a purchase row
+        and one new stock batch carrying its purchase_id, batch number and expiry date.
+        lines: dicts with IngredientID, Quantity (packages) and optionally Price, Discount,
+        BatchNumber, ExpiryDate. Nothing is written if any line is invalid.
+        Returns the purchase ids in line order.
+        """
+        from ingredient_db import IngredientDB
+        purchase_date = purchase_date or datetime.now().isoformat()
+        sizes = {ing["ID"]: ing["Size"] for ing in IngredientDB.get_ingredients()}
+        for number, line in enumerate(lines, start=1):
+            if line.get("IngredientID") not in sizes:
+                raise ValueError(f"Line {number}: unknown ingredient.")
+            quantity = line.get("Quantity")
+            if not isinstance(quantity, (int, float)) or quantity <= 0:
+                raise ValueError(f"Line {number}: number of packages must be a positive number.")
 
-        # Update stock
-        current_stock = StockDB.get_stock(ingredient_id)
-        if current_stock:
-            row = current_stock[0]
-            stock_id = row[0]         # id
-            existing_qty = row[3]     # quantity
-            StockDB.update_stock(stock_id, existing_qty + total_grams)
-        else:
-            StockDB.add_stock(ingredient_id, total_grams)
+        purchase_ids = []
+        with transaction():
+            for line in lines:
+                ingredient_id = line["IngredientID"]
+                purchase_id = PurchaseDB.add_purchase(
+                    ingredient_id, purchase_date, line["Quantity"], line.get("Price"), line.get("Discount") or 0
+                )
+                with StockDB.movement("purchase", "purchase", purchase_id):
+                    StockDB.add_stock(
+                        ingredient_id,
+                        line["Quantity"] * (sizes[ingredient_id] or 1),
+                        purchase_id=purchase_id,
+                        batch_number=line.get("BatchNumber") or None,
+                        expiry_date=line.get("ExpiryDate") or None,
+                    )
+                purchase_ids.append(purchase_id)
+        return purchase_ids
 
     @staticmethod
     def get_purchases(ingredient_id=None):
@@ -2,6 +2,7 @@ from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QMessageBox, QTableWidgetItem
 from ingredient_db import IngredientDB
 from purchases_logic import PurchasesLogic
+from purchase_import import PurchaseImport
 from metadata_logic import MetadataLogic
 from PyQt5.QtCore import Qt
 
@@ -20,9 +21,13 @@ class PurchasePopup(QtWidgets.QWidget):
         self.add_btn = QtWidgets.QPushButton("Add")
         self.update_btn = QtWidgets.QPushButton("Update")
         self.delete_btn = QtWidgets.QPushButton("Delete")
+        self.delivery_btn = QtWidgets.QPushButton("Receive Delivery Note")
+        self.import_btn = QtWidgets.QPushButton("Import Invoice...")
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.update_btn)
         btn_layout.addWidget(self.delete_btn)
+        btn_layout.addWidget(self.delivery_btn)
+        btn_layout.addWidget(self.import_btn)
 
         # Input fields
         form_layout = QtWidgets.QHBoxLayout()
@@ -30,10 +35,14 @@ class PurchasePopup(QtWidgets.QWidget):
         self.quantity_input = QtWidgets.QLineEdit(); self.quantity_input.setPlaceholderText("Number of Packages")
         self.price_input = QtWidgets.QLineEdit(); self.price_input.setPlaceholderText("Total Price (all packages)")
         self.discount_input = QtWidgets.QLineEdit(); self.discount_input.setPlaceholderText("Total Discount (all packages)")
+        self.batch_input = QtWidgets.QLineEdit(); self.batch_input.setPlaceholderText("Batch Number")
+        self.expiry_input = QtWidgets.QLineEdit(); self.expiry_input.setPlaceholderText("Expiry (YYYY-MM-DD)")
         form_layout.addWidget(self.ingredient_input)
         form_layout.addWidget(self.quantity_input)
         form_layout.addWidget(self.price_input)
         form_layout.addWidget(self.discount_input)
+        form_layout.addWidget(self.batch_input)
+        form_layout.addWidget(self.expiry_input)
 
         # Table
         self.table = QtWidgets.QTableWidget()
@@ -57,6 +66,8 @@ class PurchasePopup(QtWidgets.QWidget):
         self.add_btn.clicked.connect(self.add_purchase)
         self.update_btn.clicked.connect(self.update_purchase)
         self.delete_btn.clicked.connect(self.delete_purchase)
+        self.delivery_btn.clicked.connect(self.receive_delivery)
+        self.import_btn.clicked.connect(self.import_invoice)
         self.table.cellClicked.connect(self.fill_form)
         self.ingredient_input.currentIndexChanged.connect(self.on_ingredient_changed)
 
@@ -129,11 +140,48 @@ class PurchasePopup(QtWidgets.QWidget):
             QMessageBox.warning(self, "Error", "Quantity, Price, Discount must be numbers")
             return
 
-        PurchasesLogic.add_purchase(ingredient_id, quantity, price, discount)
+        try:
+            PurchasesLogic.add_purchase(
+                ingredient_id, quantity, price, discount,
+                batch_number=self.batch_input.text().strip() or None,
+                expiry_date=self.expiry_input.text().strip() or None,
+            )
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
         # Refresh with the same ingredient filter
         self.refresh_table(self.last_selected_ingredient_id)
         self.clear_form()
 
+    def receive_delivery(self):
+        dialog = DeliveryNoteDialog(self.ingredient_input, self)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            self.refresh_table(self.last_selected_ingredient_id)
+
+    def import_invoice(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Import Invoice", "", "Invoice files (*.csv *.json *.jsonl *.ndjson)"
+        )
+        if not path:
+            return
+        try:
+            result = PurchaseImport.import_file(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        if result["Skipped"]:
+            QMessageBox.information(self, "Import Invoice", "This invoice was already imported.")
+            return
+        if result["Rejected"]:
+            shown = "\n".join(f"Row {number}: {reason}" for number, reason in result["Rejected"][:20])
+            more = len(result["Rejected"]) - 20
+            if more > 0:
+                shown += f"\n... and {more} more"
+            QMessageBox.warning(self, "Import Invoice", f"Nothing was imported. Fix these rows and try again:\n{shown}")
+            return
+        QMessageBox.information(self, "Import Invoice", f"Imported {result['Imported']} purchases.")
+        self.refresh_table(self.last_selected_ingredient_id)
+
     def update_purchase(self):
         selected_row = self.table.currentRow()
         if selected_row < 0:
@@ -195,4 +243,88 @@ class PurchasePopup(QtWidgets.QWidget):
         # self.ingredient_input.setCurrentIndex(0)  # <-- REMOVE THIS LINE
         self.quantity_input.clear()
         self.price_input.clear()
-        self.discount_input.clear()
\ No newline at end of file
+        self.discount_input.clear()
+        self.batch_input.clear()
+        self.expiry_input.clear()
+
+
+class DeliveryNoteDialog(QtWidgets.QDialog):
+    """Enter every line of a delivery note and receive them together."""
+
+    COLUMNS = ["Ingredient", "Packages", "Total Price", "Total Discount", "Batch Number", "Expiry (YYYY-MM-DD)"]
+
+    def __init__(self, ingredient_combo, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Receive Delivery Note")
+        self.resize(900, 400)
+        # Reuse the purchase form's ingredient choices (skipping its placeholder entry)
+        self.ingredient_choices = [
+            (ingredient_combo.itemText(i), ingredient_combo.itemData(i))
+            for i in range(ingredient_combo.count())
+            if ingredient_combo.itemData(i) not in (None, -1)
+        ]
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+
+        btn_layout = QtWidgets.QHBoxLayout()
+        for text, func in [("Add Line", self.add_line),
+                           ("Remove Line", self.remove_line),
+                           ("Receive", self.receive),
+                           ("Cancel", self.reject)]:
+            btn = QtWidgets.QPushButton(text)
+            btn.clicked.connect(func)
+            btn_layout.addWidget(btn)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(btn_layout)
+        self.add_line()
+
+    def add_line(self):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        combo = QtWidgets.QComboBox()
+        for text, ingredient_id in self.ingredient_choices:
+            combo.addItem(text, ingredient_id)
+        self.table.setCellWidget(row, 0, combo)
+
+    def remove_line(self):
+        row = self.table.currentRow()
+        if row >= 0:
+            self.table.removeRow(row)
+
+    def _text(self, row, col):
+        item = self.table.item(row, col)
+        return item.text().strip() if item else ""
+
+    def receive(self):
+        lines = []
+        for row in range(self.table.rowCount()):
+            packages = self._text(row, 1)
+            if not packages:
+                continue  # blank line
+            try:
+                line = {
+                    "IngredientID": self.table.cellWidget(row, 0).currentData(),
+                    "Quantity": float(packages),
+                    "Price": float(self._text(row, 2) or "0"),
+                    "Discount": float(self._text(row, 3) or "0"),
+                    "BatchNumber": self._text(row, 4) or None,
+                    "ExpiryDate": self._text(row, 5) or None,
+                }
+            except ValueError:
+                QMessageBox.warning(self, "Error", f"Line {row + 1}: Packages, Price, Discount must be numbers")
+                return
+            lines.append(line)
+        if not lines:
+            QMessageBox.warning(self, "Error", "The delivery note has no lines")
+            return
+        try:
+            PurchasesLogic.receive_delivery(lines)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        QMessageBox.information(self, "Delivery Received", f"Received {len(lines)} lines.")
+        self.accept()
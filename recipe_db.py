@@ -1,4 +1,49 @@
-from db import get_connection
+import math
+
+from db import get_connection, transaction, chunked
+
+# Sub-recipes nest at most this deep; anything deeper is reported as a cycle.
+MAX_RECIPE_DEPTH = 32
+
+# Expands recipes {ids} into (root, sub-recipe, quantity factor, depth) rows, stopping at
+# MAX_RECIPE_DEPTH (which only a component cycle can reach). A component's quantity is
+# units of the sub-recipe, i.e. that fraction of one of its batches.
+_BOM_EXPAND = """
+    WITH RECURSIVE expand(root, recipe_id, factor, depth) AS (
+        SELECT id, id, 1.0, 0 FROM recipes WHERE id IN ({ids})
+        UNION ALL
+        SELECT e.root, rc.component_recipe_id,
+               e.factor * rc.quantity / MAX(COALESCE(c.output_quantity, 1), 1), e.depth + 1
+        FROM expand e
+        JOIN recipe_components rc ON rc.recipe_id = e.recipe_id
+        LEFT JOIN recipes c ON c.id = rc.component_recipe_id
+        WHERE e.depth < ?
+    )
+"""
+
+# (root, metadata_id, quantity, position) rows of the flattened BOM, over _BOM_EXPAND
+_BOM_ROWS = """
+    SELECT e.root, ri.metadata_id, SUM(e.factor * ri.quantity), MIN(ri.id)
+    FROM expand e
+    JOIN recipe_ingredients ri ON ri.recipe_id = e.recipe_id
+    GROUP BY e.root, ri.metadata_id
+"""
+
+
+def batches_needed(quantity, output_quantity):
+    """Whole batches of a recipe yielding output_quantity units needed to make `quantity` units."""
+    return math.ceil((quantity or 0) / max(output_quantity or 1, 1))
+
+
+def batches_sql(quantity, output_quantity):
+    """batches_needed as an SQL expression over two columns, e.g. batches_sql("li.quantity", "r.output_quantity")."""
+    ratio = f"(CAST(COALESCE({quantity}, 0) AS REAL) / MAX(COALESCE({output_quantity}, 1), 1))"
+    return f"(CAST({ratio} AS INTEGER) + ({ratio} > CAST({ratio} AS INTEGER)))"
+
+
+# Batches a line item li of recipe r needs, for SUM(b.quantity * LINE_ITEM_BATCHES_SQL) over recipe_bom b
+LINE_ITEM_BATCHES_SQL = batches_sql("li.quantity", "r.output_quantity")
+
 
 class RecipeDB:
     @staticmethod
@@ -110,3 +155,270 @@ class RecipeDB:
         cur.execute("DELETE FROM recipe_ingredients WHERE id=?", (ri_id,))
         conn.commit()
         conn.close()
+
+    # ------------------ Sub-recipes and the flattened BOM ------------------
+    @staticmethod
+    def init_recipe_components(conn):
+        """
+        Create recipe_components (a recipe using `quantity` units of another recipe),
+        the flattened bill of materials recipe_bom, and the triggers that invalidate it.
+
+        recipe_bom holds, per recipe, the total quantity of every metadata tag once all
+        sub-recipes are expanded. Like recipe_ingredients it is what one batch uses, i.e.
+        output_quantity units; line items need batches_needed(quantity, output_quantity)
+        of them. A component's quantity is units of the sub-recipe, so it contributes
+        quantity / output_quantity of that recipe's batch. Any change to a recipe's
+        ingredients, components or yield marks that recipe in recipe_bom_dirty;
+        refresh_bom() then rebuilds the dirty recipes and every recipe that uses them,
+        so readers only pay for what changed.
+        """
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS recipe_components (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipe_id INTEGER NOT NULL,
+                component_recipe_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                FOREIGN KEY(recipe_id) REFERENCES recipes(id) ON DELETE CASCADE,
+                FOREIGN KEY(component_recipe_id) REFERENCES recipes(id)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_recipe_components_recipe ON recipe_components(recipe_id)")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recipe_components_component ON recipe_components(component_recipe_id)"
+        )
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS recipe_bom (
+                recipe_id INTEGER NOT NULL,
+                metadata_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                position INTEGER,
+                PRIMARY KEY (recipe_id, metadata_id)
+            )
+        """)
+        cur.execute("CREATE TABLE IF NOT EXISTS recipe_bom_dirty (recipe_id INTEGER PRIMARY KEY)")
+
+        mark = "INSERT OR IGNORE INTO recipe_bom_dirty (recipe_id) VALUES ({row}.recipe_id);"
+        triggers = {
+            "trg_recipe_bom_ingredient_insert": ("AFTER INSERT ON recipe_ingredients", mark.format(row="NEW")),
+            "trg_recipe_bom_ingredient_delete": ("AFTER DELETE ON recipe_ingredients", mark.format(row="OLD")),
+            "trg_recipe_bom_ingredient_update": (
+                "AFTER UPDATE ON recipe_ingredients", mark.format(row="OLD") + mark.format(row="NEW")
+            ),
+            "trg_recipe_bom_component_insert": ("AFTER INSERT ON recipe_components", mark.format(row="NEW")),
+            "trg_recipe_bom_component_delete": ("AFTER DELETE ON recipe_components", mark.format(row="OLD")),
+            "trg_recipe_bom_component_update": (
+                "AFTER UPDATE ON recipe_components", mark.format(row="OLD") + mark.format(row="NEW")
+            ),
+            # A component's share of a sub-recipe batch depends on the sub-recipe's yield
+            "trg_recipe_bom_recipe_yield": (
+                "AFTER UPDATE OF output_quantity ON recipes WHEN OLD.output_quantity IS NOT NEW.output_quantity",
+                "INSERT OR IGNORE INTO recipe_bom_dirty (recipe_id) VALUES (NEW.id);",
+            ),
+            "trg_recipe_bom_recipe_delete": (
+                "AFTER DELETE ON recipes",
+                "DELETE FROM recipe_components WHERE recipe_id = OLD.id;"
+                "INSERT OR IGNORE INTO recipe_bom_dirty (recipe_id) VALUES (OLD.id);",
+            ),
+        }
+        for name, (event, body) in triggers.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+        cur.execute("INSERT OR IGNORE INTO recipe_bom_dirty (recipe_id) SELECT id FROM recipes")
+        RecipeDB.refresh_bom()
+        conn.commit()
+
+    @staticmethod
+    def _bom_work(cur):
+        """
+        (affected, cyclic): every dirty recipe plus everything that uses it, and those of
+        them whose expansion runs into a component cycle (they reach MAX_RECIPE_DEPTH).
+        """
+        cur.execute("""
+            WITH RECURSIVE affected(recipe_id) AS (
+                SELECT recipe_id FROM recipe_bom_dirty
+                UNION
+                SELECT rc.recipe_id
+                FROM recipe_components rc
+                JOIN affected a ON rc.component_recipe_id = a.recipe_id
+            )
+            SELECT recipe_id FROM affected
+        """)
+        affected = [row[0] for row in cur.fetchall()]
+        cyclic = []
+        for chunk in chunked(affected):
+            ids = ",".join(["?"] * len(chunk))
+            cur.execute(
+                _BOM_EXPAND.format(ids=ids) + "SELECT DISTINCT root FROM expand WHERE depth >= ?",
+                (*chunk, MAX_RECIPE_DEPTH, MAX_RECIPE_DEPTH)
+            )
+            cyclic.extend(row[0] for row in cur.fetchall())
+        return affected, cyclic
+
+    @staticmethod
+    def refresh_bom():
+        """
+        Rebuild recipe_bom for every dirty recipe and everything that uses it, with one
+        recursive expansion. A no-op (one indexed probe) when nothing has changed; the
+        BOM readers call it before they query.
+        Sub-recipe cycles are rejected when components are added, but legacy data or a
+        direct SQL edit can still hold one. Recipes caught in a cycle (and the recipes
+        using them) keep their previous BOM and stay dirty, so the rest of the catalog
+        still refreshes and readers keep working; they are reported with a warning and
+        returned. Writes nothing when only such recipes are left.
+        Returns the ids of the recipes that could not be expanded.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        if not cur.execute("SELECT 1 FROM recipe_bom_dirty LIMIT 1").fetchone():
+            conn.close()
+            return []
+        affected, cyclic = RecipeDB._bom_work(cur)
+        conn.close()
+        if set(affected) - set(cyclic):
+            with transaction() as conn:
+                cur = conn.cursor()
+                affected, cyclic = RecipeDB._bom_work(cur)
+                skip = set(cyclic)
+                for chunk in chunked([recipe_id for recipe_id in affected if recipe_id not in skip]):
+                    ids = ",".join(["?"] * len(chunk))
+                    cur.execute(f"DELETE FROM recipe_bom WHERE recipe_id IN ({ids})", chunk)
+                    cur.execute(
+                        _BOM_EXPAND.format(ids=ids)
+                        + "INSERT INTO recipe_bom (recipe_id, metadata_id, quantity, position)"
+                        + _BOM_ROWS,
+                        (*chunk, MAX_RECIPE_DEPTH)
+                    )
+                    cur.execute(f"DELETE FROM recipe_bom_dirty WHERE recipe_id IN ({ids})", chunk)
+        if cyclic:
+            print(
+                f"[WARN] Sub-recipes of recipe(s) {', '.join(map(str, sorted(cyclic)))} form a cycle; "
+                "their ingredient lists were not updated"
+            )
+        return cyclic
+
+    @staticmethod
+    def read_bom(conn):
+        """
+        The whole flattened BOM as {recipe_id: [(metadata_id, quantity)]} in recipe order,
+        without writing anything, so it works inside a snapshot(). Recipes still marked
+        dirty are expanded on the fly instead of being refreshed; cyclic ones keep their
+        cached rows, as refresh_bom() would leave them.
+        """
+        cur = conn.cursor()
+        cur.execute("SELECT recipe_id, metadata_id, quantity FROM recipe_bom ORDER BY recipe_id, position")
+        bom = {}
+        for recipe_id, metadata_id, quantity in cur.fetchall():
+            bom.setdefault(recipe_id, []).append((metadata_id, quantity))
+        if not cur.execute("SELECT 1 FROM recipe_bom_dirty LIMIT 1").fetchone():
+            return bom
+        affected, cyclic = RecipeDB._bom_work(cur)
+        skip = set(cyclic)
+        for chunk in chunked([recipe_id for recipe_id in affected if recipe_id not in skip]):
+            for recipe_id in chunk:
+                bom.pop(recipe_id, None)
+            cur.execute(
+                _BOM_EXPAND.format(ids=",".join(["?"] * len(chunk))) + _BOM_ROWS + "ORDER BY 1, 4",
+                (*chunk, MAX_RECIPE_DEPTH)
+            )
+            for recipe_id, metadata_id, quantity, _ in cur.fetchall():
+                bom.setdefault(recipe_id, []).append((metadata_id, quantity))
+        return bom
+
+    @staticmethod
+    def get_flattened_ingredients(recipe_id):
+        """
+        Every metadata ingredient of a recipe with its sub-recipes expanded.
+        Returns [(metadata_id, quantity, unit, name)] in recipe order.
+        """
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT b.metadata_id, b.quantity, m.unit, m.name
+            FROM recipe_bom b
+            JOIN metadata m ON m.id = b.metadata_id
+            WHERE b.recipe_id = ?
+            ORDER BY b.position
+        """, (recipe_id,))
+        rows = cur.fetchall()
+        conn.close()
+        return rows
+
+    @staticmethod
+    def add_recipe_component(recipe_id, component_recipe_id, quantity):
+        """Add a sub-recipe; raises ValueError if the component already uses recipe_id (a cycle)."""
+        with transaction() as conn:
+            if RecipeDB.uses_recipe(component_recipe_id, recipe_id):
+                raise ValueError("Adding this sub-recipe would create a cycle.")
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO recipe_components (recipe_id, component_recipe_id, quantity)
+                VALUES (?, ?, ?)
+            """, (recipe_id, component_recipe_id, quantity))
+            return cur.lastrowid
+
+    @staticmethod
+    def get_recipe_components(recipe_id):
+        """Sub-recipes used directly by a recipe: [(id, recipe_id, component_recipe_id, quantity, name)]."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT rc.id, rc.recipe_id, rc.component_recipe_id, rc.quantity, r.name
+            FROM recipe_components rc
+            JOIN recipes r ON r.id = rc.component_recipe_id
+            WHERE rc.recipe_id = ?
+            ORDER BY rc.id
+        """, (recipe_id,))
+        rows = cur.fetchall()
+        conn.close()
+        return rows
+
+    @staticmethod
+    def update_recipe_component(rc_id, quantity):
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("UPDATE recipe_components SET quantity=? WHERE id=?", (quantity, rc_id))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def delete_recipe_component(rc_id):
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM recipe_components WHERE id=?", (rc_id,))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def uses_recipe(recipe_id, component_recipe_id):
+        """True if recipe_id is component_recipe_id or contains it at any depth."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            WITH RECURSIVE below(id) AS (
+                SELECT ?
+                UNION
+                SELECT rc.component_recipe_id
+                FROM recipe_components rc
+                JOIN below b ON rc.recipe_id = b.id
+            )
+            SELECT 1 FROM below WHERE id = ? LIMIT 1
+        """, (recipe_id, component_recipe_id))
+        found = cur.fetchone() is not None
+        conn.close()
+        return found
+
+    @staticmethod
+    def get_parent_recipes(recipe_id):
+        """Recipes that use this recipe directly as a component: [(id, name)]."""
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT DISTINCT r.id, r.name
+            FROM recipe_components rc
+            JOIN recipes r ON r.id = rc.recipe_id
+            WHERE rc.component_recipe_id = ?
+        """, (recipe_id,))
+        rows = cur.fetchall()
+        conn.close()
+        return rows
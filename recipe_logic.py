@@ -1,4 +1,5 @@
 from recipe_db import RecipeDB
+import units
 
 class RecipeLogic:
     @staticmethod
@@ -23,6 +24,10 @@ class RecipeLogic:
 
     @staticmethod
     def delete_recipe(recipe_id):
+        parents = RecipeDB.get_parent_recipes(recipe_id)
+        if parents:
+            names = ", ".join(name for _, name in parents)
+            raise ValueError(f"Recipe is used as a sub-recipe by: {names}")
         RecipeDB.delete_recipe(recipe_id)
 
     @staticmethod
@@ -30,54 +35,72 @@ class RecipeLogic:
         return RecipeDB.get_recipe_ingredients(recipe_id)
 
     @staticmethod
-    def add_recipe_ingredient(recipe_id, metadata_id, quantity, unit):
-        # Validate quantity
+    def _to_metadata_unit(metadata_id, quantity, unit):
+        """Convert a recipe quantity to its tag's base unit; returns (quantity, base_unit)."""
         if not isinstance(quantity, (int, float)) or quantity <= 0:
             raise ValueError("Quantity must be a positive number.")
-        # Validate unit against metadata
         from metadata_db import MetadataDB
-        metadata = [m for m in MetadataDB.get_all_metadata() if m[0] == metadata_id]
-        if not metadata:
+        info = MetadataDB.get_unit_info(metadata_id)
+        if not info:
             raise ValueError("Invalid metadata ID.")
-        expected_unit = metadata[0][3]
-        if unit.strip() != expected_unit:
-            raise ValueError(f"Unit must match metadata unit: {expected_unit}")
-        RecipeDB.add_recipe_ingredient(recipe_id, metadata_id, quantity, unit.strip())
+        base, density = info
+        return units.convert(quantity, unit or base, base, density), base
+
+    @staticmethod
+    def add_recipe_ingredient(recipe_id, metadata_id, quantity, unit):
+        # Stored in the tag's base unit so requirement totals are plain SUMs
+        quantity, unit = RecipeLogic._to_metadata_unit(metadata_id, quantity, unit)
+        RecipeDB.add_recipe_ingredient(recipe_id, metadata_id, quantity, unit)
 
     @staticmethod
     def update_recipe_ingredient(ri_id, quantity, unit):
-        # Validate quantity
+        from db import get_connection
+        conn = get_connection()
+        row = conn.execute("SELECT metadata_id FROM recipe_ingredients WHERE id=?", (ri_id,)).fetchone()
+        conn.close()
+        if not row:
+            raise ValueError("Recipe ingredient not found.")
+        quantity, unit = RecipeLogic._to_metadata_unit(row[0], quantity, unit)
+        RecipeDB.update_recipe_ingredient(ri_id, quantity, unit)
+
+    @staticmethod
+    def delete_recipe_ingredient(ri_id):
+        RecipeDB.delete_recipe_ingredient(ri_id)
+
+    @staticmethod
+    def get_recipe_components(recipe_id):
+        return RecipeDB.get_recipe_components(recipe_id)
+
+    @staticmethod
+    def add_recipe_component(recipe_id, component_recipe_id, quantity):
         if not isinstance(quantity, (int, float)) or quantity <= 0:
             raise ValueError("Quantity must be a positive number.")
-        # Get metadata_id for this recipe_ingredient
-        from recipe_db import RecipeDB
-        from metadata_db import MetadataDB
-        # Find the recipe_ingredient row
-        recipe_ingredients = []
-        # Try to get all recipe_ingredients for all recipes (inefficient, but safe for now)
-        # We'll search for the one with ri_id
-        import sqlite3
-        conn = None
-        try:
-            from db import get_connection
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT metadata_id FROM recipe_ingredients WHERE id=?", (ri_id,))
-            row = cur.fetchone()
-            if not row:
-                raise ValueError("Recipe ingredient not found.")
-            metadata_id = row[0]
-        finally:
-            if conn:
-                conn.close()
-        metadata = [m for m in MetadataDB.get_all_metadata() if m[0] == metadata_id]
-        if not metadata:
-            raise ValueError("Invalid metadata ID.")
-        expected_unit = metadata[0][3]
-        if unit.strip() != expected_unit:
-            raise ValueError(f"Unit must match metadata unit: {expected_unit}")
-        RecipeDB.update_recipe_ingredient(ri_id, quantity, unit.strip())
+        if recipe_id == component_recipe_id:
+            raise ValueError("A recipe cannot contain itself.")
+        # The new edge closes a cycle if the component already (indirectly) uses this recipe
+        if RecipeDB.uses_recipe(component_recipe_id, recipe_id):
+            raise ValueError("That recipe already uses this one; adding it would create a cycle.")
+        return RecipeDB.add_recipe_component(recipe_id, component_recipe_id, quantity)
 
     @staticmethod
-    def delete_recipe_ingredient(ri_id):
-        RecipeDB.delete_recipe_ingredient(ri_id)
\ No newline at end of file
+    def update_recipe_component(rc_id, quantity):
+        if not isinstance(quantity, (int, float)) or quantity <= 0:
+            raise ValueError("Quantity must be a positive number.")
+        RecipeDB.update_recipe_component(rc_id, quantity)
+
+    @staticmethod
+    def delete_recipe_component(rc_id):
+        RecipeDB.delete_recipe_component(rc_id)
+
+    @staticmethod
+    def get_recipe_cost(recipe_id, method="average"):
+        """(cost of one batch of the recipe, names of ingredients without a priced purchase)."""
+        from costing_db import CostingDB
+        rows = CostingDB.get_recipe_costs(method, [recipe_id])
+        if not rows:
+            raise ValueError("Recipe not found.")
+        return rows[0]["Cost"], rows[0]["Uncosted"]
+
+    @staticmethod
+    def get_flattened_ingredients(recipe_id):
+        return RecipeDB.get_flattened_ingredients(recipe_id)
@@ -1,6 +1,7 @@
 from PyQt5 import QtWidgets, QtCore
 from recipe_logic import RecipeLogic
 from metadata_db import MetadataDB
+import units
 
 class RecipesPopup(QtWidgets.QWidget):
     def __init__(self):
@@ -31,6 +32,8 @@ class RecipesPopup(QtWidgets.QWidget):
         self.ingredient_list = QtWidgets.QListWidget()
         right_layout.addWidget(QtWidgets.QLabel("Recipe Ingredients (Metadata)"))
         right_layout.addWidget(self.ingredient_list)
+        self.cost_label = QtWidgets.QLabel("")
+        right_layout.addWidget(self.cost_label)
 
         # Ingredient buttons
         for text, func in [("Add Ingredient", self.add_recipe_ingredient),
@@ -40,6 +43,18 @@ class RecipesPopup(QtWidgets.QWidget):
             btn.clicked.connect(func)
             right_layout.addWidget(btn)
 
+        # Sub-recipes used by the selected recipe
+        self.component_list = QtWidgets.QListWidget()
+        right_layout.addWidget(QtWidgets.QLabel("Sub-recipes"))
+        right_layout.addWidget(self.component_list)
+
+        for text, func in [("Add Sub-recipe", self.add_recipe_component),
+                           ("Edit Sub-recipe", self.edit_recipe_component),
+                           ("Delete Sub-recipe", self.delete_recipe_component)]:
+            btn = QtWidgets.QPushButton(text)
+            btn.clicked.connect(func)
+            right_layout.addWidget(btn)
+
         # Combine layouts
         main_layout.addLayout(left_layout, 1)
         main_layout.addLayout(right_layout, 2)
@@ -92,9 +107,15 @@ class RecipesPopup(QtWidgets.QWidget):
         selected = self.recipe_list.currentItem()
         if not selected: return
         recipe_id = selected.data(QtCore.Qt.UserRole)
-        RecipeLogic.delete_recipe(recipe_id)
+        try:
+            RecipeLogic.delete_recipe(recipe_id)
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Error", str(e))
+            return
         self.load_recipes()
         self.ingredient_list.clear()
+        self.component_list.clear()
+        self.cost_label.setText("")
 
     # ------------------ Recipe Ingredients ------------------
     def load_recipe_ingredients(self):
@@ -117,6 +138,9 @@ class RecipesPopup(QtWidgets.QWidget):
             item.setData(QtCore.Qt.UserRole, ing[0])  # recipe_ingredient id
             self.ingredient_list.addItem(item)
 
+        self.load_recipe_components(recipe_id)
+        self.load_recipe_cost(recipe_id)
+
     def add_recipe_ingredient(self):
         selected = self.recipe_list.currentItem()
         if not selected:
@@ -136,13 +160,16 @@ class RecipesPopup(QtWidgets.QWidget):
             return
         metadata_id = metadata_tags[items.index(choice)][0]
         expected_unit = metadata_tags[items.index(choice)][3]
+        density = metadata_tags[items.index(choice)][4]
 
-        qty, ok2 = QtWidgets.QInputDialog.getDouble(self, "Quantity", "Enter quantity:", 1, 0.0)
+        qty, ok2 = QtWidgets.QInputDialog.getDouble(self, "Quantity", "Quantity per batch:", 1, 0.0, decimals=3)
         if not ok2:
             return
 
-        # Show the expected unit (from metadata) and do not ask user to enter it
-        unit = expected_unit
+        # Any unit convertible to the tag's unit; stored converted to the tag's unit
+        unit = self._choose_unit(expected_unit, density)
+        if unit is None:
+            return
 
         try:
             RecipeLogic.add_recipe_ingredient(recipe_id, metadata_id, qty, unit)
@@ -150,12 +177,25 @@ class RecipesPopup(QtWidgets.QWidget):
         except Exception as e:
             QtWidgets.QMessageBox.warning(self, "Error", str(e))
 
+    def _choose_unit(self, expected_unit, density):
+        """Ask which unit a quantity was entered in; None if cancelled."""
+        try:
+            choices = units.compatible_units(expected_unit, density)
+        except ValueError:
+            return expected_unit  # tag unit not in the registry: nothing to convert
+        if len(choices) == 1:
+            return expected_unit
+        unit, ok = QtWidgets.QInputDialog.getItem(
+            self, "Unit", "Quantity is in:", choices, choices.index(units.normalize_unit(expected_unit)), False
+        )
+        return unit if ok else None
+
     def edit_recipe_ingredient(self):
         selected_ing = self.ingredient_list.currentItem()
         if not selected_ing:
             return
         ri_id = selected_ing.data(QtCore.Qt.UserRole)
-        qty, ok = QtWidgets.QInputDialog.getDouble(self, "Quantity", "Enter new quantity:", 1, 0.0)
+        qty, ok = QtWidgets.QInputDialog.getDouble(self, "Quantity", "New quantity per batch:", 1, 0.0, decimals=3)
         if not ok:
             return
         # Get the expected unit from metadata (via logic)
@@ -176,9 +216,12 @@ class RecipesPopup(QtWidgets.QWidget):
                 QtWidgets.QMessageBox.warning(self, "Error", "Metadata not found.")
                 return
             expected_unit = metadata[0][3]
+            density = metadata[0][4]
         finally:
             conn.close()
-        unit = expected_unit
+        unit = self._choose_unit(expected_unit, density)
+        if unit is None:
+            return
         try:
             RecipeLogic.update_recipe_ingredient(ri_id, qty, unit)
             self.load_recipe_ingredients()
@@ -190,4 +233,80 @@ class RecipesPopup(QtWidgets.QWidget):
         if not selected_ing: return
         ri_id = selected_ing.data(QtCore.Qt.UserRole)
         RecipeLogic.delete_recipe_ingredient(ri_id)
-        self.load_recipe_ingredients()
\ No newline at end of file
+        self.load_recipe_ingredients()
+
+    def load_recipe_cost(self, recipe_id):
+        try:
+            cost, uncosted = RecipeLogic.get_recipe_cost(recipe_id)
+        except Exception as e:
+            print("Error costing recipe:", e)
+            self.cost_label.setText("")
+            return
+        text = f"Cost per batch (weighted average of purchases): {cost:.2f}"
+        if uncosted:
+            text += f" – no purchase price for: {', '.join(uncosted)}"
+        self.cost_label.setText(text)
+
+    # ------------------ Sub-recipes ------------------
+    def load_recipe_components(self, recipe_id):
+        self.component_list.clear()
+        try:
+            components = RecipeLogic.get_recipe_components(recipe_id)
+        except Exception as e:
+            print("Error loading sub-recipes:", e)
+            components = []
+
+        for rc in components:
+            item = QtWidgets.QListWidgetItem(f"{rc[4]} – {rc[3]}")
+            item.setData(QtCore.Qt.UserRole, rc[0])  # recipe_component id
+            self.component_list.addItem(item)
+
+    def add_recipe_component(self):
+        selected = self.recipe_list.currentItem()
+        if not selected:
+            return
+        recipe_id = selected.data(QtCore.Qt.UserRole)
+        if recipe_id is None:
+            return
+
+        recipes = [r for r in RecipeLogic.get_all_recipes() if r[0] != recipe_id]
+        if not recipes:
+            QtWidgets.QMessageBox.warning(self, "Error", "No other recipes available.")
+            return
+
+        items = [r[1] for r in recipes]
+        choice, ok = QtWidgets.QInputDialog.getItem(self, "Select Sub-recipe", "Recipe:", items, 0, False)
+        if not ok or choice not in items:
+            return
+        component_id = recipes[items.index(choice)][0]
+
+        qty, ok2 = QtWidgets.QInputDialog.getDouble(self, "Quantity", "Units of the sub-recipe per batch:", 1, 0.0, decimals=3)
+        if not ok2:
+            return
+
+        try:
+            RecipeLogic.add_recipe_component(recipe_id, component_id, qty)
+            self.load_recipe_ingredients()
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Error", str(e))
+
+    def edit_recipe_component(self):
+        selected = self.component_list.currentItem()
+        if not selected:
+            return
+        rc_id = selected.data(QtCore.Qt.UserRole)
+        qty, ok = QtWidgets.QInputDialog.getDouble(self, "Quantity", "Units of the sub-recipe per batch:", 1, 0.0, decimals=3)
+        if not ok:
+            return
+        try:
+            RecipeLogic.update_recipe_component(rc_id, qty)
+            self.load_recipe_ingredients()
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Error", str(e))
+
+    def delete_recipe_component(self):
+        selected = self.component_list.currentItem()
+        if not selected: return
+        rc_id = selected.data(QtCore.Qt.UserRole)
+        RecipeLogic.delete_recipe_component(rc_id)
+        self.load_recipe_ingredients()
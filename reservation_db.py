@@ -1,32 +1,67 @@
-from db import get_connection
+import sqlite3
+from db import get_connection, transaction, chunked
+from Stock_db import StockDB
+from datetime import datetime, timedelta
+
+# Reservation time-to-live. A reservation is held until RESERVATION_GRACE_DAYS
+# after its order's delivery date, but never for less than RESERVATION_HOLD_DAYS
+# from when it was made (which also covers orders without a delivery date).
+# Once reserved_until has passed, release_lapsed() hands the stock back.
+RESERVATION_HOLD_DAYS = 14
+RESERVATION_GRACE_DAYS = 2
+
+# Orders in these statuses have used the stock they reserved. Their reservations are a
+# record of consumption: they never lapse or go back to stock, and are not on hand.
+FULFILLED_ORDER_STATUSES = ("Order Completed", "Shipped", "Closed")
+
+# FULFILLED_ORDER_STATUSES as an SQL list, for `status NOT IN (...)` filters on orders
+FULFILLED_STATUSES_SQL = ", ".join(f"'{s}'" for s in FULFILLED_ORDER_STATUSES)
+
+# Line items of fulfilled orders, for `lineitem_id NOT IN (...)` filters on reservations
+FULFILLED_LINE_ITEMS_SQL = f"""
+    SELECT li.id FROM line_items li JOIN orders o ON o.id = li.order_id
+    WHERE o.status IN ({FULFILLED_STATUSES_SQL})
+"""
 
 class ReservationDB:
     @staticmethod
     def get_reserved_qty_for_order(order_id, metadata_id):
         """Return the total reserved quantity for a given order and metadata_id (ingredient)."""
-        from line_item_db import LineItemDB
         conn = get_connection()
         cursor = conn.cursor()
-        # Get all lineitem_ids for this order
-        lineitems = LineItemDB.get_order_items(order_id)
-        lineitem_ids = [li[0] for li in lineitems]
-        if not lineitem_ids:
-            conn.close()
-            return 0
-        # Join reservations -> stock -> ingredients to filter by metadata_id
-        q = f'''
-            SELECT SUM(r.qty)
-            FROM reservations r
-            JOIN stock s ON r.ingredient_stock_id = s.id
-            JOIN ingredients i ON s.ingredient_id = i.id
-            WHERE r.lineitem_id IN ({','.join(['?']*len(lineitem_ids))})
-              AND i.metadata_id = ?
-        '''
-        params = lineitem_ids + [metadata_id]
-        cursor.execute(q, params)
+        cursor.execute(
+            "SELECT quantity FROM reservation_totals WHERE order_id = ? AND metadata_id = ?",
+            (order_id, metadata_id)
+        )
         row = cursor.fetchone()
         conn.close()
         return row[0] if row and row[0] is not None else 0
+
+    @staticmethod
+    def get_reserved_qty_for_orders(order_ids=None):
+        """
+        Reserved quantity per ingredient (metadata_id) for many orders, read from reservation_totals.
+        Pass None for every order.
+        Returns a dict: {order_id: {metadata_id: reserved_qty}}
+        """
+        query = "SELECT order_id, metadata_id, quantity FROM reservation_totals {where}"
+        conn = get_connection()
+        cursor = conn.cursor()
+        rows = []
+        if order_ids is None:
+            cursor.execute(query.format(where=""))
+            rows = cursor.fetchall()
+        else:
+            for chunk in chunked(order_ids):
+                where = f"WHERE order_id IN ({','.join(['?'] * len(chunk))})"
+                cursor.execute(query.format(where=where), chunk)
+                rows.extend(cursor.fetchall())
+        conn.close()
+        reserved = {}
+        for order_id, metadata_id, qty in rows:
+            reserved.setdefault(order_id, {})[metadata_id] = qty
+        return reserved
+
     @staticmethod
     def init_reservations_db(conn):
         """
@@ -49,10 +84,221 @@ class ReservationDB:
         ''')
         conn.commit()
 
+    @staticmethod
+    def init_reservation_totals(conn):
+        """
+        Create the reserved-quantity rollup and the triggers that keep it current.
+        reservation_totals holds SUM(reservations.qty) per (order_id, metadata_id), i.e. the
+        reservations -> line_items -> stock -> ingredients join, so reading what an order
+        holds is a primary-key lookup however many reservations have piled up.
+        Every table on that join path has triggers, so re-pointing a line item, batch or
+        ingredient moves its reservations to the right key.
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reservation_totals (
+                order_id INTEGER NOT NULL,
+                metadata_id INTEGER NOT NULL,
+                quantity REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (order_id, metadata_id)
+            )
+        ''')
+        # Add/subtract SUM(r.qty) of the reservations selected by `where`, grouped by key
+        delta = '''
+            INSERT INTO reservation_totals (order_id, metadata_id, quantity)
+            SELECT {order}, {metadata}, {sign}SUM(r.qty)
+            FROM reservations r
+            JOIN line_items li ON li.id = r.lineitem_id
+            JOIN stock s ON s.id = r.ingredient_stock_id
+            JOIN ingredients i ON i.id = {ingredient}
+            WHERE {where}
+            GROUP BY 1, 2
+            ON CONFLICT(order_id, metadata_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+        '''
+
+        def add(sign="", *, where, order="li.order_id", metadata="i.metadata_id", ingredient="s.ingredient_id"):
+            return delta.format(sign=sign, order=order, metadata=metadata, ingredient=ingredient, where=where)
+
+        triggers = {
+            "trg_reservation_totals_insert": (
+                "AFTER INSERT ON reservations",
+                add(where="r.id = NEW.id"),
+            ),
+            # The row is already gone, so subtract it directly instead of through the join
+            "trg_reservation_totals_delete": (
+                "AFTER DELETE ON reservations",
+                '''
+                UPDATE reservation_totals SET quantity = quantity - OLD.qty
+                WHERE order_id = (SELECT order_id FROM line_items WHERE id = OLD.lineitem_id)
+                  AND metadata_id = (
+                      SELECT i.metadata_id FROM stock s JOIN ingredients i ON i.id = s.ingredient_id
+                      WHERE s.id = OLD.ingredient_stock_id
+                  );
+                ''',
+            ),
+            "trg_reservation_totals_update": (
+                "AFTER UPDATE OF qty, lineitem_id, ingredient_stock_id ON reservations",
+                '''
+                UPDATE reservation_totals SET quantity = quantity - OLD.qty
+                WHERE order_id = (SELECT order_id FROM line_items WHERE id = OLD.lineitem_id)
+                  AND metadata_id = (
+                      SELECT i.metadata_id FROM stock s JOIN ingredients i ON i.id = s.ingredient_id
+                      WHERE s.id = OLD.ingredient_stock_id
+                  );
+                ''' + add(where="r.id = NEW.id"),
+            ),
+            "trg_reservation_totals_lineitem_move": (
+                "AFTER UPDATE OF order_id ON line_items WHEN OLD.order_id IS NOT NEW.order_id",
+                add("-", order="OLD.order_id", where="r.lineitem_id = NEW.id")
+                + add(order="NEW.order_id", where="r.lineitem_id = NEW.id"),
+            ),
+            "trg_reservation_totals_lineitem_delete": (
+                "BEFORE DELETE ON line_items",
+                add("-", where="r.lineitem_id = OLD.id"),
+            ),
+            "trg_reservation_totals_stock_move": (
+                "AFTER UPDATE OF ingredient_id ON stock WHEN OLD.ingredient_id IS NOT NEW.ingredient_id",
+                add("-", ingredient="OLD.ingredient_id", where="r.ingredient_stock_id = NEW.id")
+                + add(where="r.ingredient_stock_id = NEW.id"),
+            ),
+            "trg_reservation_totals_stock_delete": (
+                "BEFORE DELETE ON stock",
+                add("-", where="r.ingredient_stock_id = OLD.id"),
+            ),
+            "trg_reservation_totals_retag": (
+                "AFTER UPDATE OF metadata_id ON ingredients WHEN OLD.metadata_id IS NOT NEW.metadata_id",
+                add("-", metadata="OLD.metadata_id", where="s.ingredient_id = NEW.id")
+                + add(where="s.ingredient_id = NEW.id"),
+            ),
+            "trg_reservation_totals_ingredient_delete": (
+                "BEFORE DELETE ON ingredients",
+                add("-", where="s.ingredient_id = OLD.id"),
+            ),
+        }
+        for name, (event, body) in triggers.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+        ReservationDB.rebuild_totals()
+        conn.commit()
+
+    @staticmethod
+    def rebuild_totals():
+        """Recompute reservation_totals from the reservations table (recovery; also run by the migration)."""
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM reservation_totals")
+            cur.execute('''
+                INSERT INTO reservation_totals (order_id, metadata_id, quantity)
+                SELECT li.order_id, i.metadata_id, SUM(r.qty)
+                FROM reservations r
+                JOIN line_items li ON li.id = r.lineitem_id
+                JOIN stock s ON s.id = r.ingredient_stock_id
+                JOIN ingredients i ON i.id = s.ingredient_id
+                GROUP BY li.order_id, i.metadata_id
+            ''')
+
+    @staticmethod
+    def verify_totals(tolerance=1e-6):
+        """
+        Compare reservation_totals with a fresh aggregate over reservations.
+        Returns a list of (kind, key, stored, actual) for every mismatch; empty means consistent.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            WITH actual AS (
+                SELECT li.order_id, i.metadata_id, SUM(r.qty) AS qty
+                FROM reservations r
+                JOIN line_items li ON li.id = r.lineitem_id
+                JOIN stock s ON s.id = r.ingredient_stock_id
+                JOIN ingredients i ON i.id = s.ingredient_id
+                GROUP BY li.order_id, i.metadata_id
+            )
+            SELECT a.order_id, a.metadata_id, COALESCE(t.quantity, 0), a.qty
+            FROM actual a
+            LEFT JOIN reservation_totals t ON t.order_id = a.order_id AND t.metadata_id = a.metadata_id
+            UNION ALL
+            SELECT t.order_id, t.metadata_id, t.quantity, 0
+            FROM reservation_totals t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM actual a WHERE a.order_id = t.order_id AND a.metadata_id = t.metadata_id
+            )
+        ''')
+        rows = cur.fetchall()
+        conn.close()
+        return [
+            ("reservation", (order_id, metadata_id), stored, actual)
+            for order_id, metadata_id, stored, actual in rows
+            if abs(stored - actual) > tolerance
+        ]
+
+    @staticmethod
+    def init_reservation_ttl(conn):
+        """
+        Index reserved_until for the lapse sweep and give every existing reservation of an
+        order that is not yet fulfilled a TTL.
+        """
+        cursor = conn.cursor()
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservations_until ON reservations(reserved_until)")
+        hold = ReservationDB._hold_until()
+        cursor.execute(f'''
+            UPDATE reservations
+            SET reserved_until = COALESCE((
+                SELECT max(COALESCE(date(o.delivery_date, ?) || 'T23:59:59', ?), ?)
+                FROM line_items li
+                JOIN orders o ON o.id = li.order_id
+                WHERE li.id = reservations.lineitem_id
+            ), ?)
+            WHERE reserved_until IS NULL AND lineitem_id NOT IN ({FULFILLED_LINE_ITEMS_SQL})
+        ''', (f"+{RESERVATION_GRACE_DAYS} days", hold, hold, hold))
+        conn.commit()
+
+    @staticmethod
+    def _hold_until(now=None):
+        return ((now or datetime.now()) + timedelta(days=RESERVATION_HOLD_DAYS)).isoformat(timespec="seconds")
+
+    @staticmethod
+    def reserved_until_for_orders(conn, order_ids, now=None):
+        """
+        The reserved_until to give new reservations of each order: the end of the day
+        RESERVATION_GRACE_DAYS after delivery, or the hold period if that is later.
+        Returns {order_id: ISO timestamp}.
+        """
+        hold = ReservationDB._hold_until(now)
+        until = {order_id: hold for order_id in order_ids}
+        cursor = conn.cursor()
+        for chunk in chunked(list(until)):
+            cursor.execute(
+                f"SELECT id, date(delivery_date, ?) FROM orders WHERE id IN ({','.join(['?'] * len(chunk))})",
+                (f"+{RESERVATION_GRACE_DAYS} days", *chunk)
+            )
+            for order_id, last_day in cursor.fetchall():
+                if last_day:
+                    until[order_id] = max(last_day + "T23:59:59", hold)
+        return until
+
+    @staticmethod
+    def release_lapsed(now=None):
+        """
+        Release every reservation whose reserved_until has passed back to stock, in one
+        transaction; the ledger books these as 'lapsed'. Reservations flagged 'expired'
+        (their batch was written off) are left alone. Cheap to call on a timer.
+        Returns the number of reservations released.
+        """
+        now = (now or datetime.now()).isoformat(timespec="seconds")
+        with StockDB.movement("lapsed") as conn:
+            return ReservationDB._release_where(
+                conn, "reserved_until < ? AND COALESCE(status, 'active') <> 'expired'", (now,)
+            )
+
     @staticmethod
     def add_reservation(lineitem_id, ingredient_stock_id, qty, status='active', reserved_until=None):
         conn = get_connection()
         cursor = conn.cursor()
+        if reserved_until is None:
+            cursor.execute("SELECT order_id FROM line_items WHERE id=?", (lineitem_id,))
+            row = cursor.fetchone()
+            order_id = row[0] if row else None
+            reserved_until = ReservationDB.reserved_until_for_orders(conn, [order_id])[order_id]
         cursor.execute(
             'INSERT INTO reservations (lineitem_id, ingredient_stock_id, qty, status, reserved_until) VALUES (?, ?, ?, ?, ?)',
             (lineitem_id, ingredient_stock_id, qty, status, reserved_until)
@@ -138,4 +384,71 @@ class ReservationDB:
             (reservation_id,)
         )
         conn.commit()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    @staticmethod
+    def _release_where(conn, where, params):
+        """
+        Return the reserved quantities selected by `where` to their stock batches with one
+        grouped UPDATE, then delete those reservations. Reservations of fulfilled orders are
+        never selected: that stock has been used. Returns the number released.
+        """
+        where = f"({where}) AND lineitem_id NOT IN ({FULFILLED_LINE_ITEMS_SQL})"
+        cursor = conn.cursor()
+        now = datetime.now().isoformat()
+        if sqlite3.sqlite_version_info >= (3, 33, 0):
+            cursor.execute(f'''
+                UPDATE stock
+                SET quantity = stock.quantity + r.total, last_updated = ?
+                FROM (
+                    SELECT ingredient_stock_id, SUM(qty) AS total
+                    FROM reservations
+                    WHERE {where}
+                    GROUP BY ingredient_stock_id
+                ) AS r
+                WHERE stock.id = r.ingredient_stock_id
+            ''', (now, *params))
+        else:
+            # UPDATE ... FROM needs SQLite 3.33; older builds use a correlated subquery
+            cursor.execute(f'''
+                UPDATE stock
+                SET quantity = quantity + (
+                        SELECT SUM(qty) FROM reservations
+                        WHERE ingredient_stock_id = stock.id AND {where}
+                    ),
+                    last_updated = ?
+                WHERE id IN (SELECT ingredient_stock_id FROM reservations WHERE {where})
+            ''', (*params, now, *params))
+        cursor.execute(f"DELETE FROM reservations WHERE {where}", params)
+        return cursor.rowcount
+
+    @staticmethod
+    def release_order_reservations(order_id):
+        """Release every reservation held by an order's line items in one transaction."""
+        with StockDB.movement("release", "order", order_id) as conn:
+            return ReservationDB._release_where(
+                conn, "lineitem_id IN (SELECT id FROM line_items WHERE order_id = ?)", (order_id,)
+            )
+
+    @staticmethod
+    def release_lineitem_reservations(lineitem_ids):
+        """Release every reservation of one line item id or a list of them, in one transaction."""
+        if isinstance(lineitem_ids, int):
+            lineitem_ids = [lineitem_ids]
+        released = 0
+        with StockDB.movement("release") as conn:
+            for chunk in chunked(lineitem_ids):
+                where = f"lineitem_id IN ({','.join(['?'] * len(chunk))})"
+                released += ReservationDB._release_where(conn, where, tuple(chunk))
+        return released
+
+    @staticmethod
+    def release_reservations(reservation_ids):
+        """Release specific reservations (e.g. rows selected in the Reservations tab) in one transaction."""
+        released = 0
+        reference_id = reservation_ids[0] if len(reservation_ids) == 1 else None
+        with StockDB.movement("release", "reservation" if reference_id else None, reference_id) as conn:
+            for chunk in chunked(reservation_ids):
+                where = f"id IN ({','.join(['?'] * len(chunk))})"
+                released += ReservationDB._release_where(conn, where, tuple(chunk))
+        return released
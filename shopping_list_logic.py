@@ -0,0 +1,72 @@
+from db import get_connection
+from recipe_db import RecipeDB, LINE_ITEM_BATCHES_SQL
+from reservation_db import FULFILLED_STATUSES_SQL
+
+
+class ShoppingListLogic:
+    """
+    Works out what has to be bought to fulfil the open orders.
+    Plain Python with no Qt dependency; the Shopping List tab only renders the result.
+    """
+
+    @staticmethod
+    def get_shopping_list(include_closed=False):
+        """
+        Shortage per ingredient (metadata_id) across all open orders (not yet shipped,
+        completed or closed; include_closed counts those too):
+        shortage = required - reserved for those orders - available in stock.
+        Everything is aggregated in SQL from one query returning a row per
+        (ingredient, order); the Python pass only folds those rows together.
+        Returns a list of dicts, sorted by ingredient name, for ingredients with a shortage:
+        {"MetadataID", "Name", "Unit", "Required", "Reserved", "Available", "Shortage", "Orders"}
+        """
+        order_filter = "" if include_closed else f"WHERE status NOT IN ({FULFILLED_STATUSES_SQL})"
+        RecipeDB.refresh_bom()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            WITH open_orders AS (
+                SELECT id FROM orders {order_filter}
+            ),
+            need AS (
+                SELECT li.order_id, b.metadata_id, SUM(b.quantity * {LINE_ITEM_BATCHES_SQL}) AS qty
+                FROM line_items li
+                JOIN open_orders o ON o.id = li.order_id
+                JOIN recipes r ON r.id = li.recipe_id
+                JOIN recipe_bom b ON b.recipe_id = li.recipe_id
+                GROUP BY li.order_id, b.metadata_id
+            )
+            SELECT n.metadata_id, m.name, m.unit, n.order_id, n.qty,
+                   COALESCE(h.quantity, 0), COALESCE(a.quantity, 0)
+            FROM need n
+            JOIN metadata m ON m.id = n.metadata_id
+            LEFT JOIN reservation_totals h ON h.order_id = n.order_id AND h.metadata_id = n.metadata_id
+            LEFT JOIN stock_metadata_totals a ON a.metadata_id = n.metadata_id
+            ORDER BY m.name, n.order_id
+        """)
+        rows = cur.fetchall()
+        conn.close()
+
+        summary = {}
+        for metadata_id, name, unit, order_id, required, reserved, available in rows:
+            entry = summary.get(metadata_id)
+            if entry is None:
+                entry = summary[metadata_id] = {
+                    "MetadataID": metadata_id,
+                    "Name": name,
+                    "Unit": unit,
+                    "Required": 0,
+                    "Reserved": 0,
+                    "Available": available,
+                    "Orders": [],
+                }
+            entry["Required"] += required
+            entry["Reserved"] += reserved
+            entry["Orders"].append(order_id)
+
+        shopping_list = []
+        for entry in summary.values():
+            entry["Shortage"] = entry["Required"] - entry["Reserved"] - entry["Available"]
+            if entry["Shortage"] > 0:
+                shopping_list.append(entry)
+        return shopping_list
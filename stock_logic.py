@@ -1,4 +1,6 @@
 from Stock_db import StockDB
+from ingredient_db import IngredientDB
+from ingredient_logic import IngredientLogic
 
 class StockLogic:
     @staticmethod
@@ -6,15 +8,33 @@ class StockLogic:
         return StockDB.get_stock(ingredient_id)
 
     @staticmethod
-    def add_stock(ingredient_id, quantity):
+    def _in_base_unit(ingredient_id, quantity, unit):
+        if unit is None:
+            return quantity
+        ingredient = IngredientDB.get_ingredient_by_id(ingredient_id)
+        if not ingredient:
+            raise ValueError("Invalid ingredient ID.")
+        return IngredientLogic.size_in_base_unit(quantity, ingredient["MetadataID"], unit)
+
+    @staticmethod
+    def add_stock(ingredient_id, quantity, unit=None):
+        """quantity is in the ingredient's base unit unless unit says otherwise."""
         if not isinstance(quantity, (int, float)) or quantity <= 0:
             raise ValueError("Quantity must be a positive number.")
-        return StockDB.add_stock(ingredient_id, quantity)
+        return StockDB.add_stock(ingredient_id, StockLogic._in_base_unit(ingredient_id, quantity, unit))
 
     @staticmethod
-    def update_stock(stock_id, quantity):
+    def update_stock(stock_id, quantity, unit=None):
         if not isinstance(quantity, (int, float)) or quantity <= 0:
             raise ValueError("Quantity must be a positive number.")
+        if unit is not None:
+            from db import get_connection
+            conn = get_connection()
+            row = conn.execute("SELECT ingredient_id FROM stock WHERE id=?", (stock_id,)).fetchone()
+            conn.close()
+            if not row:
+                raise ValueError("Stock batch not found.")
+            quantity = StockLogic._in_base_unit(row[0], quantity, unit)
         return StockDB.update_stock(stock_id, quantity)
 
     @staticmethod
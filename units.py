@@ -0,0 +1,103 @@
+import re
+
+# Unit registry. Every quantity in the database (stock, ingredient sizes,
+# reservations, recipe ingredients) is stored in the base unit of its metadata
+# tag, so SUMs over stock and requirement totals are plain numeric SQL; units
+# are only converted when a value is written or shown.
+#
+# Each unit maps to (dimension, factor to that dimension's base unit).
+BASE_UNITS = {"mass": "g", "volume": "ml", "count": "pcs"}
+
+UNITS = {
+    # mass, base g
+    "g": ("mass", 1.0),
+    "mg": ("mass", 0.001),
+    "kg": ("mass", 1000.0),
+    "oz": ("mass", 28.349523125),
+    "lb": ("mass", 453.59237),
+    # volume, base ml
+    "ml": ("volume", 1.0),
+    "cl": ("volume", 10.0),
+    "dl": ("volume", 100.0),
+    "l": ("volume", 1000.0),
+    "tsp": ("volume", 5.0),
+    "tbsp": ("volume", 15.0),
+    "cup": ("volume", 250.0),
+    # count, base pcs
+    "pcs": ("count", 1.0),
+    "dozen": ("count", 12.0),
+}
+
+ALIASES = {
+    "gram": "g", "grams": "g", "gr": "g",
+    "kilogram": "kg", "kilograms": "kg", "kilo": "kg", "kilos": "kg",
+    "milligram": "mg", "milligrams": "mg",
+    "ounce": "oz", "ounces": "oz",
+    "pound": "lb", "pounds": "lb", "lbs": "lb",
+    "millilitre": "ml", "milliliter": "ml", "millilitres": "ml", "milliliters": "ml", "mls": "ml",
+    "litre": "l", "liter": "l", "litres": "l", "liters": "l", "ltr": "l",
+    "teaspoon": "tsp", "teaspoons": "tsp",
+    "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "cups": "cup",
+    "pc": "pcs", "piece": "pcs", "pieces": "pcs", "each": "pcs", "ea": "pcs", "unit": "pcs", "units": "pcs",
+    "dozens": "dozen", "doz": "dozen",
+}
+
+_QUANTITY = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)\s*([^\d\s].*)?$")
+
+
+def normalize_unit(unit):
+    """Canonical registry name for a unit string ('Grams' -> 'g'); ValueError if unknown."""
+    key = (unit or "").strip().lower().rstrip(".")
+    key = ALIASES.get(key, key)
+    if key not in UNITS:
+        raise ValueError(f"Unknown unit '{unit}'. Known units: {', '.join(UNITS)}")
+    return key
+
+
+def dimension(unit):
+    return UNITS[normalize_unit(unit)][0]
+
+
+def base_unit(unit):
+    """The unit quantities of this unit's dimension are stored in ('kg' -> 'g')."""
+    return BASE_UNITS[dimension(unit)]
+
+
+def convert(quantity, from_unit, to_unit, density=None):
+    """
+    Convert quantity between units. Mass and volume convert through density
+    (grams per millilitre), which only some metadata tags have; without it a
+    g <-> ml conversion raises ValueError, as does any conversion to or from a count.
+    """
+    from_dim, from_factor = UNITS[normalize_unit(from_unit)]
+    to_dim, to_factor = UNITS[normalize_unit(to_unit)]
+    base_qty = quantity * from_factor
+    if from_dim != to_dim:
+        if {from_dim, to_dim} != {"mass", "volume"}:
+            raise ValueError(f"Cannot convert {from_unit} to {to_unit}.")
+        if not density or density <= 0:
+            raise ValueError(f"Converting {from_unit} to {to_unit} needs a density for this ingredient.")
+        base_qty = base_qty * density if from_dim == "volume" else base_qty / density
+    return base_qty / to_factor
+
+
+def compatible_units(unit, density=None):
+    """Units a quantity stored in `unit` can be entered in (mass and volume together when density is known)."""
+    dims = {dimension(unit)}
+    if density and dims & {"mass", "volume"}:
+        dims = {"mass", "volume"}
+    return [name for name, (dim, _) in UNITS.items() if dim in dims]
+
+
+def parse_quantity(text):
+    """
+    Split user input such as '2.5 kg' or '500' into (value, unit or None).
+    Raises ValueError for anything that is not a number optionally followed by a unit.
+    """
+    match = _QUANTITY.match(text or "")
+    if not match:
+        raise ValueError(f"Not a quantity: '{text}'")
+    value = float(match.group(1).replace(",", "."))
+    unit = match.group(2)
+    return value, normalize_unit(unit) if unit else None
@@ -0,0 +1,187 @@
+from datetime import date, datetime
+
+from db import snapshot
+from Stock_db import StockDB
+from reservation_db import FULFILLED_LINE_ITEMS_SQL
+
+# Ledger movements that move stock between free and reserved without it leaving the building
+_RESERVATION_MOVEMENTS = ("reservation", "release", "lapsed")
+
+
+class InventoryValuation:
+    """
+    Value of stock on hand, FIFO: what is left of an ingredient is assumed to be
+    its most recent purchases, each valued at that purchase's net cost per base unit.
+
+    Stock on hand includes reserved quantities (reserving takes stock out of
+    stock.quantity but it is still on the shelf), except those of fulfilled orders,
+    which have been used. A batch linked to its purchase
+    through stock.purchase_id is its own cost layer; stock not linked to a purchase
+    is covered by the ingredient's unlinked purchases, newest first. Only as many
+    purchases are read per ingredient as it takes to cover what is on hand, so the
+    length of the purchase history does not matter.
+    """
+
+    @staticmethod
+    def value(as_of=None):
+        """
+        Inventory value now, or at the end of as_of (a date, datetime or ISO string),
+        e.g. the last day of the month. Past quantities come from the stock ledger.
+        Returns {"AsOf", "Total", "Unvalued", "ByMetadata"}; ByMetadata is a list sorted by
+        name of {"MetadataID", "Name", "Unit", "Quantity", "Value", "Unvalued"}, where
+        Unvalued is quantity on hand with no priced purchase to cost it.
+        """
+        bound = StockDB._ledger_time(as_of) if as_of is not None else None
+        with snapshot() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, metadata_id, size FROM ingredients")
+            ingredients = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+            cur.execute("SELECT id, name, unit FROM metadata")
+            tags = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+            if bound is None:
+                linked, unlinked = InventoryValuation._current_layers(cur, ingredients)
+            else:
+                # Past batch links are not kept, so everything is layered from purchases
+                linked, unlinked = {}, InventoryValuation._quantities_as_of(cur, as_of, bound)
+
+            by_tag = {}
+            for ingredient_id, (metadata_id, size) in ingredients.items():
+                value, quantity, unvalued = linked.get(ingredient_id, (0.0, 0.0, 0.0))
+                remaining = unlinked.get(ingredient_id, 0.0)
+                if remaining > 0:
+                    fifo_value, fifo_unvalued = InventoryValuation._fifo(
+                        conn, ingredient_id, size, remaining, bound, skip_linked=bound is None
+                    )
+                    value += fifo_value
+                    quantity += remaining
+                    unvalued += fifo_unvalued
+                if quantity <= 0:
+                    continue
+                entry = by_tag.setdefault(metadata_id, {"Quantity": 0.0, "Value": 0.0, "Unvalued": 0.0})
+                entry["Quantity"] += quantity
+                entry["Value"] += value
+                entry["Unvalued"] += unvalued
+
+        rows = []
+        for metadata_id, entry in by_tag.items():
+            name, unit = tags.get(metadata_id, ("Unknown", ""))
+            rows.append(dict(entry, MetadataID=metadata_id, Name=name, Unit=unit))
+        rows.sort(key=lambda r: (r["Name"] or "", r["MetadataID"]))
+        if isinstance(as_of, (date, datetime)):
+            as_of = as_of.isoformat()
+        return {
+            "AsOf": as_of,
+            "Total": sum(r["Value"] for r in rows),
+            "Unvalued": sum(r["Unvalued"] for r in rows),
+            "ByMetadata": rows,
+        }
+
+    @staticmethod
+    def _current_layers(cur, ingredients):
+        """
+        Live batches plus what open orders have reserved from them, in one pass over the
+        stock that is still on hand. Returns ({ingredient_id: (value, quantity, unvalued)} for
+        batches linked to a purchase, {ingredient_id: quantity} for the rest).
+        """
+        cur.execute(f"""
+            WITH held AS (
+                SELECT ingredient_stock_id AS stock_id, SUM(qty) AS qty
+                FROM reservations
+                WHERE lineitem_id NOT IN ({FULFILLED_LINE_ITEMS_SQL})
+                GROUP BY ingredient_stock_id
+            ),
+            on_hand AS (
+                SELECT s.id, s.ingredient_id, s.purchase_id, s.quantity + COALESCE(h.qty, 0) AS qty
+                FROM stock s
+                LEFT JOIN held h ON h.stock_id = s.id
+                WHERE s.quantity > 0 OR h.qty > 0
+            )
+            SELECT o.ingredient_id, o.qty, p.id, p.price, p.discount, p.quantity
+            FROM on_hand o
+            LEFT JOIN ingredient_purchases p ON p.id = o.purchase_id AND p.ingredient_id = o.ingredient_id
+        """)
+        linked = {}
+        unlinked = {}
+        for ingredient_id, qty, purchase_id, price, discount, packs in cur:
+            if purchase_id is None:
+                unlinked[ingredient_id] = unlinked.get(ingredient_id, 0.0) + qty
+                continue
+            size = ingredients.get(ingredient_id, (None, 0))[1]
+            value, quantity, unvalued = linked.get(ingredient_id, (0.0, 0.0, 0.0))
+            if price is None or not packs or not size:
+                unvalued += qty
+            else:
+                value += qty * (price - (discount or 0)) / (packs * size)
+            linked[ingredient_id] = (value, quantity + qty, unvalued)
+        return linked, unlinked
+
+    @staticmethod
+    def _quantities_as_of(cur, as_of, bound):
+        """
+        Stock on hand per ingredient at bound: the ledger balance (free stock) plus what
+        was reserved then. Reserved at bound = reserved now, plus the reservation movements
+        booked after bound (reserving books a negative movement, releasing a positive one).
+        Order status history is not kept, so a fulfilled order's reservation made by bound
+        counts as used by then; one made after bound is counted so that it cancels its
+        own reservation movement.
+        """
+        on_hand = StockDB.get_balances_as_of(as_of)
+        cur.execute(f"""
+            SELECT s.ingredient_id, SUM(r.qty)
+            FROM reservations r
+            JOIN stock s ON s.id = r.ingredient_stock_id
+            WHERE r.lineitem_id NOT IN ({FULFILLED_LINE_ITEMS_SQL})
+               OR strftime('%Y-%m-%dT%H:%M:%f', r.reserved_at, 'localtime') > ?
+            GROUP BY s.ingredient_id
+        """, (bound,))
+        for ingredient_id, qty in cur.fetchall():
+            on_hand[ingredient_id] = on_hand.get(ingredient_id, 0.0) + qty
+        # Movements after bound all follow the newest snapshot taken at or before it
+        cur.execute(
+            "SELECT COALESCE(MAX(movement_id), 0) FROM stock_snapshots WHERE taken_at <= ?", (bound,)
+        )
+        after_id = cur.fetchone()[0]
+        cur.execute(f"""
+            SELECT ingredient_id, SUM(quantity)
+            FROM stock_movements
+            WHERE id > ? AND created_at > ?
+              AND movement_type IN ({','.join(['?'] * len(_RESERVATION_MOVEMENTS))})
+            GROUP BY ingredient_id
+        """, (after_id, bound, *_RESERVATION_MOVEMENTS))
+        for ingredient_id, qty in cur.fetchall():
+            on_hand[ingredient_id] = on_hand.get(ingredient_id, 0.0) + qty
+        return on_hand
+
+    @staticmethod
+    def _fifo(conn, ingredient_id, size, quantity, bound=None, skip_linked=False):
+        """
+        Value `quantity` of an ingredient from its newest purchases made by bound, reading
+        purchases only until the quantity is covered. skip_linked leaves out purchases whose
+        batch was already valued on its own. Returns (value, unvalued).
+        """
+        linked_filter = "AND NOT EXISTS (SELECT 1 FROM stock s WHERE s.purchase_id = p.id)" if skip_linked else ""
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT p.quantity, p.price, p.discount
+            FROM ingredient_purchases p
+            WHERE p.ingredient_id = ? AND (? IS NULL OR p.date <= ?)
+              {linked_filter}
+            ORDER BY p.date DESC, p.id DESC
+        """, (ingredient_id, bound, bound))
+        value = 0.0
+        unvalued = 0.0
+        for packs, price, discount in cur:
+            if quantity <= 0:
+                break
+            layer = (packs or 0) * (size or 0)
+            if layer <= 0:
+                continue
+            take = min(layer, quantity)
+            if price is None:
+                unvalued += take
+            else:
+                value += take * (price - (discount or 0)) / layer
+            quantity -= take
+        cur.close()
+        return value, unvalued + max(quantity, 0.0)